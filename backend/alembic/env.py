@@ -10,7 +10,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from app.database import Base
 from app.config import settings
-from app.models import User, Email, Contact, Task, OngoingInstruction
+from app.models import User, Email, Contact, Task, OngoingInstruction, SyncStatus
 
 # this is the Alembic Config object
 config = context.config
@@ -64,8 +64,14 @@ def upgrade() -> None:
     op.create_index(op.f('ix_emails_thread_id'), 'emails', ['thread_id'], unique=False)
     op.create_index(op.f('ix_emails_from_email'), 'emails', ['from_email'], unique=False)
     
-    # Add vector embedding column using raw SQL
-    op.execute("ALTER TABLE emails ADD COLUMN embedding vector(1536)")
+    # Add half-precision vector embedding column using raw SQL
+    op.execute("ALTER TABLE emails ADD COLUMN embedding halfvec(1536)")
+    
+    # HNSW index for cosine-distance semantic search (ORDER BY embedding <=> :q LIMIT k)
+    op.execute(
+        "CREATE INDEX ix_emails_embedding_hnsw ON emails "
+        "USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
     
     # Create contacts table
     op.create_table(
@@ -89,8 +95,14 @@ def upgrade() -> None:
     op.create_index(op.f('ix_contacts_id'), 'contacts', ['id'], unique=False)
     op.create_index(op.f('ix_contacts_email'), 'contacts', ['email'], unique=False)
     
-    # Add vector embedding column using raw SQL
-    op.execute("ALTER TABLE contacts ADD COLUMN embedding vector(1536)")
+    # Add half-precision vector embedding column using raw SQL
+    op.execute("ALTER TABLE contacts ADD COLUMN embedding halfvec(1536)")
+    
+    # HNSW index for cosine-distance semantic search
+    op.execute(
+        "CREATE INDEX ix_contacts_embedding_hnsw ON contacts "
+        "USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
     
     # Create tasks table
     op.create_table(
@@ -131,10 +143,12 @@ def downgrade() -> None:
     op.drop_table('ongoing_instructions')
     op.drop_index(op.f('ix_tasks_id'), table_name='tasks')
     op.drop_table('tasks')
+    op.execute("DROP INDEX IF EXISTS ix_contacts_embedding_hnsw")
     op.drop_index(op.f('ix_contacts_email'), table_name='contacts')
     op.drop_index(op.f('ix_contacts_id'), table_name='contacts')
     op.drop_index(op.f('ix_contacts_hubspot_id'), table_name='contacts')
     op.drop_table('contacts')
+    op.execute("DROP INDEX IF EXISTS ix_emails_embedding_hnsw")
     op.drop_index(op.f('ix_emails_from_email'), table_name='emails')
     op.drop_index(op.f('ix_emails_thread_id'), table_name='emails')
     op.drop_index(op.f('ix_emails_id'), table_name='emails')
@@ -0,0 +1,43 @@
+"""Store embeddings as halfvec
+
+Revision ID: 003_halfvec_embeddings
+Revises: 002_add_chat_messages
+Create Date: 2025-02-01 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '003_halfvec_embeddings'
+down_revision = '002_add_chat_messages'
+branch_labels = None
+depends_on = None
+
+
+EMBEDDING_TABLES = ('emails', 'contacts')
+
+
+def upgrade() -> None:
+    for table in EMBEDDING_TABLES:
+        # Convert existing data to half precision and rebuild the HNSW index
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_hnsw")
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN embedding TYPE halfvec(1536) "
+            f"USING embedding::halfvec(1536)"
+        )
+        op.execute(
+            f"CREATE INDEX ix_{table}_embedding_hnsw ON {table} "
+            f"USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
+
+
+def downgrade() -> None:
+    for table in EMBEDDING_TABLES:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_hnsw")
+        op.execute(
+            f"ALTER TABLE {table} ALTER COLUMN embedding TYPE vector(1536) "
+            f"USING embedding::vector(1536)"
+        )
+        op.execute(
+            f"CREATE INDEX ix_{table}_embedding_hnsw ON {table} "
+            f"USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
@@ -0,0 +1,31 @@
+"""Add binary-quantized embedding indexes
+
+Revision ID: 004_binary_quantized_index
+Revises: 003_halfvec_embeddings
+Create Date: 2025-02-05 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '004_binary_quantized_index'
+down_revision = '003_halfvec_embeddings'
+branch_labels = None
+depends_on = None
+
+
+EMBEDDING_TABLES = ('emails', 'contacts')
+
+
+def upgrade() -> None:
+    # Hamming-distance HNSW index over 1-bit quantized embeddings, used to
+    # shortlist candidates before re-ranking with the full cosine distance
+    for table in EMBEDDING_TABLES:
+        op.execute(
+            f"CREATE INDEX ix_{table}_embedding_bq ON {table} "
+            f"USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)"
+        )
+
+
+def downgrade() -> None:
+    for table in EMBEDDING_TABLES:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_bq")
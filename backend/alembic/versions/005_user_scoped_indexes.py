@@ -0,0 +1,35 @@
+"""Add user-scoped composite indexes
+
+Revision ID: 005_user_scoped_indexes
+Revises: 004_binary_quantized_index
+Create Date: 2025-02-10 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005_user_scoped_indexes'
+down_revision = '004_binary_quantized_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Composite indexes let per-user "newest first" queries stream from the index
+    op.create_index('ix_emails_user_received', 'emails', ['user_id', sa.text('received_at DESC')])
+    op.create_index('ix_chat_messages_user_created', 'chat_messages', ['user_id', sa.text('created_at DESC')])
+    op.drop_index(op.f('ix_chat_messages_created_at'), table_name='chat_messages')
+    
+    # Foreign key indexes for the remaining user-scoped tables
+    op.create_index(op.f('ix_contacts_user_id'), 'contacts', ['user_id'], unique=False)
+    op.create_index(op.f('ix_tasks_user_id'), 'tasks', ['user_id'], unique=False)
+    op.create_index(op.f('ix_ongoing_instructions_user_id'), 'ongoing_instructions', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_ongoing_instructions_user_id'), table_name='ongoing_instructions')
+    op.drop_index(op.f('ix_tasks_user_id'), table_name='tasks')
+    op.drop_index(op.f('ix_contacts_user_id'), table_name='contacts')
+    op.create_index(op.f('ix_chat_messages_created_at'), 'chat_messages', ['created_at'], unique=False)
+    op.drop_index('ix_chat_messages_user_created', table_name='chat_messages')
+    op.drop_index('ix_emails_user_received', table_name='emails')
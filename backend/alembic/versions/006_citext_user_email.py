@@ -0,0 +1,28 @@
+"""Make users.email case-insensitive
+
+Revision ID: 006_citext_user_email
+Revises: 005_user_scoped_indexes
+Create Date: 2025-02-12 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '006_citext_user_email'
+down_revision = '005_user_scoped_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # citext compares case-insensitively, so the unique index (and the
+    # ON CONFLICT (email) upsert) treats User@X.com and user@x.com as one user
+    op.execute('CREATE EXTENSION IF NOT EXISTS citext')
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.execute('ALTER TABLE users ALTER COLUMN email TYPE citext')
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_users_email'), table_name='users')
+    op.execute('ALTER TABLE users ALTER COLUMN email TYPE varchar')
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
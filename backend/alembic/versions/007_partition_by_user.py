@@ -0,0 +1,138 @@
+"""Hash-partition emails and chat_messages by user_id
+
+Revision ID: 007_partition_by_user
+Revises: 006_citext_user_email
+Create Date: 2025-02-15 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '007_partition_by_user'
+down_revision = '006_citext_user_email'
+branch_labels = None
+depends_on = None
+
+
+PARTITIONS = 16
+
+EMAIL_COLUMNS = (
+    "id", "user_id", "gmail_id", "thread_id", "subject", "from_email", "to_emails",
+    "cc_emails", "body_text", "body_html", "received_at", "created_at", "embedding"
+)
+
+CHAT_MESSAGE_COLUMNS = ("id", "user_id", "role", "content", "error", "created_at")
+
+
+def _rebuild_table(table: str, columns: tuple, create_sql: str, partitioned: bool) -> None:
+    """
+    Recreate a table from create_sql and move its rows over.
+
+    The old table is renamed aside, its data copied with a single
+    INSERT ... SELECT, and the id sequence re-attached before it is dropped.
+    Indexes are created by the caller once the old table (and its index
+    names) are gone.
+    """
+    op.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    op.execute(f"ALTER TABLE {table}_old RENAME CONSTRAINT {table}_pkey TO {table}_old_pkey")
+
+    op.execute(create_sql)
+    if partitioned:
+        for i in range(PARTITIONS):
+            op.execute(
+                f"CREATE TABLE {table}_p{i} PARTITION OF {table} "
+                f"FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {i})"
+            )
+
+    column_list = ", ".join(columns)
+    op.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {table}_old")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"DROP TABLE {table}_old")
+
+
+def _emails_sql(primary_key: str, partition_clause: str) -> str:
+    return f"""
+        CREATE TABLE emails (
+            id INTEGER NOT NULL DEFAULT nextval('emails_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            gmail_id VARCHAR NOT NULL,
+            thread_id VARCHAR,
+            subject VARCHAR,
+            from_email VARCHAR,
+            to_emails JSON,
+            cc_emails JSON,
+            body_text TEXT,
+            body_html TEXT,
+            received_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            embedding halfvec(1536),
+            PRIMARY KEY ({primary_key})
+        ) {partition_clause}
+    """
+
+
+def _chat_messages_sql(primary_key: str, partition_clause: str) -> str:
+    return f"""
+        CREATE TABLE chat_messages (
+            id INTEGER NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+            user_id INTEGER NOT NULL REFERENCES users (id),
+            role VARCHAR NOT NULL,
+            content TEXT NOT NULL,
+            error BOOLEAN,
+            created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+            PRIMARY KEY ({primary_key})
+        ) {partition_clause}
+    """
+
+
+def _create_email_indexes(gmail_unique: bool) -> None:
+    op.create_index(op.f('ix_emails_id'), 'emails', ['id'], unique=False)
+    if gmail_unique:
+        op.create_index(op.f('ix_emails_gmail_id'), 'emails', ['gmail_id'], unique=True)
+    else:
+        # Unique constraints on a partitioned table must include the partition key
+        op.create_index('ix_emails_user_gmail', 'emails', ['user_id', 'gmail_id'], unique=True)
+    op.create_index(op.f('ix_emails_thread_id'), 'emails', ['thread_id'], unique=False)
+    op.create_index(op.f('ix_emails_from_email'), 'emails', ['from_email'], unique=False)
+    op.create_index('ix_emails_user_received', 'emails', ['user_id', sa.text('received_at DESC')])
+    op.execute(
+        "CREATE INDEX ix_emails_embedding_hnsw ON emails "
+        "USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+    )
+    op.execute(
+        "CREATE INDEX ix_emails_embedding_bq ON emails "
+        "USING hnsw ((binary_quantize(embedding)::bit(1536)) bit_hamming_ops)"
+    )
+
+
+def _create_chat_message_indexes() -> None:
+    op.create_index(op.f('ix_chat_messages_id'), 'chat_messages', ['id'], unique=False)
+    op.create_index('ix_chat_messages_user_created', 'chat_messages', ['user_id', sa.text('created_at DESC')])
+
+
+def upgrade() -> None:
+    # Indexes on the partitioned parent are created on every partition,
+    # and queries filtered by user_id are pruned to a single partition
+    _rebuild_table(
+        'emails',
+        EMAIL_COLUMNS,
+        _emails_sql("id, user_id", "PARTITION BY HASH (user_id)"),
+        partitioned=True
+    )
+    _create_email_indexes(gmail_unique=False)
+
+    _rebuild_table(
+        'chat_messages',
+        CHAT_MESSAGE_COLUMNS,
+        _chat_messages_sql("id, user_id", "PARTITION BY HASH (user_id)"),
+        partitioned=True
+    )
+    _create_chat_message_indexes()
+
+
+def downgrade() -> None:
+    _rebuild_table('chat_messages', CHAT_MESSAGE_COLUMNS, _chat_messages_sql("id", ""), partitioned=False)
+    _create_chat_message_indexes()
+
+    _rebuild_table('emails', EMAIL_COLUMNS, _emails_sql("id", ""), partitioned=False)
+    _create_email_indexes(gmail_unique=True)
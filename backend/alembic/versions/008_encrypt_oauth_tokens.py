@@ -0,0 +1,56 @@
+"""Encrypt OAuth tokens at rest
+
+Revision ID: 008_encrypt_oauth_tokens
+Revises: 007_partition_by_user
+Create Date: 2025-02-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.models import EncryptedToken
+
+revision = '008_encrypt_oauth_tokens'
+down_revision = '007_partition_by_user'
+branch_labels = None
+depends_on = None
+
+
+TOKEN_COLUMNS = (
+    'google_access_token', 'google_refresh_token',
+    'hubspot_access_token', 'hubspot_refresh_token'
+)
+
+
+def _convert_tokens(read_type, write_type, sql_type: str) -> None:
+    """
+    Re-type the token columns, re-encoding existing values in Python.
+
+    The current values are read with read_type, the columns are altered to
+    sql_type, and the values are written back through write_type.
+    """
+    conn = op.get_bind()
+    source = sa.table('users', sa.column('id', sa.Integer), *(sa.column(c, read_type) for c in TOKEN_COLUMNS))
+    rows = [dict(row._mapping) for row in conn.execute(sa.select(source))]
+
+    for column in TOKEN_COLUMNS:
+        op.execute(f"ALTER TABLE users ALTER COLUMN {column} TYPE {sql_type} USING NULL")
+
+    if rows:
+        target = sa.table('users', sa.column('id', sa.Integer), *(sa.column(c, write_type) for c in TOKEN_COLUMNS))
+        conn.execute(
+            target.update()
+            .where(target.c.id == sa.bindparam('user_id'))
+            .values({c: sa.bindparam(f'new_{c}') for c in TOKEN_COLUMNS}),
+            [
+                {'user_id': row['id'], **{f'new_{c}': row[c] for c in TOKEN_COLUMNS}}
+                for row in rows
+            ]
+        )
+
+
+def upgrade() -> None:
+    _convert_tokens(sa.Text(), EncryptedToken(), 'bytea')
+
+
+def downgrade() -> None:
+    _convert_tokens(EncryptedToken(), sa.Text(), 'text')
@@ -0,0 +1,29 @@
+"""Index chat_messages for keyset pagination on (created_at, id)
+
+Revision ID: 009_chat_keyset_index
+Revises: 008_encrypt_oauth_tokens
+Create Date: 2025-02-20 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '009_chat_keyset_index'
+down_revision = '008_encrypt_oauth_tokens'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Superset of ix_chat_messages_user_created; matches the history ORDER BY exactly
+    op.create_index(
+        'ix_chat_user_created_id',
+        'chat_messages',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')]
+    )
+    op.drop_index('ix_chat_messages_user_created', table_name='chat_messages')
+
+
+def downgrade() -> None:
+    op.create_index('ix_chat_messages_user_created', 'chat_messages', ['user_id', sa.text('created_at DESC')])
+    op.drop_index('ix_chat_user_created_id', table_name='chat_messages')
@@ -0,0 +1,34 @@
+"""Add sync_status table
+
+Revision ID: 010_sync_status
+Revises: 009_chat_keyset_index
+Create Date: 2025-02-22 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '010_sync_status'
+down_revision = '009_chat_keyset_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'sync_status',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('syncing', sa.Boolean(), nullable=False),
+        sa.Column('sync_mode', sa.String(), nullable=True),
+        sa.Column('imported_count', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'source')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('sync_status')
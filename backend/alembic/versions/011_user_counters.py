@@ -0,0 +1,31 @@
+"""Add cached email/contact counters to users
+
+Revision ID: 011_user_counters
+Revises: 010_sync_status
+Create Date: 2025-02-24 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '011_user_counters'
+down_revision = '010_sync_status'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('email_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('users', sa.Column('contact_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill from the existing rows
+    op.execute(
+        "UPDATE users SET "
+        "email_count = (SELECT count(*) FROM emails WHERE emails.user_id = users.id), "
+        "contact_count = (SELECT count(*) FROM contacts WHERE contacts.user_id = users.id)"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'contact_count')
+    op.drop_column('users', 'email_count')
@@ -0,0 +1,25 @@
+"""Make contacts unique per (user_id, hubspot_id)
+
+Revision ID: 012_contacts_user_hubspot
+Revises: 011_user_counters
+Create Date: 2025-02-26 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '012_contacts_user_hubspot'
+down_revision = '011_user_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Every contact lookup is scoped by user; emails got the matching
+    # ix_emails_user_gmail index in 007_partition_by_user
+    op.create_index('ix_contacts_user_hubspot', 'contacts', ['user_id', 'hubspot_id'], unique=True)
+    op.drop_index(op.f('ix_contacts_hubspot_id'), table_name='contacts')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_contacts_hubspot_id'), 'contacts', ['hubspot_id'], unique=True)
+    op.drop_index('ix_contacts_user_hubspot', table_name='contacts')
@@ -0,0 +1,29 @@
+"""Index tasks for keyset pagination on (created_at, id)
+
+Revision ID: 013_tasks_keyset_index
+Revises: 012_contacts_user_hubspot
+Create Date: 2025-02-28 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '013_tasks_keyset_index'
+down_revision = '012_contacts_user_hubspot'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Leading user_id column also serves the plain per-user lookups
+    op.create_index(
+        'ix_tasks_user_created_id',
+        'tasks',
+        ['user_id', sa.text('created_at DESC'), sa.text('id DESC')]
+    )
+    op.drop_index(op.f('ix_tasks_user_id'), table_name='tasks')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_tasks_user_id'), 'tasks', ['user_id'], unique=False)
+    op.drop_index('ix_tasks_user_created_id', table_name='tasks')
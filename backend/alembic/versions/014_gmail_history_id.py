@@ -0,0 +1,22 @@
+"""Track the Gmail historyId reached by the poller
+
+Revision ID: 014_gmail_history_id
+Revises: 013_tasks_keyset_index
+Create Date: 2025-03-02 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '014_gmail_history_id'
+down_revision = '013_tasks_keyset_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('last_history_id', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'last_history_id')
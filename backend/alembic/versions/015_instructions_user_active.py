@@ -0,0 +1,28 @@
+"""Index ongoing instructions on (user_id, is_active)
+
+Revision ID: 015_instructions_user_active
+Revises: 014_gmail_history_id
+Create Date: 2025-03-04 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '015_instructions_user_active'
+down_revision = '014_gmail_history_id'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Leading user_id column also serves the plain per-user lookups
+    op.create_index(
+        'ix_ongoing_instructions_user_active',
+        'ongoing_instructions',
+        ['user_id', 'is_active']
+    )
+    op.drop_index(op.f('ix_ongoing_instructions_user_id'), table_name='ongoing_instructions')
+
+
+def downgrade() -> None:
+    op.create_index(op.f('ix_ongoing_instructions_user_id'), 'ongoing_instructions', ['user_id'], unique=False)
+    op.drop_index('ix_ongoing_instructions_user_active', table_name='ongoing_instructions')
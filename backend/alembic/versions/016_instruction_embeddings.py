@@ -0,0 +1,25 @@
+"""Store an embedding for each ongoing instruction
+
+Revision ID: 016_instruction_embeddings
+Revises: 015_instructions_user_active
+Create Date: 2025-03-06 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC
+
+revision = '016_instruction_embeddings'
+down_revision = '015_instructions_user_active'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Filled in when an instruction is created; existing rows keep relying on
+    # the keyword prefilter until they are re-created
+    op.add_column('ongoing_instructions', sa.Column('embedding', HALFVEC(1536), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('ongoing_instructions', 'embedding')
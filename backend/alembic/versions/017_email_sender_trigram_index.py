@@ -0,0 +1,26 @@
+"""Add a trigram index for substring search on email senders
+
+Revision ID: 017_email_sender_trigram
+Revises: 016_instruction_embeddings
+Create Date: 2025-03-10 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '017_email_sender_trigram'
+down_revision = '016_instruction_embeddings'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Lets LIKE '%name%' on lower(from_email) use an index instead of a scan
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute(
+        "CREATE INDEX ix_emails_from_email_trgm ON emails "
+        "USING gin (lower(from_email) gin_trgm_ops)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_emails_from_email_trgm")
@@ -0,0 +1,31 @@
+"""Drop unused full-precision embedding indexes
+
+Revision ID: 018_drop_embedding_hnsw
+Revises: 017_email_sender_trigram
+Create Date: 2025-03-12 00:00:00.000000
+
+"""
+from alembic import op
+
+revision = '018_drop_embedding_hnsw'
+down_revision = '017_email_sender_trigram'
+branch_labels = None
+depends_on = None
+
+
+EMBEDDING_TABLES = ('emails', 'contacts')
+
+
+def upgrade() -> None:
+    # Semantic search shortlists by Hamming distance on the binary-quantized
+    # index and re-ranks that shortlist exactly, so no query walks these
+    for table in EMBEDDING_TABLES:
+        op.execute(f"DROP INDEX IF EXISTS ix_{table}_embedding_hnsw")
+
+
+def downgrade() -> None:
+    for table in EMBEDDING_TABLES:
+        op.execute(
+            f"CREATE INDEX ix_{table}_embedding_hnsw ON {table} "
+            f"USING hnsw (embedding halfvec_cosine_ops) WITH (m = 16, ef_construction = 64)"
+        )
@@ -0,0 +1,72 @@
+"""Re-encrypt OAuth tokens with TOKEN_ENCRYPTION_KEY
+
+Revision ID: 019_token_encryption_key
+Revises: 018_drop_embedding_hnsw
+Create Date: 2025-03-14 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from app.config import settings
+from app.models import EncryptedToken
+
+revision = '019_token_encryption_key'
+down_revision = '018_drop_embedding_hnsw'
+branch_labels = None
+depends_on = None
+
+
+TOKEN_COLUMNS = (
+    'google_access_token', 'google_refresh_token',
+    'hubspot_access_token', 'hubspot_refresh_token'
+)
+
+# Tokens encrypted before key IDs existed: nonce + ciphertext + tag under a
+# key derived from JWT_SECRET
+_LEGACY_CIPHER = AESGCM(HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b"finance-advisor-oauth-tokens"
+).derive(settings.JWT_SECRET.encode()))
+_NONCE_SIZE = 12
+
+
+def upgrade() -> None:
+    token_type = EncryptedToken()
+
+    def reencrypt(value: bytes) -> bytes:
+        try:
+            # Already in the key ID format (e.g. written by 008 on a fresh database)
+            token_type.process_result_value(value, None)
+            return value
+        except (InvalidTag, ValueError):
+            token = _LEGACY_CIPHER.decrypt(value[:_NONCE_SIZE], value[_NONCE_SIZE:], None).decode()
+            return token_type.process_bind_param(token, None)
+
+    conn = op.get_bind()
+    users = sa.table('users', sa.column('id', sa.Integer), *(sa.column(c, sa.LargeBinary) for c in TOKEN_COLUMNS))
+    updates = [
+        {
+            'user_id': row.id,
+            **{f'new_{c}': reencrypt(bytes(row._mapping[c])) if row._mapping[c] is not None else None for c in TOKEN_COLUMNS}
+        }
+        for row in conn.execute(sa.select(users))
+    ]
+    if updates:
+        conn.execute(
+            users.update()
+            .where(users.c.id == sa.bindparam('user_id'))
+            .values({c: sa.bindparam(f'new_{c}') for c in TOKEN_COLUMNS}),
+            updates
+        )
+
+
+def downgrade() -> None:
+    # Tokens stay in the key ID format; 008's downgrade decrypts them through
+    # EncryptedToken, which reads that format
+    pass
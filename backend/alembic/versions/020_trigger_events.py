@@ -0,0 +1,37 @@
+"""Add trigger_events table for persisted ongoing-instruction batches
+
+Revision ID: 020_trigger_events
+Revises: 019_token_encryption_key
+Create Date: 2025-03-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from pgvector.sqlalchemy import HALFVEC
+
+revision = '020_trigger_events'
+down_revision = '019_token_encryption_key'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'trigger_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('trigger_type', sa.String(), nullable=False),
+        sa.Column('event', sa.JSON(), nullable=False),
+        sa.Column('embedding', HALFVEC(1536), nullable=True),
+        sa.Column('claimed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('batch_id', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trigger_events_batch_id', 'trigger_events', ['batch_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_trigger_events_batch_id', table_name='trigger_events')
+    op.drop_table('trigger_events')
@@ -6,13 +6,34 @@ Handles JWT token creation and validation for user sessions.
 
 from datetime import datetime, timedelta
 from typing import Optional
-from jose import JWTError, jwt
+import hashlib
+import hmac
+import secrets
+import time
+from cachetools import TTLCache
+import jwt
 from app.config import settings
 
 # JWT configuration
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
 
+# Cache of verified tokens: {token: (expires_at_timestamp, payload)}
+# Entries live at most 60 seconds and never past the token's own expiry
+_JWT_CACHE = TTLCache(maxsize=10000, ttl=60)
+
+# Seconds an OAuth state stays valid between the authorize redirect and the callback
+OAUTH_STATE_MAX_AGE = 600
+
+# Nonces of OAuth states already accepted; entries only need to outlive the states themselves
+_USED_OAUTH_STATES = TTLCache(maxsize=10000, ttl=OAUTH_STATE_MAX_AGE)
+
+# Cache of per-request user columns: {user_id: {column: value}}
+# OAuth tokens are never cached; they are loaded from the database when a
+# request needs them. invalidate_cached_user() only clears this worker's
+# copy, so entries are kept short-lived to bound staleness across workers.
+_USER_CACHE = TTLCache(maxsize=10000, ttl=60)
+
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
@@ -47,9 +68,89 @@ def verify_token(token: str) -> Optional[dict]:
     Returns:
         Decoded token payload if valid, None otherwise
     """
+    cached = _JWT_CACHE.get(token)
+    if cached is not None:
+        expires_at, payload = cached
+        if time.time() < expires_at:
+            return payload
+        _JWT_CACHE.pop(token, None)
+    
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
+        payload = jwt.decode(
+            token,
+            settings.JWT_SECRET,
+            algorithms=[ALGORITHM],
+            options={"require": ["exp"]}
+        )
+    except jwt.InvalidTokenError:
         return None
+    
+    _JWT_CACHE[token] = (payload["exp"], payload)
+    return payload
+
+
+def get_cached_user_fields(user_id: int) -> Optional[dict]:
+    """Return the cached column values for a user, if present."""
+    return _USER_CACHE.get(user_id)
+
+
+def cache_user_fields(user_id: int, fields: dict) -> None:
+    """Store column values for a user in the user cache."""
+    _USER_CACHE[user_id] = fields
+
+
+def invalidate_cached_user(user_id: int) -> None:
+    """Drop a user from the user cache after their row changes."""
+    _USER_CACHE.pop(user_id, None)
+
+
+def _sign_oauth_state(message: str) -> str:
+    """Compute the short HMAC-SHA256 tag for an OAuth state message."""
+    return hmac.new(settings.JWT_SECRET.encode(), message.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def create_oauth_state(user_id: int) -> str:
+    """
+    Create a signed, time-limited OAuth state parameter identifying the user.
+    
+    Args:
+        user_id: ID of the user starting the OAuth flow
+        
+    Returns:
+        State string in the form "<user_id>.<issued_at>.<nonce>.<signature>"
+    """
+    message = f"{user_id}.{int(time.time())}.{secrets.token_urlsafe(8)}"
+    return f"{message}.{_sign_oauth_state(message)}"
 
+
+def verify_oauth_state(state: str) -> Optional[int]:
+    """
+    Verify a signed OAuth state parameter.
+    
+    States are rejected once they are older than OAUTH_STATE_MAX_AGE
+    seconds or have already been used (per worker).
+    
+    Args:
+        state: State string returned by the OAuth provider
+        
+    Returns:
+        User ID if the state is valid, unexpired and unused, None otherwise
+    """
+    parts = state.split(".")
+    if len(parts) != 4:
+        return None
+    
+    user_id, issued_at, nonce, signature = parts
+    if not hmac.compare_digest(signature, _sign_oauth_state(f"{user_id}.{issued_at}.{nonce}")):
+        return None
+    
+    try:
+        age = time.time() - int(issued_at)
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    if not 0 <= age <= OAUTH_STATE_MAX_AGE or nonce in _USED_OAUTH_STATES:
+        return None
+    
+    _USED_OAUTH_STATES[nonce] = True
+    return user_id
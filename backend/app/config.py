@@ -4,18 +4,35 @@ Configuration settings for the application.
 Uses pydantic-settings to load environment variables from .env file.
 """
 
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from functools import lru_cache
 from typing import Optional
 
 
 class Settings(BaseSettings):
     """Application settings loaded from environment variables."""
     
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=True,
+        frozen=True,
+        extra="ignore"
+    )
+    
     # Database
     DATABASE_URL: str
+    # Pool sizes apply to each engine (sync and async) in each worker process
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30  # Seconds to wait for a free connection before erroring
+    DB_POOL_RECYCLE: int = 1800  # Seconds before a pooled connection is replaced
     
     # OpenAI
     OPENAI_API_KEY: str
+    PLANNER_MODEL: str = "gpt-4"  # Chooses tools and answers directly
+    SYNTH_MODEL: str = "gpt-4o-mini"  # Writes the answer from tool results, classifies instructions
+    # Ask the model for an instruction's trigger type when keyword matching is ambiguous
+    TRIGGER_DETECT_FALLBACK: bool = False
     
     # Google OAuth
     GOOGLE_CLIENT_ID: str
@@ -30,17 +47,29 @@ class Settings(BaseSettings):
     # JWT
     JWT_SECRET: str
     
+    # OAuth token encryption (AES-256-GCM), kept separate from JWT_SECRET so
+    # either can be rotated on its own. Keys are "<id 0-255>:<urlsafe base64
+    # of 32 bytes>"; new tokens use TOKEN_ENCRYPTION_KEY, and retired keys
+    # listed in TOKEN_DECRYPTION_KEYS (comma separated) can still be read
+    TOKEN_ENCRYPTION_KEY: str
+    TOKEN_DECRYPTION_KEYS: str = ""
+    
+    # Background email polling
+    EMAIL_POLL_INTERVAL_SECONDS: int = 20
+    
     # Frontend
     FRONTEND_URL: str = "http://localhost:3000"
     
     # Server
     PORT: int = 8000
-    
-    class Config:
-        env_file = ".env"
-        case_sensitive = True
 
 
-# Create global settings instance
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Return the process-wide settings instance, loading it on first use."""
+    return Settings()
+
+
+# Global settings instance (kept for existing imports)
+settings = get_settings()
 
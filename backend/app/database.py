@@ -4,24 +4,67 @@ Database configuration and session management.
 Sets up SQLAlchemy with PostgreSQL and pgvector support.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from pgvector.psycopg import register_vector, register_vector_async
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import DeclarativeBase, sessionmaker
 from app.config import settings
 
+# Always use the psycopg 3 driver, whatever scheme DATABASE_URL is written with
+DATABASE_URL = make_url(settings.DATABASE_URL).set(drivername="postgresql+psycopg")
+
 # Create database engine
 # This connects to PostgreSQL and enables pgvector support
 engine = create_engine(
-    settings.DATABASE_URL,
+    DATABASE_URL,
     pool_pre_ping=True,  # Verify connections before using
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_use_lifo=True,  # Reuse the most recently returned (warm) connection first
+    connect_args={"options": "-c jit=off"},  # Short OLTP queries don't benefit from JIT
+    query_cache_size=1200,  # Room for every distinct statement the app compiles
     echo=False  # Set to True for SQL query logging
 )
 
-# Create session factory
+# Create async engine for handlers that await database calls
+# psycopg 3 ships an asyncio driver, so the same DATABASE_URL is reused
+async_engine = create_async_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_use_lifo=True,
+    connect_args={"options": "-c jit=off"},
+    query_cache_size=1200,
+    echo=False
+)
+
+
+
+# Register pgvector's binary codecs on every new connection so vectors are
+# sent as packed floats instead of ~20 KB of text per embedding
+@event.listens_for(engine, "connect")
+def _register_vector(dbapi_connection, connection_record):
+    register_vector(dbapi_connection)
+
+
+@event.listens_for(async_engine.sync_engine, "connect")
+def _register_vector_async(dbapi_connection, connection_record):
+    dbapi_connection.run_async(register_vector_async)
+
+
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for all models
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
 
 
 def get_db():
@@ -35,3 +78,11 @@ def get_db():
     finally:
         db.close()
 
+
+async def get_async_db():
+    """
+    Dependency function to get an async database session.
+    Used in FastAPI routes that await database calls.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
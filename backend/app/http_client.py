@@ -0,0 +1,15 @@
+"""
+Shared HTTP client.
+
+A single process-wide httpx.AsyncClient so outbound calls to Google and
+HubSpot reuse pooled keep-alive connections instead of paying a new
+TCP + TLS handshake per request.
+"""
+
+import httpx
+
+SHARED_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(10.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+)
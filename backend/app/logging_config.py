@@ -0,0 +1,37 @@
+"""
+Logging configuration.
+
+Log records are put on an in-memory queue by a QueueHandler on the root
+logger and written out by a QueueListener thread, so formatting and stream
+I/O never block the event loop thread.
+"""
+
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(name)s] %(message)s"
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Route the root logger through a queue drained by a background thread.
+
+    Args:
+        level: Root logger level
+
+    Returns:
+        The started QueueListener (call stop() on shutdown to flush it)
+    """
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
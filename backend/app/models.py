@@ -4,12 +4,89 @@ Database models for the application.
 Defines all SQLAlchemy models including User, Email, Contact, Task, etc.
 """
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Float
-from sqlalchemy.orm import relationship
+import base64
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from sqlalchemy import Integer, String, Text, DateTime, Boolean, ForeignKey, JSON, Index, DDL, LargeBinary, TypeDecorator, cast, event
+from sqlalchemy.dialects.postgresql import BIT, CITEXT
+from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
+from pgvector import HalfVector
+from pgvector.sqlalchemy import HALFVEC
+from app.config import settings
 from app.database import Base
 
+# Number of hash partitions (by user_id) for the large per-user tables
+USER_HASH_PARTITIONS = 16
+
+
+def create_hash_partitions(table, count: int = USER_HASH_PARTITIONS):
+    """
+    Create the hash partitions of a table partitioned by user_id
+    whenever the parent table is created via metadata.create_all().
+    """
+    for i in range(count):
+        event.listen(
+            table,
+            "after_create",
+            DDL(
+                f"CREATE TABLE {table.name}_p{i} PARTITION OF {table.name} "
+                f"FOR VALUES WITH (MODULUS {count}, REMAINDER {i})"
+            )
+        )
+
+
+def _parse_token_key(entry: str) -> Tuple[int, bytes]:
+    """Parse a "<id>:<urlsafe base64 key>" token encryption key setting."""
+    key_id, _, encoded = entry.strip().partition(":")
+    key = base64.urlsafe_b64decode(encoded)
+    if not key_id.isdigit() or int(key_id) > 255 or len(key) != 32:
+        raise ValueError("Token encryption keys must look like '<id 0-255>:<urlsafe base64 of 32 bytes>'")
+    return int(key_id), key
+
+
+# AES-256-GCM ciphers for OAuth tokens by key ID; the current key encrypts,
+# retired keys only decrypt tokens written before a rotation
+_TOKEN_KEY_ID, _current_token_key = _parse_token_key(settings.TOKEN_ENCRYPTION_KEY)
+_TOKEN_CIPHERS: Dict[int, AESGCM] = {
+    key_id: AESGCM(key)
+    for key_id, key in map(_parse_token_key, filter(str.strip, settings.TOKEN_DECRYPTION_KEYS.split(",")))
+}
+_TOKEN_CIPHERS[_TOKEN_KEY_ID] = AESGCM(_current_token_key)
+
+# Nonce length recommended for AES-GCM
+_NONCE_SIZE = 12
+
+
+class EncryptedToken(TypeDecorator):
+    """
+    String column stored encrypted with AES-GCM.
+    
+    Values are stored as key ID (1 byte) + nonce + ciphertext + tag in a bytea
+    column, which for typical OAuth tokens stays small enough to live inline
+    in the row. The key ID selects the decryption key, so keys can be rotated
+    without re-encrypting existing tokens first.
+    """
+    impl = LargeBinary
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        nonce = os.urandom(_NONCE_SIZE)
+        return bytes((_TOKEN_KEY_ID,)) + nonce + _TOKEN_CIPHERS[_TOKEN_KEY_ID].encrypt(nonce, value.encode(), None)
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        value = bytes(value)
+        cipher = _TOKEN_CIPHERS.get(value[0])
+        if cipher is None:
+            raise ValueError(f"OAuth token was encrypted with unknown key ID {value[0]}")
+        return cipher.decrypt(value[1:1 + _NONCE_SIZE], value[1 + _NONCE_SIZE:], None).decode()
+
 
 class User(Base):
     """
@@ -18,30 +95,38 @@ class User(Base):
     """
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True, index=True)
-    email = Column(String, unique=True, index=True, nullable=False)
-    name = Column(String, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    email: Mapped[str] = mapped_column(CITEXT, unique=True, index=True)  # Case-insensitive
+    name: Mapped[Optional[str]] = mapped_column(String)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
     # Google OAuth tokens
-    google_access_token = Column(Text, nullable=True)
-    google_refresh_token = Column(Text, nullable=True)
-    google_token_expires_at = Column(DateTime(timezone=True), nullable=True)
-    google_email = Column(String, nullable=True)  # User's Gmail address
+    # Tokens are deferred (loaded together on first access) so profile reads skip them
+    google_access_token: Mapped[Optional[str]] = mapped_column(EncryptedToken, deferred=True, deferred_group="oauth_tokens")
+    google_refresh_token: Mapped[Optional[str]] = mapped_column(EncryptedToken, deferred=True, deferred_group="oauth_tokens")
+    google_token_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    google_email: Mapped[Optional[str]] = mapped_column(String)  # User's Gmail address
+    last_history_id: Mapped[Optional[str]] = mapped_column(String)  # Gmail historyId reached by the poller
     
     # HubSpot OAuth tokens
-    hubspot_access_token = Column(Text, nullable=True)
-    hubspot_refresh_token = Column(Text, nullable=True)
-    hubspot_token_expires_at = Column(DateTime(timezone=True), nullable=True)
-    hubspot_contact_id = Column(String, nullable=True)  # HubSpot contact ID
-    hubspot_name = Column(String, nullable=True)  # HubSpot account name
+    hubspot_access_token: Mapped[Optional[str]] = mapped_column(EncryptedToken, deferred=True, deferred_group="oauth_tokens")
+    hubspot_refresh_token: Mapped[Optional[str]] = mapped_column(EncryptedToken, deferred=True, deferred_group="oauth_tokens")
+    hubspot_token_expires_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    hubspot_contact_id: Mapped[Optional[str]] = mapped_column(String)  # HubSpot contact ID
+    hubspot_name: Mapped[Optional[str]] = mapped_column(String)  # HubSpot account name
+    
+    # Cached row counts, incremented by the sync jobs so /status needs no COUNT(*)
+    email_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    contact_count: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     
     # Relationships
-    emails = relationship("Email", back_populates="user", cascade="all, delete-orphan")
-    contacts = relationship("Contact", back_populates="user", cascade="all, delete-orphan")
-    tasks = relationship("Task", back_populates="user", cascade="all, delete-orphan")
-    ongoing_instructions = relationship("OngoingInstruction", back_populates="user", cascade="all, delete-orphan")
-    chat_messages = relationship("ChatMessage", back_populates="user", cascade="all, delete-orphan")
+    # lazy="raise" so a stray attribute access can't trigger an N+1 load;
+    # load them explicitly with selectinload() where needed
+    emails: Mapped[List["Email"]] = relationship(back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    contacts: Mapped[List["Contact"]] = relationship(back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    tasks: Mapped[List["Task"]] = relationship(back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    ongoing_instructions: Mapped[List["OngoingInstruction"]] = relationship(back_populates="user", cascade="all, delete-orphan", lazy="raise")
+    chat_messages: Mapped[List["ChatMessage"]] = relationship(back_populates="user", cascade="all, delete-orphan", lazy="raise")
 
 
 class Email(Base):
@@ -51,28 +136,60 @@ class Email(Base):
     """
     __tablename__ = "emails"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    gmail_id = Column(String, unique=True, index=True, nullable=False)
-    thread_id = Column(String, index=True, nullable=True)
+    # Partitioned by user_id, which therefore has to be part of the primary key
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    gmail_id: Mapped[str] = mapped_column(String)
+    thread_id: Mapped[Optional[str]] = mapped_column(String, index=True)
     
     # Email content
-    subject = Column(String, nullable=True)
-    from_email = Column(String, index=True, nullable=True)
-    to_emails = Column(JSON, nullable=True)  # List of recipient emails
-    cc_emails = Column(JSON, nullable=True)
-    body_text = Column(Text, nullable=True)
-    body_html = Column(Text, nullable=True)
+    subject: Mapped[Optional[str]] = mapped_column(String)
+    from_email: Mapped[Optional[str]] = mapped_column(String, index=True)
+    to_emails: Mapped[Optional[List[str]]] = mapped_column(JSON)  # List of recipient emails
+    cc_emails: Mapped[Optional[List[str]]] = mapped_column(JSON)
+    # Bodies are large TOASTed values, so they are only loaded on access or undefer()
+    body_text: Mapped[Optional[str]] = mapped_column(Text, deferred=True)
+    body_html: Mapped[Optional[str]] = mapped_column(Text, deferred=True)
     
     # Metadata
-    received_at = Column(DateTime(timezone=True), nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    received_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
     # Vector embedding for semantic search (1536 dimensions for OpenAI embeddings)
-    embedding = Column(Vector(1536), nullable=True)
+    # Stored as half precision to halve row and HNSW index size
+    embedding: Mapped[Optional[HalfVector]] = mapped_column(HALFVEC(1536))
     
     # Relationship
-    user = relationship("User", back_populates="emails")
+    user: Mapped["User"] = relationship(back_populates="emails")
+    
+    __table_args__ = (
+        # Gmail IDs are unique per user (unique indexes must include the partition key)
+        Index("ix_emails_user_gmail", "user_id", "gmail_id", unique=True),
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+
+
+# Per-user inbox listing: WHERE user_id = ? ORDER BY received_at DESC
+Index("ix_emails_user_received", Email.user_id, Email.received_at.desc())
+
+# Binary-quantized HNSW index used as a fast Hamming-distance pre-filter; the
+# only embedding index, since search re-ranks the shortlist exactly without one
+Index(
+    "ix_emails_embedding_bq",
+    cast(func.binary_quantize(Email.embedding), BIT(1536)).label("embedding_bq"),
+    postgresql_using="hnsw",
+    postgresql_ops={"embedding_bq": "bit_hamming_ops"},
+)
+
+# Trigram index for substring matches on the sender (requires pg_trgm)
+Index(
+    "ix_emails_from_email_trgm",
+    func.lower(Email.from_email).label("from_email_lower"),
+    postgresql_using="gin",
+    postgresql_ops={"from_email_lower": "gin_trgm_ops"},
+)
+
+create_hash_partitions(Email.__table__)
 
 
 class Contact(Base):
@@ -82,30 +199,45 @@ class Contact(Base):
     """
     __tablename__ = "contacts"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    hubspot_id = Column(String, unique=True, index=True, nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    hubspot_id: Mapped[str] = mapped_column(String)
     
     # Contact information
-    email = Column(String, index=True, nullable=True)
-    first_name = Column(String, nullable=True)
-    last_name = Column(String, nullable=True)
-    phone = Column(String, nullable=True)
-    company = Column(String, nullable=True)
+    email: Mapped[Optional[str]] = mapped_column(String, index=True)
+    first_name: Mapped[Optional[str]] = mapped_column(String)
+    last_name: Mapped[Optional[str]] = mapped_column(String)
+    phone: Mapped[Optional[str]] = mapped_column(String)
+    company: Mapped[Optional[str]] = mapped_column(String)
     
     # Notes and additional data
-    notes = Column(Text, nullable=True)  # Combined notes text
-    raw_data = Column(JSON, nullable=True)  # Full HubSpot contact data
+    notes: Mapped[Optional[str]] = mapped_column(Text)  # Combined notes text
+    raw_data: Mapped[Optional[dict]] = mapped_column(JSON, deferred=True)  # Full HubSpot contact data
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
     
-    # Vector embedding for semantic search
-    embedding = Column(Vector(1536), nullable=True)
+    # Vector embedding for semantic search (half precision)
+    embedding: Mapped[Optional[HalfVector]] = mapped_column(HALFVEC(1536))
     
     # Relationship
-    user = relationship("User", back_populates="contacts")
+    user: Mapped["User"] = relationship(back_populates="contacts")
+    
+    __table_args__ = (
+        # HubSpot IDs are unique per user (two advisors may share a portal)
+        Index("ix_contacts_user_hubspot", "user_id", "hubspot_id", unique=True),
+    )
+
+
+# Binary-quantized HNSW index used as a fast Hamming-distance pre-filter; the
+# only embedding index, since search re-ranks the shortlist exactly without one
+Index(
+    "ix_contacts_embedding_bq",
+    cast(func.binary_quantize(Contact.embedding), BIT(1536)).label("embedding_bq"),
+    postgresql_using="hnsw",
+    postgresql_ops={"embedding_bq": "bit_hamming_ops"},
+)
 
 
 class Task(Base):
@@ -115,26 +247,31 @@ class Task(Base):
     """
     __tablename__ = "tasks"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     
     # Task information
-    task_type = Column(String, nullable=False)  # e.g., "schedule_appointment", "create_contact"
-    status = Column(String, default="pending")  # pending, in_progress, completed, failed
-    description = Column(Text, nullable=True)
+    task_type: Mapped[str] = mapped_column(String)  # e.g., "schedule_appointment", "create_contact"
+    status: Mapped[Optional[str]] = mapped_column(String, default="pending")  # pending, in_progress, completed, failed
+    description: Mapped[Optional[str]] = mapped_column(Text)
     
     # Task data and context
-    input_data = Column(JSON, nullable=True)  # Original request data
-    current_state = Column(JSON, nullable=True)  # Current state of the task
-    result = Column(JSON, nullable=True)  # Final result
+    input_data: Mapped[Optional[dict]] = mapped_column(JSON)  # Original request data
+    current_state: Mapped[Optional[dict]] = mapped_column(JSON, deferred=True, deferred_group="task_state")  # Current state of the task
+    result: Mapped[Optional[Any]] = mapped_column(JSON, deferred=True, deferred_group="task_state")  # Final result
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
-    completed_at = Column(DateTime(timezone=True), nullable=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
+    updated_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), onupdate=func.now())
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
     
     # Relationship
-    user = relationship("User", back_populates="tasks")
+    user: Mapped["User"] = relationship(back_populates="tasks")
+
+
+# Per-user keyset paging: WHERE user_id = ? AND (created_at, id) < (?, ?)
+# ORDER BY created_at DESC, id DESC
+Index("ix_tasks_user_created_id", Task.user_id, Task.created_at.desc(), Task.id.desc())
 
 
 class OngoingInstruction(Base):
@@ -144,19 +281,53 @@ class OngoingInstruction(Base):
     """
     __tablename__ = "ongoing_instructions"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     
     # Instruction details
-    instruction = Column(Text, nullable=False)  # The instruction text
-    trigger_type = Column(String, nullable=True)  # email, calendar, hubspot, all
-    is_active = Column(Boolean, default=True)
+    instruction: Mapped[str] = mapped_column(Text)  # The instruction text
+    trigger_type: Mapped[Optional[str]] = mapped_column(String)  # email, calendar, hubspot, all
+    is_active: Mapped[Optional[bool]] = mapped_column(Boolean, default=True)
+    
+    # Embedding of the instruction text, used to match it against trigger events
+    embedding: Mapped[Optional[HalfVector]] = mapped_column(HALFVEC(1536))
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship
-    user = relationship("User", back_populates="ongoing_instructions")
+    user: Mapped["User"] = relationship(back_populates="ongoing_instructions")
+
+
+# Active-instruction lookups: WHERE user_id = ? AND is_active
+Index("ix_ongoing_instructions_user_active", OngoingInstruction.user_id, OngoingInstruction.is_active)
+
+
+class TriggerEvent(Base):
+    """
+    Trigger event (e.g. a new email) queued for ongoing-instruction processing.
+    
+    Rows are written in the same transaction as the data that triggered
+    them and deleted once the Batch API results have been acted on, so
+    queued and in-flight events survive restarts.
+    """
+    __tablename__ = "trigger_events"
+    
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"))
+    
+    # Event details
+    trigger_type: Mapped[str] = mapped_column(String)  # email, calendar, hubspot
+    event: Mapped[dict] = mapped_column(JSON)  # Data about the event
+    embedding: Mapped[Optional[HalfVector]] = mapped_column(HALFVEC(1536))  # Embedding of the event's content
+    
+    # Batch state: claimed_at is set when a worker picks the event up,
+    # batch_id once the Batch API job containing it has been created
+    claimed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    batch_id: Mapped[Optional[str]] = mapped_column(String, index=True)
+    
+    # Metadata
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
 
 class ChatMessage(Base):
@@ -166,17 +337,49 @@ class ChatMessage(Base):
     """
     __tablename__ = "chat_messages"
     
-    id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    # Partitioned by user_id, which therefore has to be part of the primary key
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True, index=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
     
     # Message content
-    role = Column(String, nullable=False)  # "user" or "assistant"
-    content = Column(Text, nullable=False)  # Message text
-    error = Column(Boolean, default=False)  # Whether this is an error message
+    role: Mapped[str] = mapped_column(String)  # "user" or "assistant"
+    content: Mapped[str] = mapped_column(Text)  # Message text
+    error: Mapped[Optional[bool]] = mapped_column(Boolean, default=False)  # Whether this is an error message
     
     # Metadata
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), server_default=func.now())
     
     # Relationship
-    user = relationship("User", back_populates="chat_messages")
+    user: Mapped["User"] = relationship(back_populates="chat_messages")
+    
+    __table_args__ = (
+        {"postgresql_partition_by": "HASH (user_id)"},
+    )
+
+
+# Per-user keyset paging: WHERE user_id = ? AND (created_at, id) < (?, ?)
+# ORDER BY created_at DESC, id DESC
+Index("ix_chat_user_created_id", ChatMessage.user_id, ChatMessage.created_at.desc(), ChatMessage.id.desc())
+
+create_hash_partitions(ChatMessage.__table__)
+
 
+class SyncStatus(Base):
+    """
+    Progress of the latest Gmail/HubSpot sync for a user.
+    Kept in the database so every worker process reports the same status.
+    """
+    __tablename__ = "sync_status"
+    
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    source: Mapped[str] = mapped_column(String, primary_key=True)  # "gmail" or "hubspot"
+    
+    # Sync progress
+    syncing: Mapped[bool] = mapped_column(Boolean, default=False)
+    sync_mode: Mapped[Optional[str]] = mapped_column(String)  # "month" or "all"
+    imported_count: Mapped[Optional[int]] = mapped_column(Integer)
+    error: Mapped[Optional[str]] = mapped_column(Text)
+    
+    # Metadata
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
+    completed_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
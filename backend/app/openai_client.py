@@ -0,0 +1,22 @@
+"""
+Shared OpenAI client.
+
+A single process-wide AsyncOpenAI client for chat completions and
+embeddings, so model calls never block the event loop and reuse one pool
+of HTTP/2 connections.
+"""
+
+import httpx
+from openai import AsyncOpenAI
+from app.config import settings
+
+# Completions can take much longer than the shared HTTP client's timeout
+# allows, so OpenAI gets its own pooled client
+openai_client = AsyncOpenAI(
+    api_key=settings.OPENAI_API_KEY,
+    http_client=httpx.AsyncClient(
+        http2=True,
+        timeout=httpx.Timeout(600.0, connect=5.0),
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+)
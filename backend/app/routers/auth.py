@@ -6,19 +6,38 @@ Handles Google OAuth and HubSpot OAuth flows.
 
 from fastapi import APIRouter, Header, Depends, HTTPException, status, Query
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, select, update, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from authlib.integrations.httpx_client import AsyncOAuth2Client
-from app.database import get_db
+from app.database import get_async_db
 from app.models import User
-from app.auth import create_access_token
+from app.auth import create_access_token, create_oauth_state, verify_oauth_state, invalidate_cached_user
 from app.config import settings
+from app.http_client import SHARED_CLIENT
 from app.services.google_service import GoogleService
 from app.services.hubspot_service import HubSpotService
 from typing import Optional
-import httpx
+import asyncio
+import orjson
 
 router = APIRouter()
 
+# Statements built once at import so their compiled form is reused from the
+# statement cache on every request
+_USER_BY_ID = select(User).where(User.id == bindparam("uid"))
+
+# Project only the fields returned by /me; token columns are never read
+_USER_PROFILE_BY_ID = select(
+    User.id,
+    User.email,
+    User.name,
+    User.google_email,
+    User.hubspot_name,
+    User.google_access_token.isnot(None).label("has_google"),
+    User.hubspot_access_token.isnot(None).label("has_hubspot")
+).where(User.id == bindparam("uid"))
+
 
 @router.get("/google")
 async def google_auth():
@@ -49,7 +68,7 @@ async def google_auth():
 
 
 @router.get("/google/callback")
-async def google_callback(code: str, db: Session = Depends(get_db)):
+async def google_callback(code: str, db: AsyncSession = Depends(get_async_db)):
     """
     Handle Google OAuth callback.
     Exchanges authorization code for tokens and creates/updates user.
@@ -74,13 +93,19 @@ async def google_callback(code: str, db: Session = Depends(get_db)):
             from datetime import datetime, timedelta, timezone
             expires_at = datetime.now(timezone.utc) + timedelta(seconds=token["expires_in"])
         
-        # Get user info
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                headers={"Authorization": f"Bearer {access_token}"}
-            )
-            user_info = response.json()
+        # Get user info and Gmail profile concurrently (both only need the access token)
+        userinfo_task = asyncio.create_task(SHARED_CLIENT.get(
+            "https://www.googleapis.com/oauth2/v2/userinfo",
+            headers={"Authorization": f"Bearer {access_token}"}
+        ))
+        gmail_task = asyncio.create_task(GoogleService(access_token).get_gmail_profile())
+        try:
+            response, gmail_profile = await asyncio.gather(userinfo_task, gmail_task)
+        except Exception:
+            userinfo_task.cancel()
+            gmail_task.cancel()
+            raise
+        user_info = orjson.loads(response.content)
         
         email = user_info.get("email")
         name = user_info.get("name")
@@ -88,34 +113,35 @@ async def google_callback(code: str, db: Session = Depends(get_db)):
         if not email:
             raise HTTPException(status_code=400, detail="Could not get user email")
         
-        # Get Gmail address (might be different from OAuth email)
-        google_service = GoogleService(access_token)
-        gmail_profile = await google_service.get_gmail_profile()
+        # Gmail address might be different from OAuth email
         gmail_address = gmail_profile.get("emailAddress", email)
         
-        # Find or create user
-        user = db.query(User).filter(User.email == email).first()
-        if not user:
-            user = User(
-                email=email,
-                name=name,
-                google_access_token=access_token,
-                google_refresh_token=refresh_token,
-                google_token_expires_at=expires_at,
-                google_email=gmail_address
-            )
-            db.add(user)
-        else:
-            # Update existing user
-            user.google_access_token = access_token
-            user.google_refresh_token = refresh_token
-            user.google_token_expires_at = expires_at
-            user.google_email = gmail_address
-            if name:
-                user.name = name
-        
-        db.commit()
-        db.refresh(user)
+        # Create or update user in a single atomic statement
+        stmt = pg_insert(User).values(
+            email=email,
+            name=name,
+            google_access_token=access_token,
+            google_refresh_token=refresh_token,
+            google_token_expires_at=expires_at,
+            google_email=gmail_address,
+            last_history_id=gmail_profile.get("historyId")
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[User.email],
+            set_={
+                "google_access_token": stmt.excluded.google_access_token,
+                "google_refresh_token": stmt.excluded.google_refresh_token,
+                "google_token_expires_at": stmt.excluded.google_token_expires_at,
+                "google_email": stmt.excluded.google_email,
+                # Keep the existing name if Google didn't return one
+                "name": func.coalesce(stmt.excluded.name, User.name),
+                # Start the poller from now on first login; keep its position afterwards
+                "last_history_id": func.coalesce(User.last_history_id, stmt.excluded.last_history_id),
+            }
+        ).returning(User)
+        user = (await db.execute(stmt)).scalar_one()
+        await db.commit()
+        invalidate_cached_user(user.id)
         
         # Create JWT token
         jwt_token = create_access_token({"user_id": user.id, "email": user.email})
@@ -136,7 +162,7 @@ async def google_callback(code: str, db: Session = Depends(get_db)):
 async def hubspot_auth(
     token: Optional[str] = Query(None, description="JWT token for authentication"),
     authorization: Optional[str] = Header(None, alias="Authorization"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Initiate HubSpot OAuth flow.
@@ -165,7 +191,7 @@ async def hubspot_auth(
         )
     
     user_id = payload.get("user_id")
-    user = db.query(User).filter(User.id == user_id).first()
+    user = (await db.execute(_USER_BY_ID, {"uid": user_id})).scalar_one_or_none()
     
     if not user:
         raise HTTPException(
@@ -173,13 +199,8 @@ async def hubspot_auth(
             detail="User not found"
         )
     
-    # Encode user_id in state parameter
-    import base64
-    import json
-    state_data = {"user_id": user_id}
-    state_encoded = base64.urlsafe_b64encode(
-        json.dumps(state_data).encode()
-    ).decode()
+    # Encode user_id in a signed state parameter
+    state_encoded = create_oauth_state(user_id)
     
     oauth = AsyncOAuth2Client(
         client_id=settings.HUBSPOT_CLIENT_ID,
@@ -194,49 +215,39 @@ async def hubspot_auth(
             "crm.objects.contacts.write",
             "oauth",
         ],
-        state=state_encoded  # Use our encoded state with user_id
+        state=state_encoded  # Use our signed state with user_id
     )
     
     return RedirectResponse(url=authorization_url)
 
 
 @router.get("/hubspot/callback")
-async def hubspot_callback(code: str, state: Optional[str] = None, db: Session = Depends(get_db)):
+async def hubspot_callback(code: str, state: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
     """
     Handle HubSpot OAuth callback.
     Exchanges authorization code for tokens and updates user.
     """
     try:
-        # Decode user_id from state parameter
-        user_id = None
-        if state:
-            try:
-                import base64
-                import json
-                state_decoded = base64.urlsafe_b64decode(state.encode()).decode()
-                state_data = json.loads(state_decoded)
-                user_id = state_data.get("user_id")
-            except Exception as e:
-                print(f"Error decoding state: {e}")
-                # If state decoding fails, fall back to most recent user (backward compatibility)
-                pass
+        # Verify the signed state parameter and recover user_id from it
+        user_id = verify_oauth_state(state) if state else None
+        if user_id is None:
+            raise HTTPException(status_code=400, detail="Invalid OAuth state")
         
         # HubSpot's token endpoint requires specific parameters
         # Using direct HTTP request as authlib might not format it correctly
-        async with httpx.AsyncClient() as client:
-            token_response = await client.post(
-                "https://api.hubapi.com/oauth/v1/token",
-                data={
-                    "grant_type": "authorization_code",
-                    "client_id": settings.HUBSPOT_CLIENT_ID,
-                    "client_secret": settings.HUBSPOT_CLIENT_SECRET,
-                    "redirect_uri": settings.HUBSPOT_REDIRECT_URI,
-                    "code": code
-                },
-                headers={"Content-Type": "application/x-www-form-urlencoded"}
-            )
-            token_response.raise_for_status()
-            token = token_response.json()
+        token_response = await SHARED_CLIENT.post(
+            "https://api.hubapi.com/oauth/v1/token",
+            data={
+                "grant_type": "authorization_code",
+                "client_id": settings.HUBSPOT_CLIENT_ID,
+                "client_secret": settings.HUBSPOT_CLIENT_SECRET,
+                "redirect_uri": settings.HUBSPOT_REDIRECT_URI,
+                "code": code
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"}
+        )
+        token_response.raise_for_status()
+        token = orjson.loads(token_response.content)
         
         access_token = token["access_token"]
         refresh_token = token.get("refresh_token")
@@ -250,32 +261,35 @@ async def hubspot_callback(code: str, state: Optional[str] = None, db: Session =
         account_info = await hubspot_service.get_account_info()
         account_name = account_info.get("portalId") or "HubSpot Account"
         
-        # Get user by user_id from state, or fall back to most recent user
-        if user_id:
-            user = db.query(User).filter(User.id == user_id).first()
-        else:
-            # Fallback: get most recent user (for backward compatibility)
-            user = db.query(User).order_by(User.id.desc()).first()
+        # Update user with HubSpot tokens in a single statement
+        updated_id = (await db.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                hubspot_access_token=access_token,
+                hubspot_refresh_token=refresh_token,
+                hubspot_token_expires_at=expires_at,
+                hubspot_name=account_name
+            )
+            .returning(User.id)
+        )).scalar_one_or_none()
         
-        if not user:
+        if not updated_id:
             raise HTTPException(
                 status_code=404, 
                 detail="User not found. Please log in with Google first."
             )
         
-        # Update user with HubSpot tokens
-        user.hubspot_access_token = access_token
-        user.hubspot_refresh_token = refresh_token
-        user.hubspot_token_expires_at = expires_at
-        user.hubspot_name = account_name
-        
-        db.commit()
+        await db.commit()
+        invalidate_cached_user(updated_id)
         
         # Redirect to frontend
         return RedirectResponse(
             url=f"{settings.FRONTEND_URL}/auth/callback?hubspot=connected"
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -288,7 +302,7 @@ async def hubspot_callback(code: str, state: Optional[str] = None, db: Session =
 @router.get("/me")
 async def get_current_user(
     authorization: str = Header(None, alias="Authorization"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get current user information.
@@ -311,21 +325,14 @@ async def get_current_user(
         )
     
     user_id = payload.get("user_id")
-    user = db.query(User).filter(User.id == user_id).first()
     
-    if not user:
+    row = (await db.execute(_USER_PROFILE_BY_ID, {"uid": user_id})).one_or_none()
+    
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
     
-    return {
-        "id": user.id,
-        "email": user.email,
-        "name": user.name,
-        "google_email": user.google_email,
-        "hubspot_name": user.hubspot_name,
-        "has_google": bool(user.google_access_token),
-        "has_hubspot": bool(user.hubspot_access_token)
-    }
+    return dict(row._mapping)
 
@@ -3,29 +3,41 @@ Chat routes for AI agent conversations.
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from typing import Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.orm import Session, make_transient_to_detached, undefer_group
+from sqlalchemy import bindparam, desc, insert, select, tuple_
 from pydantic import BaseModel
 from typing import List, Optional
-from app.database import get_db
+from datetime import datetime
+import base64
+import orjson
+from app.database import get_db, SessionLocal
 from app.models import User, ChatMessage as ChatMessageModel
-from app.auth import verify_token
-from app.services.ai_agent import AIAgent
+from app.auth import verify_token, get_cached_user_fields, cache_user_fields
+from app.services.ai_agent import AIAgent, embed_instruction, invalidate_cached_instructions
+from app.services.chat_cache import chat_cache
 
 router = APIRouter()
 
+# Built once at import so the compiled statement is reused from the statement cache
+_USER_BY_ID = select(User).options(undefer_group("oauth_tokens")).where(User.id == bindparam("uid"))
 
-class ChatMessage(BaseModel):
-    """Chat message model."""
-    role: str  # "user" or "assistant"
-    content: str
+# Number of previous messages loaded as conversation context for the agent
+HISTORY_CONTEXT_MESSAGES = 20
+
+# User columns kept in the user cache; OAuth tokens are left out and load
+# from the database on first access
+USER_CACHE_FIELDS = (
+    "id", "email", "name",
+    "google_token_expires_at", "google_email",
+    "hubspot_token_expires_at", "hubspot_name"
+)
 
 
 class ChatRequest(BaseModel):
     """Chat request model."""
     message: str
-    conversation_history: Optional[List[ChatMessage]] = None
 
 
 class ChatResponse(BaseModel):
@@ -48,6 +60,29 @@ class ChatHistoryResponse(BaseModel):
     """Chat history response with pagination."""
     messages: List[ChatHistoryMessage]
     has_more: bool  # Whether there are more messages to load
+    next_cursor: Optional[str] = None  # Pass as before_cursor to load the next (older) page
+
+
+def encode_keyset_cursor(created_at: datetime, row_id: int) -> str:
+    """Encode a (created_at, id) keyset position as an opaque cursor."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_keyset_cursor(cursor: str) -> tuple:
+    """
+    Decode a cursor produced by encode_keyset_cursor.
+    
+    Raises:
+        HTTPException: If the cursor is malformed
+    """
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(row_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
 
 
 def get_current_user(
@@ -86,7 +121,16 @@ def get_current_user(
         )
     
     user_id = payload.get("user_id")
-    user = db.query(User).filter(User.id == user_id).first()
+    
+    # Rebuild the user from the cache and attach it to this session
+    # as a persistent object, without issuing a SELECT
+    fields = get_cached_user_fields(user_id)
+    if fields is not None:
+        user = User(**fields)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+    
+    user = db.execute(_USER_BY_ID, {"uid": user_id}).scalar_one_or_none()
     
     if not user:
         raise HTTPException(
@@ -94,9 +138,45 @@ def get_current_user(
             detail="User not found"
         )
     
+    cache_user_fields(user_id, {field: getattr(user, field) for field in USER_CACHE_FIELDS})
     return user
 
 
+def load_context_and_save_message(db: Session, user_id: int, message: str) -> List[dict]:
+    """
+    Load the recent conversation used as context, then save the new user message.
+    
+    Args:
+        db: Database session (committed by this call)
+        user_id: User ID
+        message: The user's new message
+        
+    Returns:
+        Previous messages as {"role", "content"} dicts, oldest first
+    """
+    # Load the most recent messages (newest first via the keyset index), then
+    # put them back in chronological order
+    recent_messages = db.query(ChatMessageModel.role, ChatMessageModel.content).filter(
+        ChatMessageModel.user_id == user_id
+    ).order_by(
+        desc(ChatMessageModel.created_at),
+        desc(ChatMessageModel.id)
+    ).limit(HISTORY_CONTEXT_MESSAGES).all()
+    history = [dict(msg._mapping) for msg in reversed(recent_messages)]
+    
+    # Save user message to database
+    db.execute(
+        insert(ChatMessageModel).values(
+            user_id=user_id,
+            role="user",
+            content=message,
+            error=False
+        )
+    )
+    db.commit()
+    return history
+
+
 @router.post("/", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
@@ -106,9 +186,10 @@ async def chat(
     """
     Process a chat message and return AI response.
     Saves both user and assistant messages to the database.
+    Conversation history is loaded from the saved messages.
     
     Args:
-        request: Chat request with message and conversation history
+        request: Chat request with message
         authorization: JWT token in Authorization header
         db: Database session
         
@@ -116,54 +197,104 @@ async def chat(
         Chat response with AI message or error
     """
     user = get_current_user(authorization, db)
+    user_id = user.id
     
-    # Save user message to database
-    user_message = ChatMessageModel(
-        user_id=user.id,
-        role="user",
-        content=request.message,
-        error=False
-    )
-    db.add(user_message)
-    db.commit()
-    db.refresh(user_message)
-    
-    # Convert conversation history to dict format
-    history = []
-    if request.conversation_history:
-        for msg in request.conversation_history:
-            history.append({
-                "role": msg.role,
-                "content": msg.content
-            })
-    
-    # Initialize AI agent
+    # Initialize AI agent (reads the OAuth tokens) before the commit below
+    # expires the user, then detach the user so later commits leave it loaded
     agent = AIAgent(db, user)
+    db.expunge(user)
+    history = load_context_and_save_message(db, user_id, request.message)
     
     # Process message
     result = await agent.chat(request.message, history)
     
-    # Save assistant message to database
-    assistant_message = ChatMessageModel(
-        user_id=user.id,
-        role="assistant",
-        content=result.get("response", "") or result.get("error", ""),
-        error=bool(result.get("error"))
-    )
-    db.add(assistant_message)
+    # Save assistant message to database, getting its ID back in the same statement
+    assistant_message_id = db.execute(
+        insert(ChatMessageModel).values(
+            user_id=user_id,
+            role="assistant",
+            content=result.get("response", "") or result.get("error", ""),
+            error=bool(result.get("error"))
+        ).returning(ChatMessageModel.id)
+    ).scalar_one()
     db.commit()
-    db.refresh(assistant_message)
     
     # Add message ID to response
-    result["message_id"] = assistant_message.id
+    result["message_id"] = assistant_message_id
     
     return ChatResponse(**result)
 
 
+@router.post("/stream")
+async def chat_stream(
+    request: ChatRequest,
+    authorization: Optional[str] = Header(None, alias="Authorization"),
+    db: Session = Depends(get_db)
+):
+    """
+    Process a chat message and stream the AI response as Server-Sent Events.
+    
+    Emits "data: {"delta": ...}" events as text is generated, an "error"
+    event if processing fails, and a final "done" event carrying the ID of
+    the saved assistant message.
+    
+    Args:
+        request: Chat request with message
+        authorization: JWT token in Authorization header
+        db: Database session
+        
+    Returns:
+        text/event-stream response
+    """
+    user = get_current_user(authorization, db)
+    user_id = user.id
+    history = load_context_and_save_message(db, user_id, request.message)
+    
+    async def event_stream():
+        # The request session may be closed before the stream finishes,
+        # so the agent and the final insert use their own session
+        stream_db = SessionLocal()
+        try:
+            response_parts = []
+            error = None
+            try:
+                # Re-load the user with its tokens in this session (the request's
+                # copy was expired by the commit above) and detach it so the
+                # agent's commits leave it loaded; ending the read transaction
+                # returns the connection to the pool while the model streams
+                stream_user = stream_db.execute(_USER_BY_ID, {"uid": user_id}).scalar_one()
+                stream_db.expunge(stream_user)
+                stream_db.rollback()
+                agent = AIAgent(stream_db, stream_user)
+                async for delta in agent.chat_stream(request.message, history):
+                    response_parts.append(delta)
+                    yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+            except Exception as e:
+                error = f"Error processing message: {str(e)}"
+                yield f"event: error\ndata: {orjson.dumps({'error': error}).decode()}\n\n"
+            
+            # Save assistant message to database
+            assistant_message_id = stream_db.execute(
+                insert(ChatMessageModel).values(
+                    user_id=user_id,
+                    role="assistant",
+                    content=error or "".join(response_parts),
+                    error=bool(error)
+                ).returning(ChatMessageModel.id)
+            ).scalar_one()
+            stream_db.commit()
+            
+            yield f"event: done\ndata: {orjson.dumps({'message_id': assistant_message_id}).decode()}\n\n"
+        finally:
+            stream_db.close()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.get("/history", response_model=ChatHistoryResponse)
 async def get_chat_history(
     limit: int = Query(20, ge=1, le=50, description="Number of messages to fetch"),
-    before_id: Optional[int] = Query(None, description="Fetch messages before this ID (for pagination)"),
+    before_cursor: Optional[str] = Query(None, description="Fetch messages before this cursor (for pagination)"),
     authorization: Optional[str] = Header(None, alias="Authorization"),
     db: Session = Depends(get_db)
 ):
@@ -173,7 +304,7 @@ async def get_chat_history(
     
     Args:
         limit: Number of messages to fetch (default 20, max 50)
-        before_id: Fetch messages created before this message ID (for infinite scroll)
+        before_cursor: next_cursor from the previous page (for infinite scroll)
         authorization: JWT token
         db: Database session
         
@@ -182,50 +313,56 @@ async def get_chat_history(
     """
     user = get_current_user(authorization, db)
     
-    # Build query
-    query = db.query(ChatMessageModel).filter(
+    # Build query (only the columns the response needs)
+    query = db.query(
+        ChatMessageModel.id,
+        ChatMessageModel.role,
+        ChatMessageModel.content,
+        ChatMessageModel.error,
+        ChatMessageModel.created_at
+    ).filter(
         ChatMessageModel.user_id == user.id
     )
     
-    # If before_id is provided, fetch older messages
-    # Get the message with before_id to use its timestamp for filtering
-    if before_id:
-        before_message = db.query(ChatMessageModel).filter(
-            ChatMessageModel.id == before_id,
-            ChatMessageModel.user_id == user.id
-        ).first()
-        if before_message and before_message.created_at:
-            # Filter by created_at to ensure we get older messages
-            query = query.filter(ChatMessageModel.created_at < before_message.created_at)
-        else:
-            # Fallback to ID filtering if timestamp not available
-            query = query.filter(ChatMessageModel.id < before_id)
+    # If a cursor is provided, fetch older messages using keyset pagination
+    # on (created_at, id), which stays correct when timestamps tie
+    if before_cursor:
+        before_created_at, before_id = decode_keyset_cursor(before_cursor)
+        query = query.filter(
+            tuple_(ChatMessageModel.created_at, ChatMessageModel.id) < tuple_(before_created_at, before_id)
+        )
     
     # Order by created_at descending (newest first) and limit
     # We fetch limit+1 to check if there are more messages
-    messages = query.order_by(desc(ChatMessageModel.created_at)).limit(limit + 1).all()
+    messages = query.order_by(
+        desc(ChatMessageModel.created_at),
+        desc(ChatMessageModel.id)
+    ).limit(limit + 1).all()
     
     # Check if there are more messages
     has_more = len(messages) > limit
+    next_cursor = None
     if has_more:
         messages = messages[:limit]  # Remove the extra message
+        next_cursor = encode_keyset_cursor(messages[-1].created_at, messages[-1].id)
     
-    # Convert to response format
-    history_messages = [
-        ChatHistoryMessage(
-            id=msg.id,
-            role=msg.role,
-            content=msg.content,
-            error=msg.error,
-            timestamp=msg.created_at.isoformat() if msg.created_at else ""
-        )
-        for msg in messages
-    ]
-    
-    return ChatHistoryResponse(
-        messages=history_messages,
-        has_more=has_more
-    )
+    # Rows come straight from the database, so the response is serialized
+    # directly; returning a Response skips FastAPI's response_model
+    # validation, which still documents the shape
+    return ORJSONResponse({
+        "messages": [
+            {
+                "id": msg.id,
+                "role": msg.role,
+                "content": msg.content,
+                "error": msg.error,
+                "timestamp": msg.created_at.isoformat() if msg.created_at else ""
+            }
+            for msg in messages
+        ],
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    })
 
 
 @router.post("/ongoing-instruction")
@@ -248,19 +385,29 @@ async def add_ongoing_instruction(
         Created instruction
     """
     user = get_current_user(authorization, db)
+    # Read before the commit below expires the user
+    user_id = user.id
     
     from app.models import OngoingInstruction
     
-    ongoing_instruction = OngoingInstruction(
-        user_id=user.id,
-        instruction=instruction,
-        trigger_type=trigger_type,
-        is_active=True
-    )
-    
-    db.add(ongoing_instruction)
+    ongoing_instruction = db.execute(
+        insert(OngoingInstruction).values(
+            user_id=user_id,
+            instruction=instruction,
+            trigger_type=trigger_type,
+            is_active=True,
+            embedding=await embed_instruction(instruction)
+        ).returning(
+            OngoingInstruction.id,
+            OngoingInstruction.instruction,
+            OngoingInstruction.trigger_type
+        )
+    ).one()
     db.commit()
-    db.refresh(ongoing_instruction)
+    
+    # Cached prompts and answers were built without the new instruction
+    invalidate_cached_instructions(user_id)
+    chat_cache.invalidate(user_id)
     
     return {
         "id": ongoing_instruction.id,
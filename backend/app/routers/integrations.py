@@ -5,16 +5,24 @@ Integration routes for syncing data from Gmail, Calendar, and HubSpot.
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Header
 from typing import Optional
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
 import httpx
 from app.database import get_db, SessionLocal
-from app.models import User, Email, Contact
+from app.models import User, Email, Contact, SyncStatus
 from app.services.google_service import GoogleService
 from app.services.hubspot_service import HubSpotService
-from app.services.rag_service import get_embedding
+from app.services.rag_service import get_embeddings_batch
+from app.services.chat_cache import chat_cache
+from app.services.ai_agent import invalidate_cached_context, queue_trigger_events, trigger_batches
 from app.routers.chat import get_current_user
+from app.auth import invalidate_cached_user
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -23,9 +31,61 @@ class SyncRequest(BaseModel):
     """Request model for sync operations."""
     sync_mode: str = "month"  # "month" or "all"
 
-# In-memory sync status tracking
-# Format: {user_id: {"gmail": {"syncing": bool, "started_at": datetime}, "hubspot": {...}}}
-sync_status = {}
+# Messages with these labels are ignored by the poller (messages.list skips them by default)
+SKIPPED_GMAIL_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+# Maximum number of users polled at the same time by scheduled_email_polling
+# (polls release their database connection during network calls, so this
+# bounds Gmail/OpenAI concurrency rather than pool usage)
+MAX_CONCURRENT_POLLS = 20
+
+# Number of user IDs loaded per page by scheduled_email_polling
+POLL_USER_BATCH_SIZE = 500
+
+# A sync still marked as running after this long is assumed to have died with its worker
+SYNC_STATUS_TTL = timedelta(hours=24)
+
+
+def update_sync_status(db: Session, user_id: int, source: str, **fields):
+    """
+    Create or update the sync status row for a user and source.
+    Stored in the database so every worker process sees the same status.
+    
+    Args:
+        db: Database session (committed by this call)
+        user_id: User ID
+        source: "gmail" or "hubspot"
+        **fields: SyncStatus columns to set
+    """
+    stmt = pg_insert(SyncStatus).values(user_id=user_id, source=source, **fields)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SyncStatus.user_id, SyncStatus.source],
+        set_={name: stmt.excluded[name] for name in fields}
+    )
+    db.execute(stmt)
+    db.commit()
+
+
+def get_sync_status(db: Session, user_id: int) -> dict:
+    """
+    Get the sync status of every source for a user.
+    
+    Returns:
+        {source: {"syncing": bool, "sync_mode": ..., "started_at": ..., ...}}
+    """
+    stale_before = datetime.now(timezone.utc) - SYNC_STATUS_TTL
+    rows = db.query(SyncStatus).filter(SyncStatus.user_id == user_id).all()
+    return {
+        row.source: {
+            "syncing": bool(row.syncing) and row.started_at is not None and row.started_at > stale_before,
+            "sync_mode": row.sync_mode,
+            "started_at": row.started_at.isoformat() if row.started_at else None,
+            "completed_at": row.completed_at.isoformat() if row.completed_at else None,
+            "imported_count": row.imported_count,
+            "error": row.error
+        }
+        for row in rows
+    }
 
 
 def clear_google_connection(user: User, db: Session):
@@ -35,7 +95,8 @@ def clear_google_connection(user: User, db: Session):
     user.google_token_expires_at = None
     user.google_email = None
     db.commit()
-    print(f"Cleared Google connection for user {user.id} due to expired token")
+    invalidate_cached_user(user.id)
+    logger.info("Cleared Google connection for user %s due to expired token", user.id)
 
 
 def clear_hubspot_connection(user: User, db: Session):
@@ -46,7 +107,8 @@ def clear_hubspot_connection(user: User, db: Session):
     user.hubspot_name = None
     user.hubspot_contact_id = None
     db.commit()
-    print(f"Cleared HubSpot connection for user {user.id} due to expired token")
+    invalidate_cached_user(user.id)
+    logger.info("Cleared HubSpot connection for user %s due to expired token", user.id)
 
 
 @router.post("/sync/gmail")
@@ -70,14 +132,16 @@ async def sync_gmail(
             detail="Google not connected"
         )
     
-    # Mark sync as in progress
-    if user.id not in sync_status:
-        sync_status[user.id] = {}
-    sync_status[user.id]["gmail"] = {
-        "syncing": True,
-        "sync_mode": request.sync_mode,
-        "started_at": datetime.now(timezone.utc).isoformat()
-    }
+    # Mark sync as in progress (clearing the previous run's results)
+    update_sync_status(
+        db, user.id, "gmail",
+        syncing=True,
+        sync_mode=request.sync_mode,
+        started_at=datetime.now(timezone.utc),
+        completed_at=None,
+        imported_count=None,
+        error=None
+    )
     
     # Add background task - don't pass db session, create new one in background task
     background_tasks.add_task(sync_gmail_background, user.id, request.sync_mode)
@@ -97,7 +161,7 @@ async def sync_gmail_background(user_id: int, sync_mode: str = "month"):
     # Create a new database session for the background task
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).options(undefer_group("oauth_tokens")).filter(User.id == user_id).first()
         if not user or not user.google_access_token:
             return
         
@@ -124,102 +188,136 @@ async def sync_gmail_background(user_id: int, sync_mode: str = "month"):
                     if e.response.status_code == 401:
                         # Token expired, clear connection
                         clear_google_connection(user, db)
-                        if user_id in sync_status and "gmail" in sync_status[user_id]:
-                            sync_status[user_id]["gmail"]["syncing"] = False
-                            sync_status[user_id]["gmail"]["error"] = "Google token expired. Please reconnect."
-                            sync_status[user_id]["gmail"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                        print(f"Gmail sync failed for user {user_id}: Token expired (401)")
+                        update_sync_status(
+                            db, user_id, "gmail",
+                            syncing=False,
+                            error="Google token expired. Please reconnect.",
+                            completed_at=datetime.now(timezone.utc)
+                        )
+                        logger.warning("Gmail sync failed for user %s: Token expired (401)", user_id)
                         return
                     raise
                 
                 messages = result.get("messages", [])
                 
-                for msg in messages:
-                    gmail_id = msg["id"]
-                    
-                    # Check if already imported
-                    existing = db.query(Email).filter(
+                # Look up which messages on this page are already imported in one query
+                gmail_ids = [m["id"] for m in messages]
+                existing_ids = {
+                    row[0] for row in db.query(Email.gmail_id).filter(
                         Email.user_id == user_id,
-                        Email.gmail_id == gmail_id
-                    ).first()
-                    
-                    if existing:
-                        continue
-                    
-                    # Get full email
-                    try:
-                        email_data = await google_service.get_email(gmail_id)
-                    except httpx.HTTPStatusError as e:
-                        if e.response.status_code == 401:
-                            # Token expired, clear connection
-                            clear_google_connection(user, db)
-                            if user_id in sync_status and "gmail" in sync_status[user_id]:
-                                sync_status[user_id]["gmail"]["syncing"] = False
-                                sync_status[user_id]["gmail"]["error"] = "Google token expired. Please reconnect."
-                                sync_status[user_id]["gmail"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                            print(f"Gmail sync failed for user {user_id}: Token expired (401)")
-                            return
-                        raise
+                        Email.gmail_id.in_(gmail_ids)
+                    ).all()
+                }
+                
+                # Fetch all new emails on this page with Gmail batch requests
+                new_ids = [gmail_id for gmail_id in gmail_ids if gmail_id not in existing_ids]
+                try:
+                    emails_data = await google_service.get_emails_batch(new_ids)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 401:
+                        # Token expired, clear connection
+                        clear_google_connection(user, db)
+                        update_sync_status(
+                            db, user_id, "gmail",
+                            syncing=False,
+                            error="Google token expired. Please reconnect.",
+                            completed_at=datetime.now(timezone.utc)
+                        )
+                        logger.warning("Gmail sync failed for user %s: Token expired (401)", user_id)
+                        return
+                    raise
+                
+                new_emails = []
+                email_texts = []
+                for email_data in emails_data:
+                    gmail_id = email_data["id"]
                     parsed = google_service._parse_email(email_data)
                     
-                    # Create email record
-                    email_obj = Email(
-                        user_id=user_id,
-                        gmail_id=gmail_id,
-                        thread_id=parsed.get("thread_id"),
-                        subject=parsed.get("subject"),
-                        from_email=parsed.get("from_email"),
-                        to_emails=parsed.get("to_emails"),
-                        cc_emails=parsed.get("cc_emails"),
-                        body_text=parsed.get("body_text"),
-                        body_html=parsed.get("body_html"),
-                        received_at=parsed.get("received_at")
+                    # Queue email record for the page's bulk insert
+                    new_emails.append({
+                        "user_id": user_id,
+                        "gmail_id": gmail_id,
+                        "thread_id": parsed.get("thread_id"),
+                        "subject": parsed.get("subject"),
+                        "from_email": parsed.get("from_email"),
+                        "to_emails": parsed.get("to_emails"),
+                        "cc_emails": parsed.get("cc_emails"),
+                        "body_text": parsed.get("body_text"),
+                        "body_html": parsed.get("body_html"),
+                        "received_at": parsed.get("received_at"),
+                        "embedding": None
+                    })
+                    email_texts.append(f"{parsed.get('subject', '')} {parsed.get('body_text', '')}")
+                
+                # Create embeddings for the whole page with one batched API call
+                embed_rows = [
+                    (row, text_content)
+                    for row, text_content in zip(new_emails, email_texts)
+                    if text_content.strip()
+                ]
+                if embed_rows:
+                    embeddings = await get_embeddings_batch([text_content for _, text_content in embed_rows])
+                    for (row, _), embedding in zip(embed_rows, embeddings):
+                        row["embedding"] = embedding
+                
+                # Insert the whole page in one idempotent statement and one commit
+                # Rows another sync/poll inserted meanwhile are skipped by the unique index
+                if new_emails:
+                    inserted_ids = set(db.execute(
+                        pg_insert(Email)
+                        .values(new_emails)
+                        .on_conflict_do_nothing(index_elements=["user_id", "gmail_id"])
+                        .returning(Email.gmail_id)
+                    ).scalars())
+                    new_emails = [row for row in new_emails if row["gmail_id"] in inserted_ids]
+                    db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(email_count=User.email_count + len(new_emails))
                     )
                     
-                    db.add(email_obj)
+                    # Queue ongoing-instruction processing for the new emails in the same
+                    # transaction, so they are processed (via the Batch API) even across restarts
+                    queue_trigger_events(db, user_id, "email", [
+                        {
+                            "email_id": row["gmail_id"],
+                            "from": row["from_email"],
+                            "subject": row["subject"],
+                            "body": row["body_text"]
+                        }
+                        for row in new_emails
+                    ], [row.get("embedding") for row in new_emails])
                     db.commit()
-                    db.refresh(email_obj)
-                    
-                    # Create embedding
-                    text_content = f"{parsed.get('subject', '')} {parsed.get('body_text', '')}"
-                    if text_content.strip():
-                        embedding = get_embedding(text_content)
-                        email_obj.embedding = embedding
-                        db.commit()
-                    
-                    imported_count += 1
-                    
-                    # Process ongoing instructions for new email
-                    from app.services.ai_agent import AIAgent
-                    agent = AIAgent(db, user)
-                    await agent.process_ongoing_instructions("email", {
-                        "email_id": gmail_id,
-                        "from": parsed.get("from_email"),
-                        "subject": parsed.get("subject"),
-                        "body": parsed.get("body_text")
-                    })
+                    imported_count += len(new_emails)
+                    if new_emails:
+                        chat_cache.invalidate(user_id)
+                        invalidate_cached_context(user_id)
+                        trigger_batches.notify(len(new_emails))
                 
                 page_token = result.get("nextPageToken")
                 if not page_token:
                     break
             
             # Mark sync as completed
-            if user_id in sync_status and "gmail" in sync_status[user_id]:
-                sync_status[user_id]["gmail"]["syncing"] = False
-                sync_status[user_id]["gmail"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                sync_status[user_id]["gmail"]["imported_count"] = imported_count
+            update_sync_status(
+                db, user_id, "gmail",
+                syncing=False,
+                completed_at=datetime.now(timezone.utc),
+                imported_count=imported_count
+            )
             
-            print(f"Gmail sync completed for user {user_id} ({sync_mode} mode). Imported {imported_count} emails.")
+            logger.info("Gmail sync completed for user %s (%s mode). Imported %d emails.", user_id, sync_mode, imported_count)
         
         except Exception as e:
-            print(f"Error syncing Gmail for user {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error syncing Gmail for user %s", user_id)
             # Mark sync as failed
-            if user_id in sync_status and "gmail" in sync_status[user_id]:
-                sync_status[user_id]["gmail"]["syncing"] = False
-                sync_status[user_id]["gmail"]["error"] = str(e)
-                sync_status[user_id]["gmail"]["completed_at"] = datetime.now(timezone.utc).isoformat()
+            db.rollback()
+            update_sync_status(
+                db, user_id, "gmail",
+                syncing=False,
+                error=str(e),
+                completed_at=datetime.now(timezone.utc)
+            )
     finally:
         # Always close the database session
         db.close()
@@ -246,14 +344,16 @@ async def sync_hubspot(
             detail="HubSpot not connected"
         )
     
-    # Mark sync as in progress
-    if user.id not in sync_status:
-        sync_status[user.id] = {}
-    sync_status[user.id]["hubspot"] = {
-        "syncing": True,
-        "sync_mode": request.sync_mode,
-        "started_at": datetime.now(timezone.utc).isoformat()
-    }
+    # Mark sync as in progress (clearing the previous run's results)
+    update_sync_status(
+        db, user.id, "hubspot",
+        syncing=True,
+        sync_mode=request.sync_mode,
+        started_at=datetime.now(timezone.utc),
+        completed_at=None,
+        imported_count=None,
+        error=None
+    )
     
     # Add background task - don't pass db session, create new one in background task
     background_tasks.add_task(sync_hubspot_background, user.id, request.sync_mode)
@@ -273,7 +373,7 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
     # Create a new database session for the background task
     db = SessionLocal()
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).options(undefer_group("oauth_tokens")).filter(User.id == user_id).first()
         if not user or not user.hubspot_access_token:
             return
         
@@ -296,16 +396,29 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
                     if e.response.status_code == 401:
                         # Token expired, clear connection
                         clear_hubspot_connection(user, db)
-                        if user_id in sync_status and "hubspot" in sync_status[user_id]:
-                            sync_status[user_id]["hubspot"]["syncing"] = False
-                            sync_status[user_id]["hubspot"]["error"] = "HubSpot token expired. Please reconnect."
-                            sync_status[user_id]["hubspot"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                        print(f"HubSpot sync failed for user {user_id}: Token expired (401)")
+                        update_sync_status(
+                            db, user_id, "hubspot",
+                            syncing=False,
+                            error="HubSpot token expired. Please reconnect.",
+                            completed_at=datetime.now(timezone.utc)
+                        )
+                        logger.warning("HubSpot sync failed for user %s: Token expired (401)", user_id)
                         return
                     raise
                 
                 contacts = result.get("results", [])
                 
+                # Load the already-imported contacts on this page in one query
+                hubspot_ids = [c["id"] for c in contacts]
+                existing_contacts = {
+                    c.hubspot_id: c for c in db.query(Contact).filter(
+                        Contact.user_id == user_id,
+                        Contact.hubspot_id.in_(hubspot_ids)
+                    ).all()
+                }
+                
+                new_contacts = []
+                contact_texts = []
                 for contact_data in contacts:
                     hubspot_id = contact_data["id"]
                     properties = contact_data.get("properties", {})
@@ -329,10 +442,7 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
                                 pass
                     
                     # Check if already imported
-                    existing = db.query(Contact).filter(
-                        Contact.user_id == user_id,
-                        Contact.hubspot_id == hubspot_id
-                    ).first()
+                    existing = existing_contacts.get(hubspot_id)
                     
                     if existing:
                         # Update existing
@@ -350,11 +460,13 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
                             if e.response.status_code == 401:
                                 # Token expired, clear connection
                                 clear_hubspot_connection(user, db)
-                                if user_id in sync_status and "hubspot" in sync_status[user_id]:
-                                    sync_status[user_id]["hubspot"]["syncing"] = False
-                                    sync_status[user_id]["hubspot"]["error"] = "HubSpot token expired. Please reconnect."
-                                    sync_status[user_id]["hubspot"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                                print(f"HubSpot sync failed for user {user_id}: Token expired (401)")
+                                update_sync_status(
+                                    db, user_id, "hubspot",
+                                    syncing=False,
+                                    error="HubSpot token expired. Please reconnect.",
+                                    completed_at=datetime.now(timezone.utc)
+                                )
+                                logger.warning("HubSpot sync failed for user %s: Token expired (401)", user_id)
                                 return
                             raise
                         notes_text = "\n".join([
@@ -362,31 +474,51 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
                             for n in notes_data
                         ])
                         
-                        # Create contact
-                        contact_obj = Contact(
-                            user_id=user_id,
-                            hubspot_id=hubspot_id,
-                            email=properties.get("email"),
-                            first_name=properties.get("firstname"),
-                            last_name=properties.get("lastname"),
-                            phone=properties.get("phone"),
-                            company=properties.get("company"),
-                            notes=notes_text,
-                            raw_data=contact_data
+                        # Queue contact for the page's bulk insert
+                        new_contacts.append({
+                            "user_id": user_id,
+                            "hubspot_id": hubspot_id,
+                            "email": properties.get("email"),
+                            "first_name": properties.get("firstname"),
+                            "last_name": properties.get("lastname"),
+                            "phone": properties.get("phone"),
+                            "company": properties.get("company"),
+                            "notes": notes_text,
+                            "raw_data": contact_data,
+                            "embedding": None
+                        })
+                        contact_texts.append(
+                            f"{properties.get('firstname', '')} {properties.get('lastname', '')} {properties.get('email', '')} {notes_text}"
                         )
-                        
-                        db.add(contact_obj)
-                        db.commit()
-                        db.refresh(contact_obj)
-                        
-                        # Create embedding
-                        text_content = f"{properties.get('firstname', '')} {properties.get('lastname', '')} {properties.get('email', '')} {notes_text}"
-                        if text_content.strip():
-                            embedding = get_embedding(text_content)
-                            contact_obj.embedding = embedding
-                            db.commit()
-                        
-                        imported_count += 1
+                
+                # Create embeddings for the page's new contacts with one batched API call
+                embed_rows = [
+                    (row, text_content)
+                    for row, text_content in zip(new_contacts, contact_texts)
+                    if text_content.strip()
+                ]
+                if embed_rows:
+                    embeddings = await get_embeddings_batch([text_content for _, text_content in embed_rows])
+                    for (row, _), embedding in zip(embed_rows, embeddings):
+                        row["embedding"] = embedding
+                
+                # Insert new contacts and save updates with a single commit per page
+                if new_contacts:
+                    inserted_count = len(db.execute(
+                        pg_insert(Contact)
+                        .values(new_contacts)
+                        .on_conflict_do_nothing(index_elements=["user_id", "hubspot_id"])
+                        .returning(Contact.id)
+                    ).all())
+                    db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(contact_count=User.contact_count + inserted_count)
+                    )
+                    imported_count += inserted_count
+                db.commit()
+                chat_cache.invalidate(user_id)
+                invalidate_cached_context(user_id)
                 
                 # Check for pagination
                 paging = result.get("paging", {})
@@ -395,22 +527,25 @@ async def sync_hubspot_background(user_id: int, sync_mode: str = "month"):
                     break
             
             # Mark sync as completed
-            if user_id in sync_status and "hubspot" in sync_status[user_id]:
-                sync_status[user_id]["hubspot"]["syncing"] = False
-                sync_status[user_id]["hubspot"]["completed_at"] = datetime.now(timezone.utc).isoformat()
-                sync_status[user_id]["hubspot"]["imported_count"] = imported_count
+            update_sync_status(
+                db, user_id, "hubspot",
+                syncing=False,
+                completed_at=datetime.now(timezone.utc),
+                imported_count=imported_count
+            )
             
-            print(f"HubSpot sync completed for user {user_id} ({sync_mode} mode). Imported {imported_count} contacts.")
+            logger.info("HubSpot sync completed for user %s (%s mode). Imported %d contacts.", user_id, sync_mode, imported_count)
         
         except Exception as e:
-            print(f"Error syncing HubSpot for user {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Error syncing HubSpot for user %s", user_id)
             # Mark sync as failed
-            if user_id in sync_status and "hubspot" in sync_status[user_id]:
-                sync_status[user_id]["hubspot"]["syncing"] = False
-                sync_status[user_id]["hubspot"]["error"] = str(e)
-                sync_status[user_id]["hubspot"]["completed_at"] = datetime.now(timezone.utc).isoformat()
+            db.rollback()
+            update_sync_status(
+                db, user_id, "hubspot",
+                syncing=False,
+                error=str(e),
+                completed_at=datetime.now(timezone.utc)
+            )
     finally:
         # Always close the database session
         db.close()
@@ -426,12 +561,8 @@ async def get_integration_status(
     """
     user = get_current_user(authorization, db)
     
-    # Count emails and contacts
-    email_count = db.query(Email).filter(Email.user_id == user.id).count()
-    contact_count = db.query(Contact).filter(Contact.user_id == user.id).count()
-    
     # Get sync status
-    user_sync_status = sync_status.get(user.id, {})
+    user_sync_status = get_sync_status(db, user.id)
     gmail_sync = user_sync_status.get("gmail", {"syncing": False})
     hubspot_sync = user_sync_status.get("hubspot", {"syncing": False})
     
@@ -439,13 +570,13 @@ async def get_integration_status(
         "google": {
             "connected": bool(user.google_access_token),
             "email": user.google_email,
-            "email_count": email_count,
+            "email_count": user.email_count,
             "syncing": gmail_sync.get("syncing", False)
         },
         "hubspot": {
             "connected": bool(user.hubspot_access_token),
             "name": user.hubspot_name,
-            "contact_count": contact_count,
+            "contact_count": user.contact_count,
             "syncing": hubspot_sync.get("syncing", False)
         }
     }
@@ -454,180 +585,235 @@ async def get_integration_status(
 async def poll_new_emails(user_id: int):
     """
     Scheduled polling function to check for new emails.
-    Only imports emails received in the last 10 minutes (to avoid missing any).
-    Runs automatically every 5 minutes.
+    Uses the Gmail history API to import only messages added since the
+    historyId stored on the user by the previous poll.
+    
+    Read transactions are committed before every Gmail/OpenAI call, so a
+    poll only holds a pooled connection while it is talking to the database.
     """
-    db = SessionLocal()
+    # Objects stay loaded across those commits instead of being re-selected
+    db = SessionLocal(expire_on_commit=False)
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = db.query(User).options(undefer_group("oauth_tokens")).filter(User.id == user_id).first()
         if not user or not user.google_access_token:
             return
         
         # Don't poll if a manual sync is already in progress
-        if user_id in sync_status and sync_status[user_id].get("gmail", {}).get("syncing", False):
+        if get_sync_status(db, user_id).get("gmail", {}).get("syncing", False):
             return
 
         # Check if token is expired - if so, skip polling (user will need to reconnect)
         if user.google_token_expires_at:
             now = datetime.now(timezone.utc)
             if user.google_token_expires_at < now:
-                print(f"Skipping email polling for user {user_id}: Token expired")
+                logger.info("Skipping email polling for user %s: Token expired", user_id)
                 return
         
         # Refresh user object to ensure we have the latest token
         db.refresh(user)
         if not user.google_access_token:
             return
+        db.commit()
         
         google_service = GoogleService(user.google_access_token)
         
-        # Get the most recent email's received_at timestamp
-        # Check for emails received in the last 10 minutes (to catch any we might have missed)
-        cutoff_time = datetime.now(timezone.utc) - timedelta(minutes=10)
-        
-        # Convert to Unix timestamp for Gmail query
-        cutoff_timestamp = int(cutoff_time.timestamp())
-        
-        # Gmail query to get emails after the cutoff time
-        query = f"after:{cutoff_timestamp}"
+        # First poll for this user: start tracking from the mailbox's current
+        # historyId (earlier mail is imported by the manual sync)
+        if not user.last_history_id:
+            profile = await google_service.get_gmail_profile()
+            user.last_history_id = profile.get("historyId")
+            db.commit()
+            return
         
         imported_count = 0
         page_token = None
+        latest_history_id = user.last_history_id
         
         try:
             while True:
+                # Ask Gmail for exactly the messages added since the last poll
                 try:
-                    result = await google_service.list_emails(
-                        max_results=100, 
-                        page_token=page_token,
-                        query=query
+                    result = await google_service.list_history(
+                        start_history_id=user.last_history_id,
+                        page_token=page_token
                     )
                 except httpx.HTTPStatusError as e:
                     if e.response.status_code == 401:
                         # Token expired, clear connection
                         clear_google_connection(user, db)
-                        print(f"Email polling failed for user {user_id}: Token expired (401). Connection cleared.")
+                        logger.warning("Email polling failed for user %s: Token expired (401). Connection cleared.", user_id)
+                        return
+                    if e.response.status_code == 404:
+                        # Stored historyId is too old; restart tracking from the current one
+                        profile = await google_service.get_gmail_profile()
+                        user.last_history_id = profile.get("historyId")
+                        db.commit()
+                        logger.info("Gmail history expired for user %s; polling restarted from current mailbox state", user_id)
                         return
                     raise
                 
-                messages = result.get("messages", [])
+                latest_history_id = result.get("historyId", latest_history_id)
                 
-                if not messages:
-                    break
+                # Collect added messages, skipping drafts, spam and trash like messages.list does
+                gmail_ids = list(dict.fromkeys(
+                    added["message"]["id"]
+                    for record in result.get("history", [])
+                    for added in record.get("messagesAdded", [])
+                    if not SKIPPED_GMAIL_LABELS.intersection(added["message"].get("labelIds", []))
+                ))
                 
-                for msg in messages:
-                    gmail_id = msg["id"]
-                    
-                    # Check if already imported
-                    existing = db.query(Email).filter(
+                # Look up which messages on this page are already imported in one query
+                existing_ids = {
+                    row[0] for row in db.query(Email.gmail_id).filter(
                         Email.user_id == user_id,
-                        Email.gmail_id == gmail_id
-                    ).first()
-                    
-                    if existing:
-                        continue
-                    
-                    # Get full email
-                    try:
-                        email_data = await google_service.get_email(gmail_id)
-                    except httpx.HTTPStatusError as e:
-                        if e.response.status_code == 401:
-                            # Token expired, clear connection
-                            clear_google_connection(user, db)
-                            print(f"Email polling failed for user {user_id}: Token expired (401). Connection cleared.")
-                            return
-                        raise
+                        Email.gmail_id.in_(gmail_ids)
+                    ).all()
+                } if gmail_ids else set()
+                db.commit()
+                
+                # Fetch all new emails on this page with Gmail batch requests
+                new_ids = [gmail_id for gmail_id in gmail_ids if gmail_id not in existing_ids]
+                try:
+                    emails_data = await google_service.get_emails_batch(new_ids)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 401:
+                        # Token expired, clear connection
+                        clear_google_connection(user, db)
+                        logger.warning("Email polling failed for user %s: Token expired (401). Connection cleared.", user_id)
+                        return
+                    raise
+                
+                new_emails = []
+                email_texts = []
+                for email_data in emails_data:
+                    gmail_id = email_data["id"]
                     parsed = google_service._parse_email(email_data)
                     
-                    # Only import if received after cutoff (double check)
-                    if parsed.get("received_at"):
-                        try:
-                            from dateutil import parser
-                            received_at = parser.parse(parsed["received_at"])
-                            # Convert to UTC naive datetime for comparison
-                            if received_at.tzinfo:
-                                received_at = received_at.astimezone(tz=None).replace(tzinfo=None)
-                            if received_at < cutoff_time:
-                                continue
-                        except:
-                            # If parsing fails, import anyway (better safe than sorry)
-                            pass
-                    
-                    # Create email record
-                    email_obj = Email(
-                        user_id=user_id,
-                        gmail_id=gmail_id,
-                        thread_id=parsed.get("thread_id"),
-                        subject=parsed.get("subject"),
-                        from_email=parsed.get("from_email"),
-                        to_emails=parsed.get("to_emails"),
-                        cc_emails=parsed.get("cc_emails"),
-                        body_text=parsed.get("body_text"),
-                        body_html=parsed.get("body_html"),
-                        received_at=parsed.get("received_at")
+                    # Queue email record for the page's bulk insert
+                    new_emails.append({
+                        "user_id": user_id,
+                        "gmail_id": gmail_id,
+                        "thread_id": parsed.get("thread_id"),
+                        "subject": parsed.get("subject"),
+                        "from_email": parsed.get("from_email"),
+                        "to_emails": parsed.get("to_emails"),
+                        "cc_emails": parsed.get("cc_emails"),
+                        "body_text": parsed.get("body_text"),
+                        "body_html": parsed.get("body_html"),
+                        "received_at": parsed.get("received_at"),
+                        "embedding": None
+                    })
+                    email_texts.append(f"{parsed.get('subject', '')} {parsed.get('body_text', '')}")
+                
+                # Create embeddings for the whole page with one batched API call
+                embed_rows = [
+                    (row, text_content)
+                    for row, text_content in zip(new_emails, email_texts)
+                    if text_content.strip()
+                ]
+                if embed_rows:
+                    embeddings = await get_embeddings_batch([text_content for _, text_content in embed_rows])
+                    for (row, _), embedding in zip(embed_rows, embeddings):
+                        row["embedding"] = embedding
+                
+                # Insert the whole page in one idempotent statement and one commit
+                # Rows another sync/poll inserted meanwhile are skipped by the unique index
+                if new_emails:
+                    inserted_ids = set(db.execute(
+                        pg_insert(Email)
+                        .values(new_emails)
+                        .on_conflict_do_nothing(index_elements=["user_id", "gmail_id"])
+                        .returning(Email.gmail_id)
+                    ).scalars())
+                    new_emails = [row for row in new_emails if row["gmail_id"] in inserted_ids]
+                    db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(email_count=User.email_count + len(new_emails))
                     )
                     
-                    db.add(email_obj)
+                    # Queue ongoing-instruction processing for the new emails in the same
+                    # transaction, so they are processed (via the Batch API) even across restarts
+                    queue_trigger_events(db, user_id, "email", [
+                        {
+                            "email_id": row["gmail_id"],
+                            "from": row["from_email"],
+                            "subject": row["subject"],
+                            "body": row["body_text"]
+                        }
+                        for row in new_emails
+                    ], [row.get("embedding") for row in new_emails])
                     db.commit()
-                    db.refresh(email_obj)
-                    
-                    # Create embedding
-                    text_content = f"{parsed.get('subject', '')} {parsed.get('body_text', '')}"
-                    if text_content.strip():
-                        embedding = get_embedding(text_content)
-                        email_obj.embedding = embedding
-                        db.commit()
-                    
-                    imported_count += 1
-                    
-                    # Process ongoing instructions for new email
-                    from app.services.ai_agent import AIAgent
-                    agent = AIAgent(db, user)
-                    await agent.process_ongoing_instructions("email", {
-                        "email_id": gmail_id,
-                        "from": parsed.get("from_email"),
-                        "subject": parsed.get("subject"),
-                        "body": parsed.get("body_text")
-                    })
+                    imported_count += len(new_emails)
+                    if new_emails:
+                        chat_cache.invalidate(user_id)
+                        invalidate_cached_context(user_id)
+                        trigger_batches.notify(len(new_emails))
                 
                 page_token = result.get("nextPageToken")
                 if not page_token:
                     break
             
+            # Continue from here on the next poll
+            user.last_history_id = latest_history_id
+            db.commit()
+            
             if imported_count > 0:
-                print(f"Polled {imported_count} new emails for user {user_id}")
+                logger.info("Polled %d new emails for user %s", imported_count, user_id)
         
         except httpx.HTTPStatusError as e:
             if e.response.status_code == 401:
                 # Token expired, clear connection
                 clear_google_connection(user, db)
-                print(f"Email polling failed for user {user_id}: Token expired (401). Connection cleared.")
+                logger.warning("Email polling failed for user %s: Token expired (401). Connection cleared.", user_id)
             else:
                 raise
-        except Exception as e:
-            print(f"Error polling new emails for user {user_id}: {e}")
+        except Exception:
+            logger.exception("Error polling new emails for user %s", user_id)
     finally:
         db.close()
 
 
 async def scheduled_email_polling():
     """
-    Scheduled task that runs every 5 minutes.
+    Scheduled task that runs every EMAIL_POLL_INTERVAL_SECONDS (see main.py).
     Polls all users with Google connected for new emails.
     """
     db = SessionLocal()
     try:
-        # Get all users with Google connected
-        users = db.query(User).filter(
-            User.google_access_token.isnot(None)
-        ).all()
+        # Run polling for each user concurrently, capping simultaneous Google API work
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_POLLS)
+        
+        async def poll_with_limit(user_id: int):
+            async with semaphore:
+                await poll_new_emails(user_id)
         
-        for user in users:
-            # Run polling for each user (they run concurrently)
-            await poll_new_emails(user.id)
+        # Walk connected users in id order, one keyset page at a time, so memory
+        # stays bounded however many users there are
+        last_id = 0
+        while True:
+            user_ids = [row[0] for row in db.query(User.id).filter(
+                User.google_access_token.isnot(None),
+                User.id > last_id
+            ).order_by(User.id).limit(POLL_USER_BATCH_SIZE).all()]
+            # Release the connection while this page is being polled
+            db.close()
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            
+            results = await asyncio.gather(
+                *(poll_with_limit(user_id) for user_id in user_ids),
+                return_exceptions=True
+            )
+            for user_id, result in zip(user_ids, results):
+                if isinstance(result, Exception):
+                    logger.error("Error polling new emails for user %s", user_id, exc_info=result)
+            
+            if len(user_ids) < POLL_USER_BATCH_SIZE:
+                break
     
-    except Exception as e:
-        print(f"Error in scheduled email polling: {e}")
+    except Exception:
+        logger.exception("Error in scheduled email polling")
     finally:
         db.close()
-
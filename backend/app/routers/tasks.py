@@ -2,48 +2,83 @@
 Task routes for managing AI agent tasks.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Header
+from fastapi import APIRouter, Depends, HTTPException, Header, Query
 from typing import Optional
+from sqlalchemy import desc, tuple_
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Task
-from app.routers.chat import get_current_user
+from app.routers.chat import get_current_user, encode_keyset_cursor, decode_keyset_cursor
 
 router = APIRouter()
 
+# Columns returned by the task endpoints, selected directly instead of
+# hydrating Task objects
+TASK_COLUMNS = (
+    Task.id,
+    Task.task_type,
+    Task.status,
+    Task.description,
+    Task.input_data,
+    Task.current_state,
+    Task.result,
+    Task.created_at,
+    Task.completed_at
+)
+
+
+def task_to_dict(task) -> dict:
+    """Convert a row of TASK_COLUMNS to the API response format."""
+    return {
+        "id": task.id,
+        "task_type": task.task_type,
+        "status": task.status,
+        "description": task.description,
+        "input_data": task.input_data,
+        "current_state": task.current_state,
+        "result": task.result,
+        "created_at": task.created_at.isoformat() if task.created_at else None,
+        "completed_at": task.completed_at.isoformat() if task.completed_at else None
+    }
+
 
 @router.get("/")
 async def get_tasks(
     authorization: Optional[str] = Header(None, alias="Authorization"),
     status_filter: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100, description="Number of tasks to fetch"),
+    before_cursor: Optional[str] = Query(None, description="Fetch tasks before this cursor (for pagination)"),
     db: Session = Depends(get_db)
 ):
     """
-    Get all tasks for the current user.
+    Get tasks for the current user, newest first, one page at a time.
     """
     user = get_current_user(authorization, db)
     
-    query = db.query(Task).filter(Task.user_id == user.id)
+    query = db.query(*TASK_COLUMNS).filter(Task.user_id == user.id)
     
     if status_filter:
         query = query.filter(Task.status == status_filter)
     
-    tasks = query.order_by(Task.created_at.desc()).all()
+    # Keyset pagination on (created_at, id)
+    if before_cursor:
+        before_created_at, before_id = decode_keyset_cursor(before_cursor)
+        query = query.filter(tuple_(Task.created_at, Task.id) < tuple_(before_created_at, before_id))
+    
+    # Fetch limit+1 to check if there are more tasks
+    tasks = query.order_by(desc(Task.created_at), desc(Task.id)).limit(limit + 1).all()
     
-    return [
-        {
-            "id": task.id,
-            "task_type": task.task_type,
-            "status": task.status,
-            "description": task.description,
-            "input_data": task.input_data,
-            "current_state": task.current_state,
-            "result": task.result,
-            "created_at": task.created_at.isoformat() if task.created_at else None,
-            "completed_at": task.completed_at.isoformat() if task.completed_at else None
-        }
-        for task in tasks
-    ]
+    has_more = len(tasks) > limit
+    next_cursor = None
+    if has_more:
+        tasks = tasks[:limit]
+        next_cursor = encode_keyset_cursor(tasks[-1].created_at, tasks[-1].id)
+    
+    return {
+        "tasks": [task_to_dict(task) for task in tasks],
+        "has_more": has_more,
+        "next_cursor": next_cursor
+    }
 
 
 @router.get("/{task_id}")
@@ -57,7 +92,7 @@ async def get_task(
     """
     user = get_current_user(authorization, db)
     
-    task = db.query(Task).filter(
+    task = db.query(*TASK_COLUMNS).filter(
         Task.id == task_id,
         Task.user_id == user.id
     ).first()
@@ -65,15 +100,5 @@ async def get_task(
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    return {
-        "id": task.id,
-        "task_type": task.task_type,
-        "status": task.status,
-        "description": task.description,
-        "input_data": task.input_data,
-        "current_state": task.current_state,
-        "result": task.result,
-        "created_at": task.created_at.isoformat() if task.created_at else None,
-        "completed_at": task.completed_at.isoformat() if task.completed_at else None
-    }
+    return task_to_dict(task)
 
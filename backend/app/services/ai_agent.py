@@ -4,24 +4,105 @@ AI Agent service with tool calling capabilities.
 Handles conversation with OpenAI, tool calling, and task management.
 """
 
-from openai import OpenAI
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Dict, Optional, Any
+from openai import APIConnectionError, APIError, InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionMessageToolCall
+from sqlalchemy.orm import Session, undefer_group
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from typing import AsyncIterator, List, Dict, Optional, Any, Tuple
+from cachetools import LRUCache, TTLCache
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential_jitter
 from app.config import settings
-from app.models import User, Task, OngoingInstruction
-from app.services.rag_service import get_relevant_context
+from app.database import SessionLocal, AsyncSessionLocal
+from app.openai_client import openai_client
+from app.models import User, Task, OngoingInstruction, TriggerEvent
+from app.services.rag_service import get_relevant_context, get_embedding
+from app.services.chat_cache import chat_cache, conversation_key
 from app.services.google_service import GoogleService
 from app.services.hubspot_service import HubSpotService
 from datetime import datetime, timedelta, timezone
-import json
+from functools import lru_cache
+import asyncio
+import hashlib
+import logging
+import numpy as np
+import orjson
+import re
+import time
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
+
+# Batch API settings for background (non-interactive) trigger processing
+BATCH_COMPLETION_WINDOW = "24h"
+BATCH_POLL_INTERVAL = 30  # seconds between batch status checks
+BATCH_FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+# Queued trigger events are submitted across users as one batch once
+# this many are waiting, or this many seconds after the first one arrived
+TRIGGER_BATCH_MAX_EVENTS = 200
+TRIGGER_BATCH_MAX_WAIT = 60
+# Claimed events that never made it into a batch (e.g. the worker stopped
+# while submitting) are claimed again after this long
+TRIGGER_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+# Loads a user with OAuth tokens for background batch work
+_USER_WITH_TOKENS = select(User).options(undefer_group("oauth_tokens")).where(User.id == bindparam("uid"))
+
+# Claims the oldest queued trigger events that aren't in a batch yet; SKIP LOCKED
+# keeps concurrent workers from claiming the same events
+_CLAIM_TRIGGER_EVENTS = (
+    update(TriggerEvent)
+    .where(TriggerEvent.id.in_(
+        select(TriggerEvent.id)
+        .where(
+            TriggerEvent.batch_id.is_(None),
+            or_(TriggerEvent.claimed_at.is_(None), TriggerEvent.claimed_at < bindparam("stale_before"))
+        )
+        .order_by(TriggerEvent.id)
+        .limit(TRIGGER_BATCH_MAX_EVENTS)
+        .with_for_update(skip_locked=True)
+    ))
+    .values(claimed_at=func.now())
+    .returning(TriggerEvent.id, TriggerEvent.user_id, TriggerEvent.trigger_type, TriggerEvent.event, TriggerEvent.embedding)
+    .execution_options(synchronize_session=False)
+)
+
+# Batches submitted but not yet acted on, and trigger events still waiting for one
+_SUBMITTED_TRIGGER_BATCHES = select(TriggerEvent.batch_id).where(TriggerEvent.batch_id.is_not(None)).distinct()
+_QUEUED_TRIGGER_EVENT_COUNT = select(func.count()).select_from(TriggerEvent).where(TriggerEvent.batch_id.is_(None))
+
+# Read-only Core select of a user's active instructions (no ORM object hydration),
+# built once so its compiled form is reused from the statement cache
+_ACTIVE_INSTRUCTIONS = select(
+    OngoingInstruction.instruction,
+    OngoingInstruction.trigger_type,
+    OngoingInstruction.embedding
+).where(
+    OngoingInstruction.user_id == bindparam("uid"),
+    OngoingInstruction.is_active == True
+).order_by(OngoingInstruction.id)
+
+# Active ongoing instructions per user (instruction, trigger_type, embedding rows),
+# so consecutive chat turns and trigger events don't re-query them
+_INSTRUCTIONS_CACHE = TTLCache(maxsize=10000, ttl=30)
+
+
+# Recent search_emails_and_contacts results: user_id -> LRU of {query hash: context}
+_CONTEXT_CACHE = TTLCache(maxsize=1000, ttl=300)
+CONTEXT_CACHE_QUERIES_PER_USER = 20
+
+
+def invalidate_cached_context(user_id: int):
+    """Drop a user's cached search results (call after their emails/contacts change)."""
+    _CONTEXT_CACHE.pop(user_id, None)
+
+
+def invalidate_cached_instructions(user_id: int):
+    """Drop a user's cached ongoing instructions (call after they change)."""
+    _INSTRUCTIONS_CACHE.pop(user_id, None)
 
 
 # Define available tools for the AI agent
-TOOLS = [
+TOOLS = (
     {
         "type": "function",
         "function": {
@@ -241,12 +322,217 @@ TOOLS = [
             }
         }
     }
-]
+)
+
+
+@lru_cache(maxsize=1)
+def _datetime_strings(epoch_second: int) -> Tuple[str, str, str]:
+    """Formatted (date, time, weekday) for a UTC second; reused for every prompt within that second."""
+    current_datetime = datetime.fromtimestamp(epoch_second, timezone.utc)
+    return (
+        current_datetime.strftime("%Y-%m-%d"),
+        current_datetime.strftime("%H:%M:%S UTC"),
+        current_datetime.strftime("%A")
+    )
+
+
+def current_datetime_strings() -> Tuple[str, str, str]:
+    """Current UTC (date, time, weekday) strings for prompts."""
+    return _datetime_strings(int(time.time()))
+
+
+def _dumps(obj: Any, option: int = 0) -> str:
+    """Serialize to a JSON string with orjson (tool results can be large)."""
+    return orjson.dumps(obj, option=option | orjson.OPT_NON_STR_KEYS).decode()
+
+
+# Static pieces of the system prompt, assembled by AIAgent._static_system_prefix
+SYSTEM_PROMPT_HEADER = """You are an AI assistant for a Financial Advisor. You help manage client relationships by:
+- Answering questions about clients using information from emails and HubSpot CRM
+- Performing actions like scheduling appointments, sending emails, creating contacts
+- Remembering and following ongoing instructions
+
+When someone mentions relative dates like "next Tuesday", "tomorrow", "next week", you MUST calculate the actual date based on today's date (given at the end of these instructions).
+Always use ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ) for calendar event times.
+
+Available integrations:
+"""
+
+SYSTEM_PROMPT_GOOGLE = "- Gmail: Read and send emails\n- Google Calendar: View and create events\n"
+
+SYSTEM_PROMPT_HUBSPOT = "- HubSpot CRM: Search, create, and manage contacts and notes\n"
+
+SYSTEM_PROMPT_FOOTER = """
+Be helpful, professional, and proactive. When scheduling appointments, handle the full flow including:
+1. Finding the contact
+2. Sending email with available times
+3. Waiting for response
+4. Creating calendar event when confirmed
+5. Adding notes to HubSpot
+
+Use tool calling to perform actions. Create tasks for multi-step processes that require waiting.
+
+When creating calendar events:
+- ALWAYS include the attendee's email address in the 'attendees' parameter so they receive an invitation
+- If creating an event from an email, use the sender's email address as an attendee
+- Calculate dates from relative terms (e.g., "next Tuesday", "tomorrow") based on TODAY's date
+- Always use ISO 8601 format: YYYY-MM-DDTHH:MM:SSZ (e.g., 2025-01-20T14:00:00Z)
+- Ensure the date is in the future, not in the past
+- Double-check your date calculations before creating events
+
+If the user asks you to remember something or set up an automation (e.g., "when someone emails me...", "when I create a contact..."), use the create_ongoing_instruction tool to save it. The system will automatically detect the trigger type from the instruction text.
+"""
+
+# Closing reminders of the trigger-event prompt
+TRIGGER_PROMPT_DATES = "\n\nIMPORTANT: When calculating dates from relative terms (e.g., 'next Tuesday', 'tomorrow', 'next week'), use TODAY's date ({date}) to determine the actual future date. Always use ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ) for calendar events. Ensure dates are in the future, not the past."
+
+TRIGGER_PROMPT_ATTENDEES = "\n\nCRITICAL: When creating calendar events, ALWAYS include the attendee's email address in the 'attendees' parameter. If this event was triggered by an email, use the sender's email address (from the 'from' field in the event data above) as an attendee so they receive an invitation."
+
+
+# Tools that write through the database session: they run one at a time and
+# their writes are committed once per turn by _execute_tools
+DB_TOOLS = {"create_task", "create_ongoing_instruction"}
+
+
+# Keyword patterns used to classify an instruction's trigger type
+TRIGGER_PATTERNS = {
+    "email": re.compile(r"\b(e-?mails?|messages?|inbox|gmail|senders?|repl(?:y|ies))\b", re.I),
+    "calendar": re.compile(r"\b(calendars?|meetings?|appointments?|events?|schedul(?:e|es|ed|ing)|invites?|availability)\b", re.I),
+    "hubspot": re.compile(r"\b(hubspot|crm|contacts?|notes?|deals?)\b", re.I),
+}
+
+# Leading condition of an instruction ("When someone emails me ..., <action>"),
+# which names the triggering event more reliably than the action part
+TRIGGER_CONDITION_RE = re.compile(r"^\s*(?:when(?:ever)?|if|after|once)\b(.*?)(?:,|\bthen\b)", re.I | re.S)
+
+
+# Words that say nothing about which events an instruction is about
+# (function words, and the generic vocabulary of the trigger sources themselves)
+PREFILTER_IGNORED_WORDS = frozenset("""
+a about an and any are as ask asks at be by can for from get gets got has have i
+in is it me my of on or our regarding receive received receives someone somebody anyone send sends sent
+that the their them they this to us we when whenever if after once with you your
+email emails mail message messages inbox gmail new calendar event events
+hubspot crm contact contacts note notes
+""".split())
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _keyword_stems(text: str) -> set:
+    """Lowercased content words of text with simple suffixes stripped."""
+    stems = set()
+    for word in _WORD_RE.findall(text.lower()):
+        if len(word) < 3 or word in PREFILTER_IGNORED_WORDS:
+            continue
+        for suffix in ("ing", "ed", "es", "s"):
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                word = word[:-len(suffix)]
+                break
+        stems.add(word)
+    return stems
+
+
+def instruction_may_apply(instruction: str, event_stems: set) -> bool:
+    """
+    Cheap keyword check of whether an instruction could apply to an event.
+    
+    Only the instruction's leading condition ("When someone emails me about
+    X, ...") is compared. Instructions without a condition, or whose
+    condition is generic ("When I get an email, ..."), always apply; otherwise
+    the condition and the event must share a content word.
+    
+    Args:
+        instruction: Instruction text
+        event_stems: _keyword_stems of the event data
+        
+    Returns:
+        False only if the instruction clearly can't apply
+    """
+    condition = TRIGGER_CONDITION_RE.match(instruction)
+    if not condition:
+        return True
+    condition_stems = _keyword_stems(condition.group(1))
+    return not condition_stems or not condition_stems.isdisjoint(event_stems)
+
+
+def _event_stems(trigger_data: Dict) -> set:
+    """_keyword_stems of every string value in the event data."""
+    return _keyword_stems(" ".join(str(value) for value in trigger_data.values() if value))
+
+
+# Minimum cosine similarity between an instruction and an event for the
+# instruction to be considered when their keywords don't overlap
+INSTRUCTION_SIMILARITY_THRESHOLD = 0.35
+
+
+def _unit_vector(embedding: Any) -> Optional[np.ndarray]:
+    """Embedding (list or pgvector value) as a unit-length float32 array, or None."""
+    if embedding is None:
+        return None
+    vector = np.asarray(embedding.to_list() if hasattr(embedding, "to_list") else embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+async def embed_instruction(instruction: str) -> Optional[List[float]]:
+    """Embedding stored with a new instruction (None if it can't be computed right now)."""
+    try:
+        return await get_embedding(instruction)
+    except Exception:
+        logger.exception("Error embedding instruction")
+        return None
+
+
+def _score_trigger_types(text: str) -> Optional[str]:
+    """Return the trigger type with the most keyword matches in text, or None if there is no clear winner."""
+    scores = sorted(
+        ((len(pattern.findall(text)), trigger_type) for trigger_type, pattern in TRIGGER_PATTERNS.items()),
+        reverse=True
+    )
+    (best_score, best_type), (second_score, _) = scores[0], scores[1]
+    return best_type if best_score > second_score else None
+
+
+async def detect_trigger_type(instruction: str) -> str:
+    """
+    Automatically detect the trigger type from instruction text.
+    
+    Counts keyword matches for each trigger type in the instruction's
+    leading condition, then in the whole text, and picks the best one.
+    Instructions with no matches apply to "all"; ties are ambiguous and fall
+    back to asking the model if TRIGGER_DETECT_FALLBACK is enabled, and to
+    "all" otherwise.
+    
+    Args:
+        instruction: The instruction text
+        
+    Returns:
+        Trigger type: "email", "calendar", "hubspot", or "all"
+    """
+    condition = TRIGGER_CONDITION_RE.match(instruction)
+    if condition:
+        trigger_type = _score_trigger_types(condition.group(1))
+        if trigger_type:
+            return trigger_type
+    
+    trigger_type = _score_trigger_types(instruction)
+    if trigger_type:
+        return trigger_type
+    if not any(pattern.search(instruction) for pattern in TRIGGER_PATTERNS.values()):
+        return "all"
+    
+    if settings.TRIGGER_DETECT_FALLBACK:
+        try:
+            return await _detect_trigger_type_with_model(instruction)
+        except APIError:
+            logger.exception("Error detecting trigger type")
+    return "all"
 
 
-def detect_trigger_type(instruction: str) -> str:
+async def _detect_trigger_type_with_model(instruction: str) -> str:
     """
-    Automatically detect the trigger type from instruction text using AI.
+    Detect the trigger type from instruction text using AI.
     
     Args:
         instruction: The instruction text
@@ -265,41 +551,48 @@ The instruction should be triggered by:
 
 Respond with ONLY one word: email, calendar, hubspot, or all"""
     
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that analyzes instructions and determines trigger types. Respond with only one word."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
-            max_tokens=10
-        )
-        trigger_type = response.choices[0].message.content.strip().lower()
-        
-        # Validate response
-        valid_types = ["email", "calendar", "hubspot", "all"]
-        if trigger_type in valid_types:
-            return trigger_type
-        else:
-            # Default to "all" if detection fails
-            return "all"
-    except Exception as e:
-        print(f"Error detecting trigger type: {e}")
+    response = await _classify_trigger_type(prompt)
+    trigger_type = (response.choices[0].message.content or "").strip().lower()
+    
+    # Validate response
+    valid_types = ["email", "calendar", "hubspot", "all"]
+    if trigger_type in valid_types:
+        return trigger_type
+    else:
+        # Default to "all" if detection fails
         return "all"
 
 
+@retry(
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+    wait=wait_exponential_jitter(initial=1, max=20),
+    stop=stop_after_attempt(4),
+    reraise=True
+)
+async def _classify_trigger_type(prompt: str):
+    """Ask the model for a trigger type, retrying rate limits and transient errors with backoff."""
+    return await openai_client.chat.completions.create(
+        model=settings.SYNTH_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a helpful assistant that analyzes instructions and determines trigger types. Respond with only one word."},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0.3,
+        max_tokens=10
+    )
+
+
 class AIAgent:
     """
     AI Agent that handles conversations, tool calling, and task management.
     """
     
-    def __init__(self, db: Session, user: User):
+    def __init__(self, db: Optional[Session], user: User):
         """
         Initialize AI Agent.
         
         Args:
-            db: Database session
+            db: Database session (None for an agent that only builds prompts)
             user: User object with OAuth tokens
         """
         self.db = db
@@ -312,11 +605,31 @@ class AIAgent:
             self.google_service = GoogleService(user.google_access_token)
         if user.hubspot_access_token:
             self.hubspot_service = HubSpotService(user.hubspot_access_token)
+        
+        # Stable start of the system prompt, shared by every turn
+        self._system_prefix = self._static_system_prefix()
+        
+        # Serializes tools that use self.db when tool calls run concurrently
+        self._db_lock = asyncio.Lock()
+        
+        # Tool name -> handler taking the parsed arguments
+        self._tool_handlers = {
+            "search_emails_and_contacts": self._tool_search_emails_and_contacts,
+            "send_email": self._tool_send_email,
+            "create_calendar_event": self._tool_create_calendar_event,
+            "search_hubspot_contact": self._tool_search_hubspot_contact,
+            "create_hubspot_contact": self._tool_create_hubspot_contact,
+            "create_hubspot_note": self._tool_create_hubspot_note,
+            "get_calendar_events": self._tool_get_calendar_events,
+            "create_task": self._tool_create_task,
+            "create_ongoing_instruction": self._tool_create_ongoing_instruction,
+        }
     
     async def chat(
         self,
         message: str,
-        conversation_history: Optional[List[Dict]] = None
+        conversation_history: Optional[List[Dict]] = None,
+        use_cache: bool = True
     ) -> Dict:
         """
         Process a chat message and return response.
@@ -324,31 +637,35 @@ class AIAgent:
         Args:
             message: User's message
             conversation_history: Previous conversation messages
+            use_cache: Reuse/store answers in the semantic chat cache
             
         Returns:
             Dictionary with response text and any errors
         """
-        if conversation_history is None:
-            conversation_history = []
-        
-        # Get ongoing instructions
-        ongoing_instructions = self.db.query(OngoingInstruction).filter(
-            OngoingInstruction.user_id == self.user.id,
-            OngoingInstruction.is_active == True
-        ).all()
-        
-        # Build system prompt
-        system_prompt = self._build_system_prompt(ongoing_instructions)
+        # Answer repeated questions from the semantic cache; answers are only
+        # reused after the same conversation history
+        message_vector = None
+        history_key = conversation_key(conversation_history)
+        if use_cache:
+            try:
+                cached_response, message_vector = await chat_cache.get(self.user.id, message, get_embedding, history_key)
+                if cached_response is not None:
+                    return {
+                        "response": cached_response,
+                        "error": None
+                    }
+            except Exception:
+                logger.exception("Chat cache lookup failed")
         
         # Prepare messages
-        messages = [{"role": "system", "content": system_prompt}]
-        messages.extend(conversation_history)
+        messages = [{"role": "system", "content": await self._get_system_prompt()}]
+        messages.extend(conversation_history or [])
         messages.append({"role": "user", "content": message})
         
         try:
             # Call OpenAI with tool calling
-            response = openai_client.chat.completions.create(
-                model="gpt-4",
+            response = await openai_client.chat.completions.create(
+                model=settings.PLANNER_MODEL,
                 messages=messages,
                 tools=TOOLS,
                 tool_choice="auto"
@@ -359,25 +676,35 @@ class AIAgent:
             messages.append(assistant_message)
             
             # Execute tool calls if any
-            tool_results = []
             if assistant_message.tool_calls:
-                for tool_call in assistant_message.tool_calls:
-                    result = await self._execute_tool(tool_call)
-                    tool_results.append(result)
+                tool_results = await self._execute_tools(assistant_message.tool_calls)
+                for tool_call, result in zip(assistant_message.tool_calls, tool_results):
                     messages.append({
                         "role": "tool",
                         "tool_call_id": tool_call.id,
-                        "content": json.dumps(result)
+                        "content": _dumps(result)
                     })
                 
-                # Get final response after tool execution
-                final_response = openai_client.chat.completions.create(
-                    model="gpt-4",
+                # Get final response after tool execution with the (cheaper) synthesis
+                # model. No tools are sent: this is a text-only answer, and the tool
+                # schemas would only add prompt tokens
+                final_response = await openai_client.chat.completions.create(
+                    model=settings.SYNTH_MODEL,
                     messages=messages
                 )
                 response_text = final_response.choices[0].message.content
+                
+                # Tools may have changed the user's data; drop answers based on the old state
+                chat_cache.invalidate(self.user.id)
             else:
                 response_text = assistant_message.content
+                
+                # Only answers that needed no tool calls are safe to reuse
+                if use_cache and response_text:
+                    try:
+                        await chat_cache.put(self.user.id, message, response_text, get_embedding, message_vector, history_key)
+                    except Exception:
+                        logger.exception("Chat cache store failed")
             
             return {
                 "response": response_text,
@@ -390,58 +717,202 @@ class AIAgent:
                 "error": f"Error processing message: {str(e)}"
             }
     
-    def _build_system_prompt(self, ongoing_instructions: List[OngoingInstruction]) -> str:
-        """Build system prompt with ongoing instructions."""
-        # Get current date and time
-        current_datetime = datetime.now(timezone.utc)
-        current_date_str = current_datetime.strftime("%Y-%m-%d")
-        current_time_str = current_datetime.strftime("%H:%M:%S UTC")
-        current_weekday = current_datetime.strftime("%A")
+    async def chat_stream(
+        self,
+        message: str,
+        conversation_history: Optional[List[Dict]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Process a chat message, yielding the response text as it is generated.
         
-        prompt = f"""You are an AI assistant for a Financial Advisor. You help manage client relationships by:
-- Answering questions about clients using information from emails and HubSpot CRM
-- Performing actions like scheduling appointments, sending emails, creating contacts
-- Remembering and following ongoing instructions
-
-CRITICAL: Today is {current_date_str} ({current_weekday}) at {current_time_str}. 
-When someone mentions relative dates like "next Tuesday", "tomorrow", "next week", you MUST calculate the actual date based on today's date ({current_date_str}).
-Always use ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ) for calendar event times.
-
-Available integrations:
-"""
+        Same flow as chat(): if the model asks for tools they are executed
+        and the answer after the tool results is streamed instead. Errors
+        are raised to the caller.
+        
+        Args:
+            message: User's message
+            conversation_history: Previous conversation messages
+            
+        Yields:
+            Pieces of the response text
+        """
+        # Answer repeated questions from the semantic cache; answers are only
+        # reused after the same conversation history
+        message_vector = None
+        history_key = conversation_key(conversation_history)
+        try:
+            cached_response, message_vector = await chat_cache.get(self.user.id, message, get_embedding, history_key)
+        except Exception:
+            cached_response = None
+            logger.exception("Chat cache lookup failed")
+        if cached_response is not None:
+            yield cached_response
+            return
+        
+        # Prepare messages
+        messages = [{"role": "system", "content": await self._get_system_prompt()}]
+        messages.extend(conversation_history or [])
+        messages.append({"role": "user", "content": message})
+        
+        # Call OpenAI with tool calling; text is passed on as it arrives and
+        # tool call fragments are reassembled by their index
+        response_parts = []
+        tool_call_parts: Dict[int, Dict] = {}
+        stream = await openai_client.chat.completions.create(
+            model=settings.PLANNER_MODEL,
+            messages=messages,
+            tools=TOOLS,
+            tool_choice="auto",
+            stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                response_parts.append(delta.content)
+                yield delta.content
+            for tool_call_delta in delta.tool_calls or []:
+                part = tool_call_parts.setdefault(tool_call_delta.index, {"id": None, "name": "", "arguments": ""})
+                if tool_call_delta.id:
+                    part["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    part["name"] += tool_call_delta.function.name or ""
+                    part["arguments"] += tool_call_delta.function.arguments or ""
+        
+        if not tool_call_parts:
+            # Only answers that needed no tool calls are safe to reuse
+            response_text = "".join(response_parts)
+            if response_text:
+                try:
+                    await chat_cache.put(self.user.id, message, response_text, get_embedding, message_vector, history_key)
+                except Exception:
+                    logger.exception("Chat cache store failed")
+            return
+        
+        tool_calls = [
+            ChatCompletionMessageToolCall.model_validate({
+                "id": part["id"],
+                "type": "function",
+                "function": {"name": part["name"], "arguments": part["arguments"]}
+            })
+            for _, part in sorted(tool_call_parts.items())
+        ]
+        messages.append({
+            "role": "assistant",
+            "content": "".join(response_parts) or None,
+            "tool_calls": [tool_call.model_dump() for tool_call in tool_calls]
+        })
+        
+        # Execute tool calls
+        tool_results = await self._execute_tools(tool_calls)
+        for tool_call, result in zip(tool_calls, tool_results):
+            messages.append({
+                "role": "tool",
+                "tool_call_id": tool_call.id,
+                "content": _dumps(result)
+            })
         
+        # Tools may have changed the user's data; drop answers based on the old state
+        chat_cache.invalidate(self.user.id)
+        
+        # Stream the final response after tool execution (text only, so no tools are sent)
+        final_stream = await openai_client.chat.completions.create(
+            model=settings.SYNTH_MODEL,
+            messages=messages,
+            stream=True
+        )
+        async for chunk in final_stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    
+    async def _get_active_instructions(self) -> List[Any]:
+        """Get the user's active ongoing instructions (cached for a short time)."""
+        instructions = _INSTRUCTIONS_CACHE.get(self.user.id)
+        if instructions is None:
+            # Read on a short-lived async session so the event loop isn't blocked
+            async with AsyncSessionLocal() as session:
+                instructions = (await session.execute(_ACTIVE_INSTRUCTIONS, {"uid": self.user.id})).all()
+            _INSTRUCTIONS_CACHE[self.user.id] = instructions
+        return instructions
+    
+    async def _get_system_prompt(self) -> str:
+        """Load the user's active ongoing instructions and build the system prompt."""
+        return self._build_system_prompt(await self._get_active_instructions())
+    
+    def _static_system_prefix(self) -> str:
+        """
+        Build the part of the system prompt that does not change between turns.
+        
+        It only depends on which integrations are connected, so it is built
+        once per agent and kept byte-identical at the start of every request,
+        letting OpenAI's prompt caching reuse it.
+        """
+        parts = [SYSTEM_PROMPT_HEADER]
         if self.google_service:
-            prompt += "- Gmail: Read and send emails\n- Google Calendar: View and create events\n"
+            parts.append(SYSTEM_PROMPT_GOOGLE)
         if self.hubspot_service:
-            prompt += "- HubSpot CRM: Search, create, and manage contacts and notes\n"
+            parts.append(SYSTEM_PROMPT_HUBSPOT)
+        parts.append(SYSTEM_PROMPT_FOOTER)
+        return "".join(parts)
+    
+    def _dynamic_suffix(self, ongoing_instructions: List[Any]) -> str:
+        """Build the per-turn end of the system prompt: ongoing instructions and the current time."""
+        current_date_str, current_time_str, current_weekday = current_datetime_strings()
         
+        parts = []
         if ongoing_instructions:
-            prompt += "\n## Ongoing Instructions (always follow these):\n"
-            for instruction in ongoing_instructions:
-                prompt += f"- {instruction.instruction}\n"
+            parts.append("\n## Ongoing Instructions (always follow these):\n")
+            parts.extend(f"- {instruction.instruction}\n" for instruction in ongoing_instructions)
         
-        prompt += """
-Be helpful, professional, and proactive. When scheduling appointments, handle the full flow including:
-1. Finding the contact
-2. Sending email with available times
-3. Waiting for response
-4. Creating calendar event when confirmed
-5. Adding notes to HubSpot
-
-Use tool calling to perform actions. Create tasks for multi-step processes that require waiting.
-
-When creating calendar events:
-- ALWAYS include the attendee's email address in the 'attendees' parameter so they receive an invitation
-- If creating an event from an email, use the sender's email address as an attendee
-- Calculate dates from relative terms (e.g., "next Tuesday", "tomorrow") based on TODAY's date
-- Always use ISO 8601 format: YYYY-MM-DDTHH:MM:SSZ (e.g., 2025-01-20T14:00:00Z)
-- Ensure the date is in the future, not in the past
-- Double-check your date calculations before creating events
-
-If the user asks you to remember something or set up an automation (e.g., "when someone emails me...", "when I create a contact..."), use the create_ongoing_instruction tool to save it. The system will automatically detect the trigger type from the instruction text.
-"""
+        parts.append(f"\nCRITICAL: Today is {current_date_str} ({current_weekday}) at {current_time_str}.\n")
+        return "".join(parts)
+    
+    def _build_system_prompt(self, ongoing_instructions: List[Any]) -> str:
+        """Build system prompt with ongoing instructions (static prefix first, volatile parts last)."""
+        return self._system_prefix + self._dynamic_suffix(ongoing_instructions)
+    
+    async def _execute_tools(self, tool_calls) -> List[Dict]:
+        """
+        Execute several tool calls concurrently.
+        
+        Tools that only call Google/HubSpot run in parallel; tools that use
+        the database session take turns, since a session can't be shared
+        between concurrent operations. Database writes are committed once,
+        after all tools have run.
+        
+        Args:
+            tool_calls: Tool call objects from OpenAI
+            
+        Returns:
+            Tool execution results, in the same order as tool_calls
+        """
+        async def run(tool_call) -> Dict:
+            if tool_call.function.name in DB_TOOLS:
+                async with self._db_lock:
+                    return await self._execute_tool(tool_call)
+            return await self._execute_tool(tool_call)
         
-        return prompt
+        results = await asyncio.gather(*(run(tool_call) for tool_call in tool_calls), return_exceptions=True)
+        results = [
+            {"success": False, "error": str(result)} if isinstance(result, Exception) else result
+            for result in results
+        ]
+        
+        # Commit every write of the turn at once, off the event loop
+        written = [i for i, tool_call in enumerate(tool_calls) if tool_call.function.name in DB_TOOLS]
+        if written:
+            try:
+                await asyncio.to_thread(self.db.commit)
+            except Exception as e:
+                await asyncio.to_thread(self.db.rollback)
+                for i in written:
+                    results[i] = {"success": False, "error": str(e)}
+            else:
+                if any(tool_calls[i].function.name == "create_ongoing_instruction" for i in written):
+                    invalidate_cached_instructions(self.user.id)
+        
+        return results
     
     async def _execute_tool(self, tool_call) -> Dict:
         """
@@ -454,128 +925,202 @@ If the user asks you to remember something or set up an automation (e.g., "when
             Tool execution result
         """
         function_name = tool_call.function.name
-        function_args = json.loads(tool_call.function.arguments)
+        handler = self._tool_handlers.get(function_name)
+        if handler is None:
+            return {"success": False, "error": f"Unknown tool: {function_name}"}
         
         try:
-            if function_name == "search_emails_and_contacts":
-                context = get_relevant_context(
-                    self.db,
-                    self.user.id,
-                    function_args["query"]
-                )
-                return {"success": True, "context": context}
-            
-            elif function_name == "send_email":
-                if not self.google_service:
-                    return {"success": False, "error": "Google not connected"}
-                result = await self.google_service.send_email(
-                    to=function_args["to"],
-                    subject=function_args["subject"],
-                    body=function_args["body"],
-                    cc=function_args.get("cc")
-                )
-                return {"success": True, "message_id": result.get("id")}
-            
-            elif function_name == "create_calendar_event":
-                if not self.google_service:
-                    return {"success": False, "error": "Google not connected"}
-                result = await self.google_service.create_calendar_event(
-                    summary=function_args["summary"],
-                    start_time=function_args["start_time"],
-                    end_time=function_args["end_time"],
-                    attendees=function_args.get("attendees"),
-                    description=function_args.get("description")
-                )
-                return {"success": True, "event_id": result.get("id")}
-            
-            elif function_name == "search_hubspot_contact":
-                if not self.hubspot_service:
-                    return {"success": False, "error": "HubSpot not connected"}
-                results = await self.hubspot_service.search_contacts(
-                    query=function_args["query"]
-                )
-                return {"success": True, "contacts": results}
-            
-            elif function_name == "create_hubspot_contact":
-                if not self.hubspot_service:
-                    return {"success": False, "error": "HubSpot not connected"}
-                result = await self.hubspot_service.create_contact(
-                    email=function_args["email"],
-                    first_name=function_args.get("first_name"),
-                    last_name=function_args.get("last_name"),
-                    phone=function_args.get("phone"),
-                    company=function_args.get("company")
-                )
-                return {"success": True, "contact": result}
-            
-            elif function_name == "create_hubspot_note":
-                if not self.hubspot_service:
-                    return {"success": False, "error": "HubSpot not connected"}
-                result = await self.hubspot_service.create_note(
-                    contact_id=function_args["contact_id"],
-                    note=function_args["note"]
-                )
-                return {"success": True, "note": result}
-            
-            elif function_name == "get_calendar_events":
-                if not self.google_service:
-                    return {"success": False, "error": "Google not connected"}
-                results = await self.google_service.list_calendar_events(
-                    time_min=function_args.get("time_min"),
-                    time_max=function_args.get("time_max")
-                )
-                return {"success": True, "events": results}
-            
-            elif function_name == "create_task":
-                # Create task in database
-                task = Task(
-                    user_id=self.user.id,
-                    task_type=function_args["task_type"],
-                    description=function_args["description"],
-                    input_data=function_args["input_data"],
-                    status="pending"
-                )
-                self.db.add(task)
-                self.db.commit()
-                return {"success": True, "task_id": task.id}
-            
-            elif function_name == "create_ongoing_instruction":
-                # Create ongoing instruction
-                instruction_text = function_args["instruction"]
-                
-                # Auto-detect trigger type if not provided
-                trigger_type = function_args.get("trigger_type")
-                if not trigger_type:
-                    trigger_type = detect_trigger_type(instruction_text)
-                
-                # Create the instruction
-                ongoing_instruction = OngoingInstruction(
-                    user_id=self.user.id,
-                    instruction=instruction_text,
-                    trigger_type=trigger_type,
-                    is_active=True
-                )
-                self.db.add(ongoing_instruction)
-                self.db.commit()
-                self.db.refresh(ongoing_instruction)
-                
-                return {
-                    "success": True,
-                    "instruction_id": ongoing_instruction.id,
-                    "instruction": ongoing_instruction.instruction,
-                    "trigger_type": ongoing_instruction.trigger_type
-                }
-            
-            else:
-                return {"success": False, "error": f"Unknown tool: {function_name}"}
-        
+            return await handler(orjson.loads(tool_call.function.arguments))
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    async def _tool_search_emails_and_contacts(self, function_args: Dict) -> Dict:
+        # The same search often repeats over a conversation
+        user_contexts = _CONTEXT_CACHE.get(self.user.id)
+        if user_contexts is None:
+            user_contexts = _CONTEXT_CACHE[self.user.id] = LRUCache(maxsize=CONTEXT_CACHE_QUERIES_PER_USER)
+        query_key = hashlib.blake2b(function_args["query"].encode("utf-8"), digest_size=16).digest()
+        context = user_contexts.get(query_key)
+        if context is None:
+            # Searches use their own async sessions, so this runs alongside other tools
+            context = await get_relevant_context(self.user.id, function_args["query"])
+            user_contexts[query_key] = context
+        return {"success": True, "context": context}
+    
+    async def _tool_send_email(self, function_args: Dict) -> Dict:
+        if not self.google_service:
+            return {"success": False, "error": "Google not connected"}
+        result = await self.google_service.send_email(
+            to=function_args["to"],
+            subject=function_args["subject"],
+            body=function_args["body"],
+            cc=function_args.get("cc")
+        )
+        return {"success": True, "message_id": result.get("id")}
+    
+    async def _tool_create_calendar_event(self, function_args: Dict) -> Dict:
+        if not self.google_service:
+            return {"success": False, "error": "Google not connected"}
+        result = await self.google_service.create_calendar_event(
+            summary=function_args["summary"],
+            start_time=function_args["start_time"],
+            end_time=function_args["end_time"],
+            attendees=function_args.get("attendees"),
+            description=function_args.get("description")
+        )
+        return {"success": True, "event_id": result.get("id")}
+    
+    async def _tool_search_hubspot_contact(self, function_args: Dict) -> Dict:
+        if not self.hubspot_service:
+            return {"success": False, "error": "HubSpot not connected"}
+        results = await self.hubspot_service.search_contacts(
+            query=function_args["query"]
+        )
+        return {"success": True, "contacts": results}
+    
+    async def _tool_create_hubspot_contact(self, function_args: Dict) -> Dict:
+        if not self.hubspot_service:
+            return {"success": False, "error": "HubSpot not connected"}
+        result = await self.hubspot_service.create_contact(
+            email=function_args["email"],
+            first_name=function_args.get("first_name"),
+            last_name=function_args.get("last_name"),
+            phone=function_args.get("phone"),
+            company=function_args.get("company")
+        )
+        return {"success": True, "contact": result}
+    
+    async def _tool_create_hubspot_note(self, function_args: Dict) -> Dict:
+        if not self.hubspot_service:
+            return {"success": False, "error": "HubSpot not connected"}
+        result = await self.hubspot_service.create_note(
+            contact_id=function_args["contact_id"],
+            note=function_args["note"]
+        )
+        return {"success": True, "note": result}
+    
+    async def _tool_get_calendar_events(self, function_args: Dict) -> Dict:
+        if not self.google_service:
+            return {"success": False, "error": "Google not connected"}
+        results = await self.google_service.list_calendar_events(
+            time_min=function_args.get("time_min"),
+            time_max=function_args.get("time_max")
+        )
+        return {"success": True, "events": results}
+    
+    async def _tool_create_task(self, function_args: Dict) -> Dict:
+        # Create task in database
+        task = Task(
+            user_id=self.user.id,
+            task_type=function_args["task_type"],
+            description=function_args["description"],
+            input_data=function_args["input_data"],
+            status="pending"
+        )
+        self.db.add(task)
+        # Flush to get the ID (off the event loop); the turn's writes are committed together
+        await asyncio.to_thread(self.db.flush)
+        return {"success": True, "task_id": task.id}
+    
+    async def _tool_create_ongoing_instruction(self, function_args: Dict) -> Dict:
+        # Create ongoing instruction
+        instruction_text = function_args["instruction"]
+        
+        # Auto-detect trigger type if not provided, while the embedding is computed
+        embedding_task = embed_instruction(instruction_text)
+        trigger_type = function_args.get("trigger_type")
+        if trigger_type:
+            embedding = await embedding_task
+        else:
+            trigger_type, embedding = await asyncio.gather(
+                detect_trigger_type(instruction_text),
+                embedding_task
+            )
+        
+        # Create the instruction (with its embedding for event matching),
+        # getting its ID back in the same statement; runs off the event loop
+        result = await asyncio.to_thread(
+            self.db.execute,
+            insert(OngoingInstruction).values(
+                user_id=self.user.id,
+                instruction=instruction_text,
+                trigger_type=trigger_type,
+                is_active=True,
+                embedding=embedding
+            ).returning(OngoingInstruction.id)
+        )
+        instruction_id = result.scalar_one()
+        
+        return {
+            "success": True,
+            "instruction_id": instruction_id,
+            "instruction": instruction_text,
+            "trigger_type": trigger_type
+        }
+    
+    async def _get_trigger_instructions(self, trigger_type: str) -> List[Any]:
+        """Get the user's active ongoing instructions that apply to a trigger type."""
+        return [
+            instruction for instruction in await self._get_active_instructions()
+            if instruction.trigger_type in (trigger_type, "all")
+        ]
+    
+    def _build_trigger_prompt(
+        self,
+        trigger_type: str,
+        trigger_data: Dict,
+        instructions: List[Any]
+    ) -> str:
+        """Build the prompt asking the AI whether a trigger event needs action."""
+        # Get current date and time
+        current_date_str, current_time_str, current_weekday = current_datetime_strings()
+        
+        # Build prompt for AI to decide what to do
+        parts = [
+            f"CRITICAL: Today is {current_date_str} ({current_weekday}) at {current_time_str}.\n\n",
+            f"A {trigger_type} event occurred:\n",
+            _dumps(trigger_data, orjson.OPT_INDENT_2),
+            "\n\nYou have these ongoing instructions:\n"
+        ]
+        parts.extend(f"- {instruction.instruction}\n" for instruction in instructions)
+        parts.append("\nShould you take any action? Use tools if needed.")
+        parts.append(TRIGGER_PROMPT_DATES.format(date=current_date_str))
+        parts.append(TRIGGER_PROMPT_ATTENDEES)
+        return "".join(parts)
+    
+    def _matching_instructions(
+        self,
+        instructions: List[Any],
+        trigger_data: Dict,
+        event_embedding: Optional[Any] = None
+    ) -> List[Any]:
+        """
+        Filter instructions down to those that may apply to an event.
+        
+        An instruction is kept if its condition shares keywords with the event
+        (see instruction_may_apply), or, when both embeddings are known, if
+        it is semantically close to the event.
+        """
+        event_stems = _event_stems(trigger_data)
+        event_vector = _unit_vector(event_embedding)
+        matching = []
+        for instruction in instructions:
+            if instruction_may_apply(instruction.instruction, event_stems):
+                matching.append(instruction)
+                continue
+            instruction_vector = _unit_vector(instruction.embedding)
+            if (
+                event_vector is not None and instruction_vector is not None
+                and float(event_vector @ instruction_vector) >= INSTRUCTION_SIMILARITY_THRESHOLD
+            ):
+                matching.append(instruction)
+        return matching
+    
     async def process_ongoing_instructions(
         self,
         trigger_type: str,
-        trigger_data: Dict
+        trigger_data: Dict,
+        event_embedding: Optional[Any] = None
     ) -> Optional[str]:
         """
         Process ongoing instructions when a trigger event occurs.
@@ -583,44 +1128,381 @@ If the user asks you to remember something or set up an automation (e.g., "when
         Args:
             trigger_type: Type of trigger (email, calendar, hubspot)
             trigger_data: Data about the trigger event
+            event_embedding: Embedding of the event's content, if already computed
             
         Returns:
             Optional response message if action was taken
         """
-        # Get relevant ongoing instructions
-        instructions = self.db.query(OngoingInstruction).filter(
-            OngoingInstruction.user_id == self.user.id,
-            OngoingInstruction.is_active == True,
-            or_(
-                OngoingInstruction.trigger_type == trigger_type,
-                OngoingInstruction.trigger_type == "all"
-            )
-        ).all()
+        # Get relevant ongoing instructions, skipping those that clearly
+        # don't relate to the event
+        instructions = self._matching_instructions(
+            await self._get_trigger_instructions(trigger_type),
+            trigger_data,
+            event_embedding
+        )
         
         if not instructions:
             return None
         
-        # Get current date and time
-        current_datetime = datetime.now(timezone.utc)
-        current_date_str = current_datetime.strftime("%Y-%m-%d")
-        current_time_str = current_datetime.strftime("%H:%M:%S UTC")
-        current_weekday = current_datetime.strftime("%A")
+        prompt = self._build_trigger_prompt(trigger_type, trigger_data, instructions)
         
-        # Build prompt for AI to decide what to do
-        prompt = f"""CRITICAL: Today is {current_date_str} ({current_weekday}) at {current_time_str}.
+        result = await self.chat(prompt, use_cache=False)
+        return result.get("response")
+    
+    async def build_trigger_batch(self, trigger_events: List[Tuple[str, Dict, Optional[Any]]]) -> List[Optional[List[Dict]]]:
+        """
+        Build Batch API message lists for trigger events of this user.
+        
+        Each event gets the same decision prompt as process_ongoing_instructions
+        (with the same keyword prefilter).
+        
+        Args:
+            trigger_events: (trigger type, event data, event embedding or None) per event
+            
+        Returns:
+            Message list for each event, in order (None if no instruction may apply to it)
+        """
+        instructions_by_type: Dict[str, List[Any]] = {}
+        system_message = None
+        messages_list: List[Optional[List[Dict]]] = []
+        for trigger_type, event, event_embedding in trigger_events:
+            if trigger_type not in instructions_by_type:
+                instructions_by_type[trigger_type] = await self._get_trigger_instructions(trigger_type)
+            event_instructions = self._matching_instructions(instructions_by_type[trigger_type], event, event_embedding)
+            if not event_instructions:
+                messages_list.append(None)
+                continue
+            
+            # Every event of the user shares one system prompt
+            if system_message is None:
+                system_message = {"role": "system", "content": await self._get_system_prompt()}
+            messages_list.append([
+                system_message,
+                {"role": "user", "content": self._build_trigger_prompt(trigger_type, event, event_instructions)}
+            ])
+        return messages_list
 
-A {trigger_type} event occurred:
-{json.dumps(trigger_data, indent=2)}
 
-You have these ongoing instructions:
-"""
-        for instruction in instructions:
-            prompt += f"- {instruction.instruction}\n"
+async def submit_chat_batch(requests: List[Tuple[str, List[Dict]]]) -> str:
+    """
+    Submit several independent first-turn completions to the OpenAI Batch API.
+    
+    Batch requests cost half as much and have separate rate limits, but
+    may take up to the completion window to finish, so this is only
+    used for background work.
+    
+    Args:
+        requests: (custom id, message list) per completion
+    
+    Returns:
+        ID of the created batch, for wait_for_chat_batch
+    """
+    lines = [
+        _dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": settings.PLANNER_MODEL,
+                "messages": messages,
+                "tools": TOOLS,
+                "tool_choice": "auto"
+            }
+        })
+        for custom_id, messages in requests
+    ]
+    input_file = await openai_client.files.create(
+        file=("chat_batch.jsonl", "\n".join(lines).encode("utf-8")),
+        purpose="batch"
+    )
+    batch = await openai_client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window=BATCH_COMPLETION_WINDOW
+    )
+    return batch.id
+
+
+async def wait_for_chat_batch(batch_id: str) -> Dict[str, Any]:
+    """
+    Wait for a batch from submit_chat_batch to finish and read its results.
+    
+    Args:
+        batch_id: ID of the batch
+    
+    Returns:
+        Assistant message per custom id (requests that failed are left out)
+    """
+    # Poll until the batch finishes; transient API errors just delay the next check
+    while True:
+        try:
+            batch = await openai_client.batches.retrieve(batch_id)
+        except (APIConnectionError, InternalServerError, RateLimitError):
+            logger.warning("Could not check status of batch %s, retrying", batch_id)
+        else:
+            if batch.status in BATCH_FINAL_STATUSES:
+                break
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+    
+    results: Dict[str, Any] = {}
+    if not batch.output_file_id:
+        logger.warning("Batch %s ended with status %s and no output", batch_id, batch.status)
+        return results
+    
+    # Output lines come back in any order; match them up by custom_id
+    output = (await openai_client.files.content(batch.output_file_id)).text
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        item = orjson.loads(line)
+        response = item.get("response") or {}
+        if response.get("status_code") == 200:
+            completion = ChatCompletion.model_validate(response["body"])
+            results[item["custom_id"]] = completion.choices[0].message
+    return results
+
+
+async def _load_user(user_id: int) -> Optional[User]:
+    """Load a user with OAuth tokens on a short-lived async session (returned detached)."""
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(_USER_WITH_TOKENS, {"uid": user_id})).scalar_one_or_none()
+
+
+async def _execute_batch_tool_calls(user_id: int, tool_call_lists: List[Any]):
+    """Run the tool calls a finished batch asked for on behalf of one user, on a fresh session."""
+    db = SessionLocal()
+    try:
+        # Tokens are re-read, since they may have been refreshed while the batch ran
+        user = await _load_user(user_id)
+        if not user:
+            return
+        agent = AIAgent(db, user)
+        for tool_calls in tool_call_lists:
+            await agent._execute_tools(tool_calls)
+    except Exception:
+        logger.exception("Error executing ongoing instruction actions for user %s", user_id)
+    finally:
+        db.close()
+
+
+def queue_trigger_events(
+    db: Session,
+    user_id: int,
+    trigger_type: str,
+    events: List[Dict],
+    event_embeddings: Optional[List[Any]] = None
+) -> None:
+    """
+    Queue trigger events for ongoing-instruction processing through the Batch API.
+    
+    The events are added to the trigger_events table on the caller's
+    session, so they are committed together with the data that triggered
+    them; call trigger_batches.notify() after the commit.
+    
+    Args:
+        db: Database session (committed by the caller)
+        user_id: User the events belong to
+        trigger_type: Type of trigger (email, calendar, hubspot)
+        events: Data about each trigger event
+        event_embeddings: Embedding of each event's content, if already computed
+    """
+    if not events:
+        return
+    db.execute(insert(TriggerEvent), [
+        {"user_id": user_id, "trigger_type": trigger_type, "event": event, "embedding": event_embedding}
+        for event, event_embedding in zip(events, event_embeddings or [None] * len(events))
+    ])
+
+
+async def _submit_trigger_batch() -> Tuple[Optional[str], int]:
+    """
+    Claim up to TRIGGER_BATCH_MAX_EVENTS queued trigger events and submit them as one batch.
+    
+    Events no instruction may apply to are deleted straight away; the
+    others are marked with the batch ID, so the batch can be picked up
+    again after a restart.
+    
+    Returns:
+        (batch ID or None if nothing was submitted, number of events claimed)
+    """
+    async with AsyncSessionLocal() as session:
+        rows = (await session.execute(
+            _CLAIM_TRIGGER_EVENTS,
+            {"stale_before": datetime.now(timezone.utc) - TRIGGER_CLAIM_TIMEOUT}
+        )).all()
+        await session.commit()
+    if not rows:
+        return None, 0
+    
+    # Group the events by user
+    rows_by_user: Dict[int, List[Any]] = {}
+    for row in rows:
+        rows_by_user.setdefault(row.user_id, []).append(row)
+    
+    # Build every user's prompts, keyed by event ID
+    requests = []
+    for user_id, user_rows in rows_by_user.items():
+        user = await _load_user(user_id)
+        if not user:
+            continue
+        messages_list = await AIAgent(None, user).build_trigger_batch(
+            [(row.trigger_type, row.event, row.embedding) for row in user_rows]
+        )
+        requests.extend(
+            (str(row.id), messages)
+            for row, messages in zip(user_rows, messages_list)
+            if messages is not None
+        )
+    
+    batch_id = await submit_chat_batch(requests) if requests else None
+    
+    # Record the batch on its events and drop the events that needed no decision
+    submitted_ids = [int(custom_id) for custom_id, _ in requests]
+    async with AsyncSessionLocal() as session:
+        if submitted_ids:
+            await session.execute(
+                update(TriggerEvent).where(TriggerEvent.id.in_(submitted_ids)).values(batch_id=batch_id)
+            )
+        await session.execute(
+            delete(TriggerEvent).where(
+                TriggerEvent.id.in_([row.id for row in rows]),
+                TriggerEvent.batch_id.is_(None)
+            )
+        )
+        await session.commit()
+    return batch_id, len(rows)
+
+
+async def _finish_trigger_batch(batch_id: str):
+    """
+    Wait for a trigger batch and execute the tool calls it asked for.
+    
+    No database session is open while the batch runs; each user's tool
+    calls are executed afterwards on a session of their own.
+    """
+    try:
+        results = await wait_for_chat_batch(batch_id)
         
-        prompt += "\nShould you take any action? Use tools if needed."
-        prompt += f"\n\nIMPORTANT: When calculating dates from relative terms (e.g., 'next Tuesday', 'tomorrow', 'next week'), use TODAY's date ({current_date_str}) to determine the actual future date. Always use ISO 8601 format (YYYY-MM-DDTHH:MM:SSZ) for calendar events. Ensure dates are in the future, not the past."
-        prompt += "\n\nCRITICAL: When creating calendar events, ALWAYS include the attendee's email address in the 'attendees' parameter. If this event was triggered by an email, use the sender's email address (from the 'from' field in the event data above) as an attendee so they receive an invitation."
+        # Deleting the batch's events claims its results, so when several
+        # workers wait on the same batch only one of them acts on it
+        async with AsyncSessionLocal() as session:
+            rows = (await session.execute(
+                delete(TriggerEvent)
+                .where(TriggerEvent.batch_id == batch_id)
+                .returning(TriggerEvent.id, TriggerEvent.user_id)
+            )).all()
+            await session.commit()
         
-        result = await self.chat(prompt)
-        return result.get("response")
+        # Collect the tool calls the AI asked for, per user
+        tool_calls_by_user: Dict[int, List[Any]] = {}
+        for row in rows:
+            assistant_message = results.get(str(row.id))
+            if assistant_message is not None and assistant_message.tool_calls:
+                tool_calls_by_user.setdefault(row.user_id, []).append(assistant_message.tool_calls)
+        
+        for user_id, tool_call_lists in tool_calls_by_user.items():
+            await _execute_batch_tool_calls(user_id, tool_call_lists)
+    except Exception:
+        logger.exception("Error processing ongoing instructions batch %s", batch_id)
+
+
+class TriggerBatchScheduler:
+    """
+    Submits queued trigger events (the trigger_events table) to the Batch API.
+    
+    Events from every user are submitted together once TRIGGER_BATCH_MAX_EVENTS
+    are waiting or TRIGGER_BATCH_MAX_WAIT seconds after the first one was
+    queued, instead of one batch job per synced page. Queued events and
+    submitted batch IDs live in the database, so start() resumes both
+    after a restart.
+    """
+    
+    def __init__(self):
+        # Events queued since the last flush (only used to decide when to flush)
+        self._pending = 0
+        self._timer: Optional[asyncio.Task] = None
+        # Background tasks, referenced so they aren't garbage collected mid-run
+        self._tasks = set()
+    
+    def start(self):
+        """Resume waiting on submitted batches and submit events left queued by a previous run."""
+        self._spawn(self._resume())
+    
+    async def _resume(self):
+        """Background task for start()."""
+        try:
+            async with AsyncSessionLocal() as session:
+                batch_ids = (await session.execute(_SUBMITTED_TRIGGER_BATCHES)).scalars().all()
+                pending = await session.scalar(_QUEUED_TRIGGER_EVENT_COUNT)
+        except Exception:
+            logger.exception("Error resuming ongoing instructions batches")
+            return
+        for batch_id in batch_ids:
+            self._spawn(_finish_trigger_batch(batch_id))
+        if pending:
+            self.notify(pending)
+    
+    def notify(self, count: int):
+        """
+        Note that trigger events were queued (call after their transaction committed).
+        
+        Args:
+            count: Number of events queued
+        """
+        self._pending += count
+        if self._pending >= TRIGGER_BATCH_MAX_EVENTS:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        """Flush once the wait window has passed."""
+        await asyncio.sleep(TRIGGER_BATCH_MAX_WAIT)
+        self._timer = None
+        self.flush()
+    
+    def flush(self):
+        """Submit every queued event in the background."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._pending = 0
+        self._spawn(self._submit())
+    
+    async def _submit(self):
+        """Submit queued events, one batch per TRIGGER_BATCH_MAX_EVENTS, until none are left."""
+        try:
+            while True:
+                batch_id, claimed = await _submit_trigger_batch()
+                if batch_id:
+                    self._spawn(_finish_trigger_batch(batch_id))
+                if claimed < TRIGGER_BATCH_MAX_EVENTS:
+                    break
+        except Exception:
+            logger.exception("Error submitting ongoing instructions batch")
+    
+    def _spawn(self, coro):
+        """Run a coroutine as a tracked background task."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def aclose(self):
+        """
+        Stop the background tasks.
+        
+        Submitted batches keep running at OpenAI and queued events stay in
+        the database; start() picks both up again on the next startup.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
 
+# Process-wide scheduler instance
+trigger_batches = TriggerBatchScheduler()
@@ -0,0 +1,191 @@
+"""
+Semantic cache for chat responses.
+
+Advisors often repeat nearly the same question ("what's on my calendar
+tomorrow"). Answers that did not need any tool calls are kept per user for
+a few minutes and reused when a new message is an exact or near-duplicate
+(cosine similarity of the message embeddings) of a cached one asked after
+the same conversation history, so context-dependent follow-ups ("and the
+week after?") never pick up an answer given in another conversation.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+import hashlib
+import threading
+import time
+import numpy as np
+import orjson
+
+# Minimum cosine similarity for two messages to count as the same question
+SIMILARITY_THRESHOLD = 0.95
+
+# Cached answers older than this are not reused
+CACHE_TTL_SECONDS = 600
+
+# Bounds on memory use: ~6 KB per entry (1536 float32 dimensions plus the answer),
+# so 2000 users x 10 entries stays around 100 MB at worst
+MAX_CACHED_USERS = 2000
+MAX_ENTRIES_PER_USER = 10
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase and collapse whitespace so trivially different messages match exactly."""
+    return " ".join(message.lower().split())
+
+
+def conversation_key(conversation_history: Optional[List[Dict]]) -> bytes:
+    """Hash the conversation history an answer depends on (empty for a new conversation)."""
+    if not conversation_history:
+        return b""
+    return hashlib.blake2b(orjson.dumps(conversation_history), digest_size=16).digest()
+
+
+@dataclass
+class _CacheEntry:
+    """A cached answer and the normalized message/embedding and conversation it answered."""
+    normalized_message: str
+    context: bytes  # conversation_key() of the history the message was asked after
+    vector: np.ndarray  # unit-length float32 embedding
+    response: str
+    created_at: float
+
+
+class SmartChatCache:
+    """
+    Per-user LRU + TTL cache of chat answers, matched by embedding similarity.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        ttl: float = CACHE_TTL_SECONDS,
+        max_users: int = MAX_CACHED_USERS,
+        max_entries_per_user: int = MAX_ENTRIES_PER_USER
+    ):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_users = max_users
+        self.max_entries_per_user = max_entries_per_user
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, List[_CacheEntry]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _fresh_entries(self, user_id: int) -> List[_CacheEntry]:
+        """Drop expired entries for a user and return the rest (caller holds the lock)."""
+        entries = self._entries.get(user_id)
+        if not entries:
+            return []
+        cutoff = time.monotonic() - self.ttl
+        entries = [entry for entry in entries if entry.created_at > cutoff]
+        if entries:
+            self._entries[user_id] = entries
+            self._entries.move_to_end(user_id)
+        else:
+            del self._entries[user_id]
+        return entries
+
+    async def get(
+        self,
+        user_id: int,
+        message: str,
+        embed: Callable[[str], Awaitable[List[float]]],
+        context: bytes = b""
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Look up a cached answer for a message.
+
+        Args:
+            user_id: User asking
+            message: The new message
+            embed: Async function returning the embedding of a text; only called
+                when the user has cached answers and none matches the text exactly
+            context: conversation_key() of the history the message follows
+
+        Returns:
+            (cached answer or None, message embedding if one was computed)
+        """
+        normalized = normalize_message(message)
+        with self._lock:
+            entries = [entry for entry in self._fresh_entries(user_id) if entry.context == context]
+
+        if not entries:
+            self.misses += 1
+            return None, None
+
+        for entry in entries:
+            if entry.normalized_message == normalized:
+                self.hits += 1
+                return entry.response, entry.vector
+
+        vector = _unit(await embed(normalized))
+        similarities = np.stack([entry.vector for entry in entries]) @ vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            self.hits += 1
+            return entries[best].response, vector
+
+        self.misses += 1
+        return None, vector
+
+    async def put(
+        self,
+        user_id: int,
+        message: str,
+        response: str,
+        embed: Callable[[str], Awaitable[List[float]]],
+        vector: Optional[np.ndarray] = None,
+        context: bytes = b""
+    ):
+        """
+        Cache an answer for a message.
+
+        Args:
+            user_id: User who asked
+            message: The message that was answered
+            response: The answer
+            embed: Async function returning the embedding of a text (used if vector is None)
+            vector: Embedding already computed by get(), if any
+            context: conversation_key() of the history the message followed
+        """
+        normalized = normalize_message(message)
+        if vector is None:
+            vector = _unit(await embed(normalized))
+        entry = _CacheEntry(normalized, context, vector, response, time.monotonic())
+
+        with self._lock:
+            entries = self._fresh_entries(user_id)
+            entries = [e for e in entries if (e.normalized_message, e.context) != (normalized, context)]
+            entries.append(entry)
+            self._entries[user_id] = entries[-self.max_entries_per_user:]
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Forget every cached answer for a user (their data changed)."""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "users": len(self._entries),
+                "entries": sum(len(entries) for entries in self._entries.values())
+            }
+
+
+def _unit(embedding: List[float]) -> np.ndarray:
+    """Convert an embedding to a unit-length float32 vector."""
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# Process-wide cache instance
+chat_cache = SmartChatCache()
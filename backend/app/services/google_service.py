@@ -2,41 +2,98 @@
 Google service for interacting with Gmail and Google Calendar APIs.
 """
 
+import asyncio
+import binascii
+import hashlib
 import httpx
+import logging
+import orjson
+import uuid
 from typing import List, Dict, Optional
+from cachetools import TTLCache
+from app.http_client import SHARED_CLIENT
 from datetime import datetime
 import email
+from email.mime.text import MIMEText
 from email.utils import parsedate_to_datetime
 
+logger = logging.getLogger(__name__)
+
+# Maximum number of Gmail message fetches in flight at once
+MAX_CONCURRENT_FETCHES = 10
+
+# Gmail batch endpoint; accepts up to 100 sub-requests, but Google advises
+# staying at 50 or fewer to avoid per-user rate limiting
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+GMAIL_BATCH_SIZE = 50
+
+# Maximum number of batch requests in flight at once
+MAX_CONCURRENT_BATCHES = 2
+
+# Raw message JSON keyed by (token scope, message ID). Message content never
+# changes, so entries only age out to bound memory (~50 KB per message).
+_MESSAGE_CACHE = TTLCache(maxsize=1000, ttl=24 * 3600)
+
+# Headers _parse_email reads (Gmail returns dozens per message)
+_PARSED_HEADERS = frozenset({"From", "To", "Cc", "Subject", "Date"})
+
+# Maps the URL-safe base64 alphabet Gmail uses back to the standard one, and back
+_URLSAFE_TRANS = bytes.maketrans(b"-_", b"+/")
+_B64_URLSAFE_TRANS = bytes.maketrans(b"+/", b"-_")
+
+
+def _decode_body(data: str) -> str:
+    """Decode a Gmail URL-safe base64 body (padding optional) to text."""
+    raw = data.encode("ascii").translate(_URLSAFE_TRANS)
+    return binascii.a2b_base64(raw + b"=" * (-len(raw) % 4)).decode("utf-8", errors="ignore")
+
 
 class GoogleService:
     """
     Service for interacting with Google APIs (Gmail and Calendar).
     """
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, client: Optional[httpx.AsyncClient] = None):
         """
         Initialize Google service with access token.
         
         Args:
             access_token: OAuth access token for Google APIs
+            client: HTTP client to use (defaults to the shared pooled client)
         """
         self.access_token = access_token
+        self.client = client or SHARED_CLIENT
         self.base_url = "https://www.googleapis.com"
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
+        # Scopes cached messages to this mailbox without keeping the token as a key
+        self._cache_scope = hashlib.blake2b(access_token.encode("utf-8"), digest_size=8).digest()
+    
+    async def aclose(self):
+        """
+        Close the HTTP client if it was injected for this service.
+        
+        The shared pooled client is left open; it is closed once on app shutdown.
+        """
+        if self.client is not SHARED_CLIENT:
+            await self.client.aclose()
+    
+    async def __aenter__(self) -> "GoogleService":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
     
     async def get_gmail_profile(self) -> Dict:
         """Get Gmail profile information."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/gmail/v1/users/me/profile",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.get(
+            f"{self.base_url}/gmail/v1/users/me/profile",
+            headers=self.headers
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def list_emails(self, max_results: int = 100, page_token: Optional[str] = None, query: Optional[str] = None) -> Dict:
         """
@@ -50,20 +107,42 @@ class GoogleService:
         Returns:
             Dictionary with emails list and next page token
         """
-        async with httpx.AsyncClient() as client:
-            params = {"maxResults": max_results}
-            if page_token:
-                params["pageToken"] = page_token
-            if query:
-                params["q"] = query
+        params = {"maxResults": max_results}
+        if page_token:
+            params["pageToken"] = page_token
+        if query:
+            params["q"] = query
+        
+        response = await self.client.get(
+            f"{self.base_url}/gmail/v1/users/me/messages",
+            headers=self.headers,
+            params=params
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
+    
+    async def list_history(self, start_history_id: str, page_token: Optional[str] = None) -> Dict:
+        """
+        List mailbox changes since a history ID (only added messages).
+        
+        Args:
+            start_history_id: historyId to list changes after
+            page_token: Token for pagination
             
-            response = await client.get(
-                f"{self.base_url}/gmail/v1/users/me/messages",
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
-            return response.json()
+        Returns:
+            Dictionary with history records, next page token and the current historyId
+        """
+        params = {"startHistoryId": start_history_id, "historyTypes": "messageAdded"}
+        if page_token:
+            params["pageToken"] = page_token
+        
+        response = await self.client.get(
+            f"{self.base_url}/gmail/v1/users/me/history",
+            headers=self.headers,
+            params=params
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def get_email(self, message_id: str) -> Dict:
         """
@@ -75,14 +154,143 @@ class GoogleService:
         Returns:
             Full email data with headers and body
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/gmail/v1/users/me/messages/{message_id}",
-                headers=self.headers,
-                params={"format": "full"}
+        cache_key = (self._cache_scope, message_id)
+        cached = _MESSAGE_CACHE.get(cache_key)
+        if cached is not None:
+            return orjson.loads(cached)
+        
+        response = await self.client.get(
+            f"{self.base_url}/gmail/v1/users/me/messages/{message_id}",
+            headers=self.headers,
+            params={"format": "full"}
+        )
+        response.raise_for_status()
+        _MESSAGE_CACHE[cache_key] = response.content
+        return orjson.loads(response.content)
+    
+    async def get_emails_batch(self, message_ids: List[str], batch_size: int = GMAIL_BATCH_SIZE) -> List[Dict]:
+        """
+        Get full details for several emails using Gmail batch requests.
+        
+        Up to batch_size messages are fetched per HTTP round trip; cached
+        messages are not requested. Messages whose sub-request fails (e.g.
+        rate limited) are re-fetched individually; messages that no longer
+        exist (deleted after listing) are skipped.
+        
+        Args:
+            message_ids: Gmail message IDs
+            batch_size: Maximum number of messages per batch request
+            
+        Returns:
+            Full email data for each ID that still exists, in the same order
+        """
+        if not message_ids:
+            return []
+        
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+        
+        async def fetch(chunk: List[str]) -> Dict[str, Dict]:
+            async with semaphore:
+                return await self._fetch_email_batch(chunk)
+        
+        # Serve cached messages, batch-fetch the rest
+        fetched = {}
+        pending = []
+        for message_id in message_ids:
+            cached = _MESSAGE_CACHE.get((self._cache_scope, message_id))
+            if cached is not None:
+                fetched[message_id] = orjson.loads(cached)
+            else:
+                pending.append(message_id)
+        
+        chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        for result in await asyncio.gather(*(fetch(chunk) for chunk in chunks)):
+            fetched.update(result)
+        
+        # Retry failed sub-requests one by one
+        missing = [message_id for message_id in message_ids if message_id not in fetched]
+        if missing:
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+            
+            async def retry(message_id: str) -> Dict:
+                async with semaphore:
+                    return await self.get_email(message_id)
+            
+            results = await asyncio.gather(*(retry(message_id) for message_id in missing), return_exceptions=True)
+            for message_id, result in zip(missing, results):
+                if isinstance(result, httpx.HTTPStatusError) and result.response.status_code == 404:
+                    # Deleted between listing and fetching; skip it rather than fail the page
+                    logger.warning("Gmail message %s no longer exists, skipping", message_id)
+                    continue
+                if isinstance(result, BaseException):
+                    raise result
+                fetched[message_id] = result
+        
+        return [fetched[message_id] for message_id in message_ids if message_id in fetched]
+    
+    async def _fetch_email_batch(self, message_ids: List[str]) -> Dict[str, Dict]:
+        """
+        Send one Gmail batch request for a list of messages.
+        
+        Args:
+            message_ids: Gmail message IDs (at most GMAIL_BATCH_SIZE)
+            
+        Returns:
+            Email data by message ID for the sub-requests that succeeded
+        """
+        boundary = f"batch_{uuid.uuid4().hex}"
+        
+        # One application/http part per message, tagged with its index
+        parts = []
+        for index, message_id in enumerate(message_ids):
+            parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <item{index}>\r\n\r\n"
+                f"GET /gmail/v1/users/me/messages/{message_id}?format=full\r\n\r\n"
             )
-            response.raise_for_status()
-            return response.json()
+        parts.append(f"--{boundary}--\r\n")
+        
+        response = await self.client.post(
+            GMAIL_BATCH_URL,
+            headers={
+                "Authorization": self.headers["Authorization"],
+                "Content-Type": f"multipart/mixed; boundary={boundary}"
+            },
+            content="".join(parts).encode("utf-8")
+        )
+        response.raise_for_status()
+        
+        # Split the multipart/mixed response on its own boundary
+        content_type = response.headers.get("Content-Type", "")
+        response_boundary = content_type.split("boundary=", 1)[-1].split(";", 1)[0].strip('"')
+        
+        results = {}
+        for part in response.content.split(f"--{response_boundary}".encode("utf-8"))[1:]:
+            if part.startswith(b"--"):
+                break
+            
+            # Part headers, then the embedded HTTP status line + headers, then the body
+            sections = part.split(b"\r\n\r\n", 2)
+            if len(sections) < 3:
+                continue
+            part_headers, http_head, body = sections
+            
+            content_id = ""
+            for line in part_headers.decode("utf-8", errors="ignore").splitlines():
+                if line.lower().startswith("content-id:"):
+                    content_id = line.split(":", 1)[1].strip().strip("<>")
+            status_line = http_head.split(b"\r\n", 1)[0].split()
+            if len(status_line) < 2 or status_line[1] != b"200" or "item" not in content_id:
+                continue
+            
+            index = int(content_id.rsplit("item", 1)[1])
+            if index < len(message_ids):
+                body = body.strip()
+                results[message_ids[index]] = orjson.loads(body)
+                _MESSAGE_CACHE[(self._cache_scope, message_ids[index])] = body
+        
+        return results
     
     def _parse_email(self, email_data: Dict) -> Dict:
         """
@@ -94,7 +302,11 @@ class GoogleService:
         Returns:
             Parsed email dictionary
         """
-        headers = {h["name"]: h["value"] for h in email_data.get("payload", {}).get("headers", [])}
+        payload = email_data.get("payload", {})
+        headers = {
+            h["name"]: h["value"] for h in payload.get("headers", ())
+            if h["name"] in _PARSED_HEADERS
+        }
         
         # Extract email addresses
         from_email = headers.get("From", "")
@@ -105,30 +317,24 @@ class GoogleService:
         body_text = ""
         body_html = ""
         
-        payload = email_data.get("payload", {})
-        if "parts" in payload:
-            # Multipart message
-            for part in payload["parts"]:
-                mime_type = part.get("mimeType", "")
-                body_data = part.get("body", {}).get("data", "")
-                if body_data:
-                    import base64
-                    decoded = base64.urlsafe_b64decode(body_data).decode("utf-8", errors="ignore")
-                    if mime_type == "text/plain":
-                        body_text = decoded
-                    elif mime_type == "text/html":
-                        body_html = decoded
-        else:
-            # Simple message
-            mime_type = payload.get("mimeType", "")
-            body_data = payload.get("body", {}).get("data", "")
-            if body_data:
-                import base64
-                decoded = base64.urlsafe_b64decode(body_data).decode("utf-8", errors="ignore")
-                if mime_type == "text/plain":
-                    body_text = decoded
-                elif mime_type == "text/html":
-                    body_html = decoded
+        # Walk the MIME tree depth-first in document order (multipart/alternative
+        # is often nested inside multipart/mixed) and keep the first plain and
+        # HTML bodies, stopping once both are found
+        stack = [payload]
+        while stack and not (body_text and body_html):
+            part = stack.pop()
+            parts = part.get("parts")
+            if parts:
+                stack.extend(reversed(parts))
+                continue
+            mime_type = part.get("mimeType", "")
+            body_data = part.get("body", {}).get("data")
+            if not body_data:
+                continue
+            if mime_type == "text/plain" and not body_text:
+                body_text = _decode_body(body_data)
+            elif mime_type == "text/html" and not body_html:
+                body_html = _decode_body(body_data)
         
         # Parse date
         date_str = headers.get("Date", "")
@@ -136,7 +342,7 @@ class GoogleService:
         if date_str:
             try:
                 received_at = parsedate_to_datetime(date_str)
-            except:
+            except (TypeError, ValueError):
                 pass
         
         return {
@@ -164,9 +370,6 @@ class GoogleService:
         Returns:
             Sent message data
         """
-        import base64
-        from email.mime.text import MIMEText
-        
         # Create email message
         message = MIMEText(body)
         message["To"] = to
@@ -174,17 +377,16 @@ class GoogleService:
         if cc:
             message["Cc"] = ", ".join(cc)
         
-        # Encode message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode("utf-8")
+        # Encode message as URL-safe base64
+        raw_message = binascii.b2a_base64(message.as_bytes(), newline=False).translate(_B64_URLSAFE_TRANS).decode("ascii")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/gmail/v1/users/me/messages/send",
-                headers=self.headers,
-                json={"raw": raw_message}
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.post(
+            f"{self.base_url}/gmail/v1/users/me/messages/send",
+            headers=self.headers,
+            json={"raw": raw_message}
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def list_calendar_events(self, time_min: Optional[str] = None, time_max: Optional[str] = None) -> List[Dict]:
         """
@@ -197,21 +399,20 @@ class GoogleService:
         Returns:
             List of calendar events
         """
-        async with httpx.AsyncClient() as client:
-            params = {}
-            if time_min:
-                params["timeMin"] = time_min
-            if time_max:
-                params["timeMax"] = time_max
-            
-            response = await client.get(
-                f"{self.base_url}/calendar/v3/calendars/primary/events",
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("items", [])
+        params = {}
+        if time_min:
+            params["timeMin"] = time_min
+        if time_max:
+            params["timeMax"] = time_max
+        
+        response = await self.client.get(
+            f"{self.base_url}/calendar/v3/calendars/primary/events",
+            headers=self.headers,
+            params=params
+        )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        return data.get("items", [])
     
     async def create_calendar_event(
         self,
@@ -247,14 +448,13 @@ class GoogleService:
             event_data["attendees"] = [{"email": email} for email in attendees]
             event_data["sendUpdates"] = "all"  # Send email invitations
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/calendar/v3/calendars/primary/events",
-                headers=self.headers,
-                json=event_data
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.post(
+            f"{self.base_url}/calendar/v3/calendars/primary/events",
+            headers=self.headers,
+            json=event_data
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def get_available_times(
         self,
@@ -274,21 +474,19 @@ class GoogleService:
             List of available time slots
         """
         # Get busy times
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/calendar/v3/freeBusy",
-                headers=self.headers,
-                json={
-                    "timeMin": time_min,
-                    "timeMax": time_max,
-                    "items": [{"id": "primary"}]
-                }
-            )
-            response.raise_for_status()
-            data = response.json()
+        response = await self.client.post(
+            f"{self.base_url}/calendar/v3/freeBusy",
+            headers=self.headers,
+            json={
+                "timeMin": time_min,
+                "timeMax": time_max,
+                "items": [{"id": "primary"}]
+            }
+        )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
             
         # Calculate available slots (simplified - in production, use proper algorithm)
         busy_periods = data.get("calendars", {}).get("primary", {}).get("busy", [])
         # This is a simplified version - full implementation would calculate gaps
         return []
-
@@ -2,8 +2,24 @@
 HubSpot service for interacting with HubSpot CRM API.
 """
 
+import asyncio
+import hashlib
 import httpx
+import orjson
 from typing import List, Dict, Optional
+from cachetools import TTLCache
+from app.http_client import SHARED_CLIENT
+
+# Maximum number of HubSpot note fetches in flight at once
+MAX_CONCURRENT_FETCHES = 10
+
+# Raw contact JSON keyed by (token scope, contact ID); contacts can be edited
+# in HubSpot, so entries are only reused for a minute
+_CONTACT_CACHE = TTLCache(maxsize=5000, ttl=60)
+
+# Retries for rate-limited (429) requests, with exponential backoff from the base delay
+MAX_RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BASE_DELAY = 1.0
 
 
 class HubSpotService:
@@ -11,29 +27,47 @@ class HubSpotService:
     Service for interacting with HubSpot CRM API.
     """
     
-    def __init__(self, access_token: str):
+    def __init__(self, access_token: str, client: Optional[httpx.AsyncClient] = None):
         """
         Initialize HubSpot service with access token.
         
         Args:
             access_token: OAuth access token for HubSpot API
+            client: HTTP client to use (defaults to the shared pooled client)
         """
         self.access_token = access_token
+        self.client = client or SHARED_CLIENT
         self.base_url = "https://api.hubapi.com"
         self.headers = {
             "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
+        # Scopes cached contacts to this account without keeping the token as a key
+        self._cache_scope = hashlib.blake2b(access_token.encode("utf-8"), digest_size=8).digest()
+    
+    async def aclose(self):
+        """
+        Close the HTTP client if it was injected for this service.
+        
+        The shared pooled client is left open; it is closed once on app shutdown.
+        """
+        if self.client is not SHARED_CLIENT:
+            await self.client.aclose()
+    
+    async def __aenter__(self) -> "HubSpotService":
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
     
     async def get_account_info(self) -> Dict:
         """Get HubSpot account information."""
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/integrations/v1/me",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.get(
+            f"{self.base_url}/integrations/v1/me",
+            headers=self.headers
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def search_contacts(self, query: Optional[str] = None, email: Optional[str] = None) -> List[Dict]:
         """
@@ -46,37 +80,36 @@ class HubSpotService:
         Returns:
             List of matching contacts
         """
-        async with httpx.AsyncClient() as client:
-            if email:
-                # Search by email
-                response = await client.post(
-                    f"{self.base_url}/crm/v3/objects/contacts/search",
-                    headers=self.headers,
-                    json={
-                        "filterGroups": [{
-                            "filters": [{
-                                "propertyName": "email",
-                                "operator": "EQ",
-                                "value": email
-                            }]
-                        }],
-                        "properties": ["email", "firstname", "lastname", "phone", "company"]
-                    }
-                )
-            else:
-                # General search
-                response = await client.post(
-                    f"{self.base_url}/crm/v3/objects/contacts/search",
-                    headers=self.headers,
-                    json={
-                        "query": query or "",
-                        "properties": ["email", "firstname", "lastname", "phone", "company"]
-                    }
-                )
-            
-            response.raise_for_status()
-            data = response.json()
-            return data.get("results", [])
+        if email:
+            # Search by email
+            response = await self.client.post(
+                f"{self.base_url}/crm/v3/objects/contacts/search",
+                headers=self.headers,
+                json={
+                    "filterGroups": [{
+                        "filters": [{
+                            "propertyName": "email",
+                            "operator": "EQ",
+                            "value": email
+                        }]
+                    }],
+                    "properties": ["email", "firstname", "lastname", "phone", "company"]
+                }
+            )
+        else:
+            # General search
+            response = await self.client.post(
+                f"{self.base_url}/crm/v3/objects/contacts/search",
+                headers=self.headers,
+                json={
+                    "query": query or "",
+                    "properties": ["email", "firstname", "lastname", "phone", "company"]
+                }
+            )
+        
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        return data.get("results", [])
     
     async def get_contact(self, contact_id: str) -> Dict:
         """
@@ -88,16 +121,21 @@ class HubSpotService:
         Returns:
             Contact data
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/crm/v3/objects/contacts/{contact_id}",
-                headers=self.headers,
-                params={
-                    "properties": "email,firstname,lastname,phone,company"
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+        cache_key = (self._cache_scope, contact_id)
+        cached = _CONTACT_CACHE.get(cache_key)
+        if cached is not None:
+            return orjson.loads(cached)
+        
+        response = await self.client.get(
+            f"{self.base_url}/crm/v3/objects/contacts/{contact_id}",
+            headers=self.headers,
+            params={
+                "properties": "email,firstname,lastname,phone,company"
+            }
+        )
+        response.raise_for_status()
+        _CONTACT_CACHE[cache_key] = response.content
+        return orjson.loads(response.content)
     
     async def create_contact(
         self,
@@ -130,14 +168,13 @@ class HubSpotService:
         if company:
             properties["company"] = company
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/crm/v3/objects/contacts",
-                headers=self.headers,
-                json={"properties": properties}
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.post(
+            f"{self.base_url}/crm/v3/objects/contacts",
+            headers=self.headers,
+            json={"properties": properties}
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def create_note(self, contact_id: str, note: str) -> Dict:
         """
@@ -150,22 +187,21 @@ class HubSpotService:
         Returns:
             Created note data
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{self.base_url}/crm/v3/objects/notes",
-                headers=self.headers,
-                json={
-                    "properties": {
-                        "hs_note_body": note
-                    },
-                    "associations": [{
-                        "to": {"id": contact_id},
-                        "types": [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 214}]
-                    }]
-                }
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await self.client.post(
+            f"{self.base_url}/crm/v3/objects/notes",
+            headers=self.headers,
+            json={
+                "properties": {
+                    "hs_note_body": note
+                },
+                "associations": [{
+                    "to": {"id": contact_id},
+                    "types": [{"associationCategory": "HUBSPOT_DEFINED", "associationTypeId": 214}]
+                }]
+            }
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
     
     async def get_contact_notes(self, contact_id: str) -> List[Dict]:
         """
@@ -177,27 +213,53 @@ class HubSpotService:
         Returns:
             List of notes
         """
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{self.base_url}/crm/v3/objects/contacts/{contact_id}/associations/notes",
-                headers=self.headers
-            )
-            response.raise_for_status()
-            data = response.json()
-            
-            # Get note details
-            note_ids = [result["id"] for result in data.get("results", [])]
-            notes = []
-            for note_id in note_ids:
-                note_response = await client.get(
+        response = await self.client.get(
+            f"{self.base_url}/crm/v3/objects/contacts/{contact_id}/associations/notes",
+            headers=self.headers
+        )
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        
+        # Get note details concurrently
+        note_ids = [result["id"] for result in data.get("results", [])]
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+        
+        async def fetch(note_id: str) -> httpx.Response:
+            async with semaphore:
+                return await self._get_with_retry(
                     f"{self.base_url}/crm/v3/objects/notes/{note_id}",
-                    headers=self.headers,
                     params={"properties": "hs_note_body,hs_createdate"}
                 )
-                if note_response.status_code == 200:
-                    notes.append(note_response.json())
+        
+        responses = await asyncio.gather(*(fetch(note_id) for note_id in note_ids), return_exceptions=True)
+        return [
+            orjson.loads(response.content) for response in responses
+            if isinstance(response, httpx.Response) and response.status_code == 200
+        ]
+    
+    async def _get_with_retry(self, url: str, params: Optional[Dict] = None) -> httpx.Response:
+        """
+        GET a URL, backing off and retrying while HubSpot rate limits the request.
+        
+        Args:
+            url: Request URL
+            params: Query parameters
             
-            return notes
+        Returns:
+            The last response received
+        """
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            response = await self.client.get(url, headers=self.headers, params=params)
+            if response.status_code != 429 or attempt == MAX_RATE_LIMIT_RETRIES:
+                return response
+            
+            # Honor Retry-After when HubSpot sends it
+            retry_after = response.headers.get("Retry-After")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = RATE_LIMIT_BASE_DELAY * 2 ** attempt
+            await asyncio.sleep(delay)
     
     async def list_all_contacts(self, limit: int = 100, after: Optional[str] = None) -> Dict:
         """
@@ -210,19 +272,17 @@ class HubSpotService:
         Returns:
             Dictionary with contacts list and pagination info
         """
-        async with httpx.AsyncClient() as client:
-            params = {
-                "limit": limit,
-                "properties": "email,firstname,lastname,phone,company"
-            }
-            if after:
-                params["after"] = after
-            
-            response = await client.get(
-                f"{self.base_url}/crm/v3/objects/contacts",
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
-            return response.json()
-
+        params = {
+            "limit": limit,
+            "properties": "email,firstname,lastname,phone,company"
+        }
+        if after:
+            params["after"] = after
+        
+        response = await self.client.get(
+            f"{self.base_url}/crm/v3/objects/contacts",
+            headers=self.headers,
+            params=params
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)
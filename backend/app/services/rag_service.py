@@ -4,22 +4,133 @@ RAG (Retrieval Augmented Generation) service.
 Handles vector embeddings and semantic search over emails and contacts.
 """
 
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, text as sa_text
-from app.models import Email, Contact
-from openai import OpenAI
-from app.config import settings
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, or_, select, text as sa_text
+from app.database import AsyncSessionLocal
+from app.models import Email
+from pgvector import HalfVector
+from app.openai_client import openai_client
 from typing import List, Dict, Optional
+from cachetools import TTLCache
+import asyncio
+import hashlib
 import numpy as np
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# Number of candidates shortlisted by the binary-quantized index
+# before re-ranking by full-precision similarity
+RERANK_CANDIDATES = 200
 
+# HNSW scans return at most ef_search rows (default 40), so the search
+# list has to be at least as large as the shortlist
+HNSW_EF_SEARCH = RERANK_CANDIDATES
 
-def get_embedding(text: str) -> List[float]:
+# The user_id filter is applied after the index walk; with iterative scans
+# (pgvector 0.8+) the walk continues until enough of this user's rows are
+# found instead of returning too few. Relaxed order is fine because the
+# shortlist is re-ranked by exact distance afterwards.
+HNSW_ITERATIVE_SCAN = "relaxed_order"
+
+# text-embedding-3-small has a max of 8192 tokens
+# Roughly 1 token = 4 characters for English text, so 8192 tokens ≈ 32,768 characters
+# To be safe, truncate to 20,000 characters (well under the limit)
+MAX_EMBEDDING_CHARS = 20000
+
+# Length of the email body / contact notes excerpts put into the LLM context
+# (truncated in SQL so full bodies never leave the database)
+EMAIL_SNIPPET_CHARS = 500
+CONTACT_NOTES_CHARS = 300
+
+# Keep each batched embeddings request well under the API's per-request token limit
+MAX_BATCH_CHARS = 600000
+
+# Concurrent get_embedding calls are coalesced into one request of up to
+# this many texts, waiting at most this long for a batch to fill
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_BATCH_WAIT = 0.02
+
+# Embeddings keyed by a hash of their input text, so identical content
+# (auto-responders, newsletters, re-imports) is only embedded once.
+# Vectors are stored as float16 (what the halfvec columns hold anyway),
+# ~3 KB each at 1536 dimensions, and every caller gets those values.
+_EMBEDDING_CACHE = TTLCache(maxsize=20000, ttl=30 * 24 * 3600)
+
+
+# Semantic search statements. Only the columns and text excerpts used for
+# the context are selected. Stored and query embeddings are unit length, so
+# the re-rank orders by negative inner product (<#>), equivalent to cosine
+# distance without computing norms.
+_EMAIL_SEARCH = sa_text("""
+WITH candidates AS (
+    SELECT id, embedding
+    FROM emails
+    WHERE user_id = :user_id AND embedding IS NOT NULL
+    ORDER BY binary_quantize(embedding)::bit(1536)
+             <~> binary_quantize(CAST(:query_embedding AS halfvec))::bit(1536)
+    LIMIT :candidates
+)
+SELECT e.id, e.from_email, e.subject, e.received_at,
+       LEFT(e.body_text, :snippet_chars) AS snippet
+FROM candidates c
+JOIN emails e ON e.user_id = :user_id AND e.id = c.id
+ORDER BY c.embedding <#> CAST(:query_embedding AS halfvec)
+LIMIT :limit
+""")
+
+_CONTACT_SEARCH = sa_text("""
+WITH candidates AS (
+    SELECT id, embedding
+    FROM contacts
+    WHERE user_id = :user_id AND embedding IS NOT NULL
+    ORDER BY binary_quantize(embedding)::bit(1536)
+             <~> binary_quantize(CAST(:query_embedding AS halfvec))::bit(1536)
+    LIMIT :candidates
+)
+SELECT ct.id, ct.first_name, ct.last_name, ct.email, ct.company,
+       LEFT(ct.notes, :notes_chars) AS notes
+FROM candidates c
+JOIN contacts ct ON ct.id = c.id
+ORDER BY c.embedding <#> CAST(:query_embedding AS halfvec)
+LIMIT :limit
+""")
+
+
+# Transaction-scoped (SET LOCAL) HNSW scan settings
+_SET_HNSW_SCAN = sa_text(
+    "SELECT set_config('hnsw.ef_search', :ef_search, true), "
+    "set_config('hnsw.iterative_scan', :iterative_scan, true)"
+)
+
+
+async def _prepare_vector_search(db: AsyncSession):
+    """Configure HNSW scans for the shortlist query in the current transaction."""
+    await db.execute(_SET_HNSW_SCAN, {
+        "ef_search": str(HNSW_EF_SEARCH),
+        "iterative_scan": HNSW_ITERATIVE_SCAN
+    })
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    """
+    Scale an embedding to unit length (OpenAI's already are, up to rounding)
+    so inner-product search matches cosine similarity.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _content_key(text: str) -> bytes:
+    """Hash of the text with whitespace collapsed, used as the embedding cache key."""
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+
+async def get_embedding(text: str) -> List[float]:
     """
     Get embedding vector for text using OpenAI.
-    Truncates text if it exceeds the model's token limit.
+    Truncates text if it exceeds the model's token limit. The request is
+    batched with other concurrent get_embedding calls, and repeated texts
+    (same content hash) are served from the embedding cache.
     
     Args:
         text: Text to embed
@@ -27,29 +138,165 @@ def get_embedding(text: str) -> List[float]:
     Returns:
         List of floats representing the embedding vector
     """
-    # text-embedding-3-small has a max of 8192 tokens
-    # Roughly 1 token = 4 characters for English text, so 8192 tokens ≈ 32,768 characters
-    # To be safe, truncate to 20,000 characters (well under the limit)
-    MAX_CHARS = 20000
-    
-    if len(text) > MAX_CHARS:
+    if len(text) > MAX_EMBEDDING_CHARS:
         # Truncate but keep the beginning (subject and first part of body are usually most important)
-        text = text[:MAX_CHARS]
-        print(f"Warning: Text truncated to {MAX_CHARS} characters for embedding")
+        text = text[:MAX_EMBEDDING_CHARS]
+        print(f"Warning: Text truncated to {MAX_EMBEDDING_CHARS} characters for embedding")
+    
+    return await embedding_batcher.submit(text)
+
+
+async def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
+    """
+    Get embedding vectors for many texts with as few API calls as possible.
+    Each text is truncated like in get_embedding. Texts already embedded
+    (same content hash) are served from the cache and only embedded once
+    per call.
+    
+    Args:
+        texts: Texts to embed
+        
+    Returns:
+        Embedding vectors, in the same order as texts
+    """
+    texts = [text[:MAX_EMBEDDING_CHARS] for text in texts]
+    keys = [_content_key(text) for text in texts]
+    
+    # Take what the cache already has; collect the unique texts still to embed
+    vectors = {}
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key in vectors or key in pending:
+            continue
+        cached = _EMBEDDING_CACHE.get(key)
+        if cached is not None:
+            vectors[key] = np.frombuffer(cached, dtype=np.float16).tolist()
+        else:
+            pending[key] = text
     
-    response = openai_client.embeddings.create(
-        model="text-embedding-3-small",
-        input=text
-    )
-    return response.data[0].embedding
+    # Split into batches that stay under the per-request size limit
+    batches = []
+    batch, batch_chars = [], 0
+    for key, text in pending.items():
+        if batch and batch_chars + len(text) > MAX_BATCH_CHARS:
+            batches.append(batch)
+            batch, batch_chars = [], 0
+        batch.append((key, text))
+        batch_chars += len(text)
+    if batch:
+        batches.append(batch)
+    
+    # Send the requests concurrently
+    responses = await asyncio.gather(*(
+        openai_client.embeddings.create(
+            model="text-embedding-3-small",
+            input=[text for _, text in batch]
+        )
+        for batch in batches
+    ))
+    for batch, response in zip(batches, responses):
+        # Results carry their input index; sort to be safe
+        for (key, _), item in zip(batch, sorted(response.data, key=lambda item: item.index)):
+            # Return the cached float16 values on a miss too, so a text gets the
+            # same vector whether or not it was cached
+            vector = _normalize(item.embedding).astype(np.float16)
+            vectors[key] = vector.tolist()
+            _EMBEDDING_CACHE[key] = vector.tobytes()
+    
+    return [vectors[key] for key in keys]
 
 
-def search_emails(
-    db: Session,
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into batched API calls.
+    
+    Callers await submit(); a worker task collects texts that arrive within a
+    short window and embeds each batch with get_embeddings_batch in its own
+    task, so a slow request doesn't hold up the next batch.
+    """
+    
+    def __init__(self, max_batch_size: int = EMBEDDING_BATCH_SIZE, max_wait: float = EMBEDDING_BATCH_WAIT):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # In-flight batch requests, referenced so they aren't garbage collected
+        self._requests = set()
+    
+    async def submit(self, text: str) -> List[float]:
+        """
+        Embed a text as part of the next batch.
+        
+        Args:
+            text: Text to embed
+            
+        Returns:
+            List of floats representing the embedding vector
+        """
+        # Start the worker on first use, inside the running event loop
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+    
+    async def _run(self):
+        """Collect queued texts into batches and resolve their futures."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            
+            # Keep collecting until the batch is full or the window closes
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            request = asyncio.create_task(self._embed(batch))
+            self._requests.add(request)
+            request.add_done_callback(self._requests.discard)
+    
+    async def _embed(self, batch: List[tuple]):
+        """Embed one batch and resolve its futures."""
+        try:
+            vectors = await get_embeddings_batch([text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+    
+    async def aclose(self):
+        """Stop the worker task and any in-flight batch requests."""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for request in list(self._requests):
+            request.cancel()
+
+
+# Process-wide batcher instance
+embedding_batcher = EmbeddingBatcher()
+
+
+async def search_emails(
+    db: AsyncSession,
     user_id: int,
     query: str,
-    limit: int = 5
-) -> List[Email]:
+    limit: int = 5,
+    query_embedding: Optional[List[float]] = None
+) -> List[Row]:
     """
     Search emails using exact sender matching and semantic similarity.
     
@@ -61,9 +308,10 @@ def search_emails(
         user_id: User ID to filter emails
         query: Search query text
         limit: Maximum number of results
+        query_embedding: Embedding of the query, if already computed
         
     Returns:
-        List of matching Email objects
+        Matching rows (id, from_email, subject, received_at, snippet)
     """
     # First, try exact match by sender email/name
     # Check if query looks like a name or email (simple heuristic)
@@ -71,58 +319,64 @@ def search_emails(
     
     # Try to find emails from sender matching the query
     # This handles queries like "emails from robert" or just "robert"
-    exact_matches = db.query(Email).filter(
-        Email.user_id == user_id,
-        or_(
-            Email.from_email.ilike(f"%{query_lower}%"),
-            Email.from_email.ilike(f"%{query_lower.replace(' ', '')}%")
-        )
-    ).order_by(Email.received_at.desc()).limit(limit).all()
+    # Substring matches on lower(from_email) use the trigram index; a query with
+    # spaces also matches its unspaced form ("robert smith" -> robertsmith@...)
+    sender = func.lower(Email.from_email)
+    sender_match = sender.contains(query_lower, autoescape=True)
+    if " " in query_lower:
+        sender_match = or_(sender_match, sender.contains(query_lower.replace(" ", ""), autoescape=True))
+    exact_matches = (await db.execute(
+        select(
+            Email.id,
+            Email.from_email,
+            Email.subject,
+            Email.received_at,
+            func.left(Email.body_text, EMAIL_SNIPPET_CHARS).label("snippet")
+        ).where(
+            Email.user_id == user_id,
+            sender_match
+        ).order_by(Email.received_at.desc()).limit(limit)
+    )).all()
     
     if exact_matches:
         return exact_matches
     
     # Fall back to semantic search if no exact matches
     # Get query embedding
-    query_embedding = get_embedding(query)
+    if query_embedding is None:
+        query_embedding = await get_embedding(query)
     
-    # Search using pgvector (cosine similarity)
-    # Format embedding as PostgreSQL array string
-    embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+    # Search using pgvector (inner product of unit vectors)
+    # Bound as a HalfVector so psycopg sends it with pgvector's binary
+    # dumper instead of a ~30 KB text literal
+    query_vector = HalfVector(query_embedding)
     
     # Using raw SQL for pgvector similarity search
-    # Use CAST() instead of ::vector to avoid parameter binding issues
-    results = db.execute(
-        sa_text("""
-        SELECT id, gmail_id, subject, from_email, body_text, received_at,
-               1 - (embedding <=> CAST(:query_embedding AS vector)) as similarity
-        FROM emails
-        WHERE user_id = :user_id AND embedding IS NOT NULL
-        ORDER BY embedding <=> CAST(:query_embedding AS vector)
-        LIMIT :limit
-        """),
+    # Two stages: shortlist by Hamming distance on binary-quantized vectors,
+    # then re-rank the shortlist by exact inner product. The ranked rows
+    # come back in order in one round trip.
+    await _prepare_vector_search(db)
+    emails = (await db.execute(
+        _EMAIL_SEARCH,
         {
             "user_id": user_id,
-            "query_embedding": embedding_str,
-            "limit": limit
+            "query_embedding": query_vector,
+            "candidates": RERANK_CANDIDATES,
+            "limit": limit,
+            "snippet_chars": EMAIL_SNIPPET_CHARS
         }
-    ).fetchall()
-    
-    # Convert to Email objects
-    email_ids = [r[0] for r in results]
-    emails = db.query(Email).filter(Email.id.in_(email_ids)).all()
+    )).all()
     
-    # Sort by similarity (maintain order from query)
-    email_dict = {e.id: e for e in emails}
-    return [email_dict[eid] for eid in email_ids if eid in email_dict]
+    return list(emails)
 
 
-def search_contacts(
-    db: Session,
+async def search_contacts(
+    db: AsyncSession,
     user_id: int,
     query: str,
-    limit: int = 5
-) -> List[Contact]:
+    limit: int = 5,
+    query_embedding: Optional[List[float]] = None
+) -> List[Row]:
     """
     Search contacts using semantic similarity.
     
@@ -131,45 +385,37 @@ def search_contacts(
         user_id: User ID to filter contacts
         query: Search query text
         limit: Maximum number of results
+        query_embedding: Embedding of the query, if already computed
         
     Returns:
-        List of matching Contact objects
+        Matching rows (id, first_name, last_name, email, company, notes excerpt)
     """
     # Get query embedding
-    query_embedding = get_embedding(query)
+    if query_embedding is None:
+        query_embedding = await get_embedding(query)
     
-    # Format embedding as PostgreSQL array string
-    embedding_str = "[" + ",".join(map(str, query_embedding)) + "]"
+    # Bind as a HalfVector (binary parameter, no text literal)
+    query_vector = HalfVector(query_embedding)
     
     # Search using pgvector
-    # Use CAST() instead of ::vector to avoid parameter binding issues
-    results = db.execute(
-        sa_text("""
-        SELECT id, hubspot_id, email, first_name, last_name, notes,
-               1 - (embedding <=> CAST(:query_embedding AS vector)) as similarity
-        FROM contacts
-        WHERE user_id = :user_id AND embedding IS NOT NULL
-        ORDER BY embedding <=> CAST(:query_embedding AS vector)
-        LIMIT :limit
-        """),
+    # Shortlist by binary-quantized Hamming distance, re-rank by inner product,
+    # and return the ranked rows in one round trip
+    await _prepare_vector_search(db)
+    contacts = (await db.execute(
+        _CONTACT_SEARCH,
         {
             "user_id": user_id,
-            "query_embedding": embedding_str,
-            "limit": limit
+            "query_embedding": query_vector,
+            "candidates": RERANK_CANDIDATES,
+            "limit": limit,
+            "notes_chars": CONTACT_NOTES_CHARS
         }
-    ).fetchall()
+    )).all()
     
-    # Convert to Contact objects
-    contact_ids = [r[0] for r in results]
-    contacts = db.query(Contact).filter(Contact.id.in_(contact_ids)).all()
-    
-    # Sort by similarity
-    contact_dict = {c.id: c for c in contacts}
-    return [contact_dict[cid] for cid in contact_ids if cid in contact_dict]
+    return list(contacts)
 
 
-def get_relevant_context(
-    db: Session,
+async def get_relevant_context(
     user_id: int,
     query: str,
     email_limit: int = 5,
@@ -178,8 +424,9 @@ def get_relevant_context(
     """
     Get relevant context from emails and contacts for a query.
     
+    Emails and contacts are searched concurrently, each on its own session.
+    
     Args:
-        db: Database session
         user_id: User ID
         query: Search query
         email_limit: Maximum number of emails to include
@@ -188,9 +435,15 @@ def get_relevant_context(
     Returns:
         Formatted context string for LLM
     """
-    # Search emails and contacts
-    emails = search_emails(db, user_id, query, email_limit)
-    contacts = search_contacts(db, user_id, query, contact_limit)
+    # Embed the query once; both searches use the same vector
+    query_embedding = await get_embedding(query)
+    
+    # Search emails and contacts concurrently
+    async with AsyncSessionLocal() as email_db, AsyncSessionLocal() as contact_db:
+        emails, contacts = await asyncio.gather(
+            search_emails(email_db, user_id, query, email_limit, query_embedding),
+            search_contacts(contact_db, user_id, query, contact_limit, query_embedding)
+        )
     
     # Format context
     context_parts = []
@@ -202,7 +455,7 @@ def get_relevant_context(
 From: {email.from_email}
 Subject: {email.subject}
 Date: {email.received_at}
-Body: {email.body_text[:500]}...
+Body: {email.snippet or ''}...
 """)
     
     if contacts:
@@ -213,7 +466,7 @@ Body: {email.body_text[:500]}...
 Name: {name}
 Email: {contact.email}
 Company: {contact.company or 'N/A'}
-Notes: {contact.notes[:300] if contact.notes else 'No notes'}...
+Notes: {contact.notes or 'No notes'}...
 """)
     
     return "\n".join(context_parts) if context_parts else "No relevant context found."
@@ -7,19 +7,31 @@ and database connections.
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 import uvicorn
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
-from app.database import engine, Base
+from app.database import engine, async_engine, Base
 from app.routers import auth, chat, integrations, tasks
 from app.config import settings
+from app.http_client import SHARED_CLIENT
+from app.openai_client import openai_client
+from app.services.rag_service import embedding_batcher
+from app.services.ai_agent import trigger_batches
+from app.logging_config import setup_logging
 
 # Global scheduler instance
 scheduler = AsyncIOScheduler()
 
+# Worker threads for asyncio.to_thread, which runs the AI agent's synchronous
+# database writes; sized to the sync connection pool, since extra threads
+# would only wait for a connection
+DEFAULT_EXECUTOR_WORKERS = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -27,26 +39,54 @@ async def lifespan(app: FastAPI):
     Lifespan context manager for startup and shutdown events.
     Creates database tables on startup and starts scheduled tasks.
     """
+    # Send log output through a background thread
+    log_listener = setup_logging()
+    
+    # Let every pooled connection be used by a to_thread call at once
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=DEFAULT_EXECUTOR_WORKERS))
+    
     # Create database tables
     Base.metadata.create_all(bind=engine)
     
     # Start scheduled email polling
-    # Polls every 5 minutes for new emails
+    # Polls every EMAIL_POLL_INTERVAL_SECONDS for new emails; a run that is
+    # still going when the next one is due makes the next one skip, and
+    # missed runs are collapsed into one
     from app.routers.integrations import scheduled_email_polling
+    poll_interval = settings.EMAIL_POLL_INTERVAL_SECONDS
     scheduler.add_job(
         scheduled_email_polling,
-        trigger=IntervalTrigger(seconds=20),
+        trigger=IntervalTrigger(seconds=poll_interval),
         id="email_polling",
-        replace_existing=True
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        misfire_grace_time=poll_interval
     )
     scheduler.start()
-    print("Scheduled email polling started (every 5 minutes)")
+    print(f"Scheduled email polling started (every {poll_interval} seconds)")
+    
+    # Resume ongoing-instruction batches left queued or running by the previous run
+    trigger_batches.start()
     
     yield
     
     # Shutdown scheduler on app shutdown
     scheduler.shutdown()
     print("Scheduled email polling stopped")
+    
+    # Stop waiting on ongoing-instruction batches before their clients are closed
+    # (the batches themselves keep running and are resumed on the next startup)
+    await trigger_batches.aclose()
+    
+    # Close pooled async database and HTTP connections
+    await async_engine.dispose()
+    await SHARED_CLIENT.aclose()
+    await openai_client.close()
+    await embedding_batcher.aclose()
+    
+    # Flush any queued log records
+    log_listener.stop()
 
 
 # Initialize FastAPI app
@@ -54,7 +94,8 @@ app = FastAPI(
     title="Financial Advisor AI Agent API",
     description="AI agent for Financial Advisors with Gmail, Calendar, and HubSpot integration",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse  # Serialize responses with orjson
 )
 
 # Configure CORS
@@ -88,7 +129,7 @@ async def health():
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
     """Global exception handler for unhandled errors."""
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"error": "Internal server error", "detail": str(exc)}
     )
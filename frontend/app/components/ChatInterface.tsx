@@ -26,6 +26,7 @@ export default function ChatInterface() {
   const messagesEndRef = useRef<HTMLDivElement>(null)
   const messagesContainerRef = useRef<HTMLDivElement>(null)
   const isLoadingMoreRef = useRef(false)
+  const nextCursorRef = useRef<string | null>(null)
 
   // Load initial chat history (15-20 messages)
   useEffect(() => {
@@ -55,6 +56,7 @@ export default function ChatInterface() {
         
         setMessages(historyMessages)
         setHasMoreHistory(response.data.has_more)
+        nextCursorRef.current = response.data.next_cursor
 
         // Scroll to bottom after loading history
         setTimeout(() => {
@@ -92,9 +94,9 @@ export default function ChatInterface() {
   const loadOlderMessages = useCallback(async () => {
     if (!token || !hasMoreHistory || isLoadingMoreRef.current || messages.length === 0) return
 
-    // Find the oldest message ID (first message in the array)
-    const oldestMessage = messages[0]
-    if (typeof oldestMessage.id !== 'number') return
+    // Cursor pointing just past the oldest message loaded so far
+    const beforeCursor = nextCursorRef.current
+    if (!beforeCursor) return
 
     // Store current scroll position and height before loading
     const container = messagesContainerRef.current
@@ -106,7 +108,7 @@ export default function ChatInterface() {
       const response = await axios.get(
         `${API_URL}/api/chat/history`,
         {
-          params: { limit: 20, before_id: oldestMessage.id },
+          params: { limit: 20, before_cursor: beforeCursor },
           headers: { Authorization: `Bearer ${token}` },
         }
       )
@@ -131,6 +133,7 @@ export default function ChatInterface() {
           return combined
         })
         setHasMoreHistory(response.data.has_more)
+        nextCursorRef.current = response.data.next_cursor
 
         // Restore scroll position after new content is loaded
         setTimeout(() => {
@@ -198,20 +201,11 @@ export default function ChatInterface() {
     setIsLoading(true)
 
     try {
-      // Convert messages to API format (only user and assistant messages, no temp IDs)
-      const conversationHistory = messages
-        .filter((msg) => typeof msg.id === 'number' || !msg.id.toString().startsWith('temp-'))
-        .map((msg) => ({
-          role: msg.role,
-          content: msg.content,
-        }))
-
-      // Send to API
+      // Send to API (conversation history is loaded server-side)
       const response = await axios.post(
         `${API_URL}/api/chat/`,
         {
           message: content,
-          conversation_history: conversationHistory,
         },
         {
           headers: {